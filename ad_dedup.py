@@ -0,0 +1,212 @@
+import time
+import logging
+import argparse
+from typing import Dict, Sequence
+
+import numpy as np
+import pandas as pd
+
+TEXT_COLUMNS = ['title', 'body']
+METRIC_COLUMNS = ['reach', 'impressions', 'clicks']
+KEEP_FIRST = ['image_url', 'call_to_action_type']
+
+SHINGLE_SIZE = 5
+
+
+def normalize_text(values: pd.Series) -> pd.Series:
+    """Case-fold, drop emoji and other symbols, and collapse whitespace so trivial variants compare equal."""
+    return (values.fillna('').astype(str)
+            .str.normalize('NFKC')
+            .str.casefold()
+            .str.replace(r"[^\w\s]", ' ', regex=True)
+            .str.replace(r"\s+", ' ', regex=True)
+            .str.strip())
+
+
+def text_keys(df: pd.DataFrame, columns: Sequence[str] = TEXT_COLUMNS) -> pd.Series:
+    """Fixed-width uint64 key per row from the normalized creative text."""
+    raw = df[list(columns)].fillna('').astype(str)
+    raw_keys = pd.util.hash_pandas_object(raw, index=False)
+    # Ads reuse a handful of creatives, so normalize each distinct raw text once rather than per row
+    distinct = raw[~raw_keys.duplicated()]
+    normalized = pd.DataFrame({column: normalize_text(distinct[column]) for column in columns})
+    mapping = pd.Series(pd.util.hash_pandas_object(normalized, index=False).to_numpy(),
+                        index=raw_keys[distinct.index].to_numpy())
+    return raw_keys.map(mapping)
+
+
+def _shingle_hashes(text: str, size: int = SHINGLE_SIZE) -> np.ndarray:
+    data = np.frombuffer(text.encode('utf-8'), dtype=np.uint8).astype(np.uint64)
+    if len(data) < size:
+        data = np.pad(data, (0, size - len(data)))
+    windows = np.lib.stride_tricks.sliding_window_view(data, size)
+    # Polynomial rolling hash of each character window; uint64 overflow wraps, which is what we want
+    powers = np.uint64(1099511628211) ** np.arange(size, dtype=np.uint64)
+    return np.unique(windows @ powers)
+
+
+def minhash_signatures(texts: Sequence[str], num_perm: int = 64, seed: int = 20240719) -> np.ndarray:
+    """MinHash signature (num_perm uint32 values) of each text's character shingles."""
+    # Multiply-shift hash family: odd 64-bit multipliers, seeded so signatures are reproducible
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, 2**63, num_perm, dtype=np.uint64) | np.uint64(1)
+    b = rng.integers(0, 2**63, num_perm, dtype=np.uint64)
+    signatures = np.empty((len(texts), num_perm), dtype=np.uint32)
+    with np.errstate(over='ignore'):
+        for row, text in enumerate(texts):
+            shingles = _shingle_hashes(text)
+            signatures[row] = ((shingles[:, None] * a + b) >> np.uint64(32)).min(axis=0)
+    return signatures
+
+
+def lsh_groups(signatures: np.ndarray, bands: int = 16, threshold: float = 0.8) -> np.ndarray:
+    """Group rows whose signatures collide in any LSH band and agree on at least `threshold` of positions.
+
+    Returns, for each row, the index of its group's representative (the lowest row index).
+    """
+    n, num_perm = signatures.shape
+    rows_per_band = num_perm // bands
+    parent = np.arange(n)
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for band in range(bands):
+        block = pd.DataFrame(signatures[:, band * rows_per_band:(band + 1) * rows_per_band])
+        band_keys = pd.util.hash_pandas_object(block, index=False).to_numpy()
+        order = np.argsort(band_keys, kind='stable')
+        sorted_keys = band_keys[order]
+        # Consecutive equal keys after sorting are one bucket
+        for start, stop in zip(*_runs(sorted_keys)):
+            members = order[start:stop]
+            first = members[0]
+            for other in members[1:]:
+                root_a, root_b = find(first), find(other)
+                if root_a != root_b and (signatures[first] == signatures[other]).mean() >= threshold:
+                    parent[max(root_a, root_b)] = min(root_a, root_b)
+    return np.array([find(i) for i in range(n)])
+
+
+def _runs(sorted_keys: np.ndarray):
+    """Start/stop indices of runs of two or more equal values in a sorted array."""
+    if len(sorted_keys) == 0:
+        return [], []
+    boundaries = np.flatnonzero(sorted_keys[1:] != sorted_keys[:-1]) + 1
+    starts = np.concatenate([[0], boundaries])
+    stops = np.concatenate([boundaries, [len(sorted_keys)]])
+    multi = stops - starts > 1
+    return starts[multi], stops[multi]
+
+
+def dedup_keys(df: pd.DataFrame, near_duplicates: bool = False, threshold: float = 0.8,
+               num_perm: int = 64, bands: int = 16) -> pd.Series:
+    """Group key per ad: the normalized-text hash, optionally merged across near-duplicate texts.
+
+    Ads whose text normalizes to nothing (no title or body, or only emoji) say nothing about
+    their creative, so each keeps a key of its own derived from its ad ID. MinHash/LSH only runs
+    over the distinct normalized texts, so its cost follows the number of creatives rather than
+    the number of ads.
+    """
+    keys = text_keys(df)
+    empty = keys == text_keys(pd.DataFrame({column: [''] for column in TEXT_COLUMNS})).iloc[0]
+    if near_duplicates:
+        distinct = ~keys.duplicated() & ~empty
+        texts = (normalize_text(df.loc[distinct, TEXT_COLUMNS[0]]) + ' ' + normalize_text(df.loc[distinct, TEXT_COLUMNS[1]])).tolist()
+        representatives = lsh_groups(minhash_signatures(texts, num_perm), bands, threshold)
+        distinct_keys = keys[distinct].to_numpy()
+        # Positional lookup rather than Series.map, which round-trips uint64 keys through float64
+        positions = pd.Index(distinct_keys).get_indexer(keys[~empty].to_numpy())
+        keys = keys.copy()
+        keys[~empty] = distinct_keys[representatives][positions]
+    if empty.any():
+        keys = keys.copy()
+        keys[empty] = pd.util.hash_pandas_object('no creative text: ' + df.loc[empty, 'id'].astype(str), index=False).to_numpy()
+    return keys
+
+
+def deduplicate_ads(df: pd.DataFrame, near_duplicates: bool = False, **lsh_options) -> pd.DataFrame:
+    """Sum reach/impressions/clicks across ads with the same (or, optionally, nearly the same) creative text.
+
+    Returns one row per distinct ad ID, carrying its group's text, first image URL and CTA, and
+    the group totals, plus the `dedup_key` it was grouped under.
+    """
+    keys = dedup_keys(df, near_duplicates, **lsh_options).rename('dedup_key')
+    metrics = df[METRIC_COLUMNS].apply(pd.to_numeric, errors='coerce').fillna(0)
+    totals = metrics.groupby(keys.to_numpy()).transform('sum')
+    firsts = df[TEXT_COLUMNS + KEEP_FIRST].groupby(keys.to_numpy()).transform('first')
+    deduplicated = pd.concat([firsts[TEXT_COLUMNS], df[['id']], firsts[KEEP_FIRST], totals, keys], axis=1)
+    return deduplicated.drop_duplicates(subset=['dedup_key', 'id']).reset_index(drop=True)
+
+
+def _groupby_reference(df: pd.DataFrame) -> pd.DataFrame:
+    """The original groupby on raw body/title with list(set(ids)) and explode."""
+    grouped = df.groupby(['body', 'title'])
+    deduplicated = grouped.agg({
+        'id': lambda x: list(set(x)),
+        'image_url': 'first',
+        'call_to_action_type': 'first',
+        'reach': 'sum',
+        'impressions': 'sum',
+        'clicks': 'sum'
+    }).reset_index()
+    return deduplicated.explode('id')
+
+
+def _synthetic_ads(ads: int, creatives: int, seed: int = 7) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    words = np.array("join the study today find out more about clinical research near you eligible adults "
+                     "heart health trial paid travel support learn if you qualify".split())
+    bodies = [' '.join(rng.choice(words, 25)) for _ in range(creatives)]
+    titles = [' '.join(rng.choice(words, 5)).title() for _ in range(creatives)]
+    creative = rng.integers(0, creatives, ads)
+    variant = rng.integers(0, 5, ads)
+    body = np.array(bodies, dtype=object)[creative]
+    # Trivial variants (shouting, doubled spaces, a trailing emoji) and one reworded ending
+    body = np.where(variant == 1, np.char.upper(body.astype(str)).astype(object), body)
+    body = np.where(variant == 2, [text.replace(' ', '  ') for text in body], body)
+    body = np.where(variant == 3, [f"{text} \U0001F49A" for text in body], body)
+    body = np.where(variant == 4, [f"{text} apply now" for text in body], body)
+    return pd.DataFrame({
+        'id': [f"2385{i:08d}" for i in range(ads)],
+        'title': np.array(titles, dtype=object)[creative],
+        'body': body,
+        'image_url': [f"https://img.example/{c}.png" for c in creative],
+        'call_to_action_type': 'LEARN_MORE',
+        'reach': rng.integers(0, 5000, ads).astype(str),
+        'impressions': rng.integers(0, 20000, ads).astype(str),
+        'clicks': rng.integers(0, 300, ads).astype(str),
+    })
+
+
+def benchmark(ads: int = 300000, creatives: int = 2000) -> Dict:
+    """Time the raw-text groupby against the hash index, with and without near-duplicate grouping."""
+    df = _synthetic_ads(ads, creatives)
+    for column in METRIC_COLUMNS:
+        df[column] = pd.to_numeric(df[column])
+    report = {'ads': ads, 'creatives': creatives}
+    for name, run in (('groupby_raw_text', lambda: _groupby_reference(df)),
+                      ('hash_index', lambda: deduplicate_ads(df)),
+                      ('hash_index_near', lambda: deduplicate_ads(df, near_duplicates=True))):
+        start = time.perf_counter()
+        result = run()
+        groups = result['dedup_key'].nunique() if 'dedup_key' in result else len(result[['body', 'title']].drop_duplicates())
+        report[name] = {'seconds': round(time.perf_counter() - start, 2), 'rows': len(result), 'groups': groups}
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Hash-based ad deduplication with optional MinHash/LSH near-duplicate grouping.")
+    parser.add_argument('--benchmark', action='store_true', help="Deduplicate synthetic ads with trivial text variants")
+    parser.add_argument('--ads', type=int, default=300000)
+    parser.add_argument('--creatives', type=int, default=2000)
+    args = parser.parse_args()
+
+    if args.benchmark:
+        logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+        for key, value in benchmark(args.ads, args.creatives).items():
+            print(f"{key}: {value}")
+    else:
+        parser.print_help()
@@ -0,0 +1,247 @@
+import os
+import json
+import shutil
+import logging
+import argparse
+import configparser
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+import pandas as pd
+
+from incremental_extract import FULL_REFRESH_ENV, changed_rows_query
+from snowflake_client import fetch_dataframe, pooled_connection, read_sql_file
+
+SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
+FACT_DIR = os.path.join(SCRIPT_DIR, '.ad_facts')
+# Partition used when a source has no date column: it is simply replaced on every run
+UNDATED = 'all'
+
+MILESTONE_COLUMNS = {
+    ('VALUE', 'Sessions'): 'sessions',
+    ('VALUE', 'Referrals'): 'referrals',
+    ('BAA_VALUE', 'Sessions'): 'baa_sessions',
+    ('BAA_VALUE', 'Referrals'): 'baa_referrals',
+}
+# Only additive insights are stored: reach counts unique people, so daily reach can't be summed
+INSIGHT_COLUMNS = ['impressions', 'clicks']
+
+
+def pivot_milestones(df: pd.DataFrame) -> pd.DataFrame:
+    """Per-ad sessions/referrals (and their B/AA counts) from Snowflake milestone rows, indexed by CONTENT."""
+    values = [column for column in ('VALUE', 'BAA_VALUE') if column in df.columns]
+    numeric = df[['CONTENT', 'MILESTONE']].assign(**{column: pd.to_numeric(df[column], errors='coerce') for column in values})
+    pivoted = numeric.pivot_table(values=values, index='CONTENT', columns='MILESTONE', aggfunc='sum')
+    pivoted.columns = [MILESTONE_COLUMNS.get(column, '_'.join(column)) for column in pivoted.columns]
+    return pivoted.reindex(columns=list(MILESTONE_COLUMNS.values()), fill_value=0).fillna(0)
+
+
+def sum_insights(df: pd.DataFrame) -> pd.DataFrame:
+    """Per-ad totals of daily insights rows, indexed by ad_id."""
+    numeric = df.reindex(columns=INSIGHT_COLUMNS).apply(pd.to_numeric, errors='coerce').fillna(0)
+    return numeric.groupby(df['ad_id']).sum()
+
+
+TABLES = {
+    'milestones': {'key': 'CONTENT', 'aggregate': pivot_milestones},
+    'insights': {'key': 'ad_id', 'aggregate': sum_insights},
+}
+
+
+class AdFactStore:
+    """Date-partitioned Parquet store of ad facts with incrementally maintained per-ad aggregates.
+
+    Each table lives under `<root>/<table>/date=YYYY-MM-DD/part.parquet` next to an
+    `<table>.aggregate.parquet` holding its per-ad totals. Appending a refetched window replaces
+    the partitions in that window and adjusts the totals by (new window - old window), so the
+    rest of the history is never re-read.
+    """
+
+    def __init__(self, root: str = FACT_DIR):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _state_path(self) -> str:
+        return os.path.join(self.root, 'state.json')
+
+    def load_state(self) -> Dict:
+        try:
+            with open(self._state_path()) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_state(self, state: Dict):
+        with open(f"{self._state_path()}.tmp", 'w') as f:
+            json.dump(state, f, indent=2)
+        os.replace(f"{self._state_path()}.tmp", self._state_path())
+
+    def _table_dir(self, table: str) -> str:
+        return os.path.join(self.root, table)
+
+    def _aggregate_path(self, table: str) -> str:
+        return os.path.join(self.root, f"{table}.aggregate.parquet")
+
+    def partitions(self, table: str) -> List[str]:
+        table_dir = self._table_dir(table)
+        if not os.path.isdir(table_dir):
+            return []
+        return sorted(name.split('=', 1)[1] for name in os.listdir(table_dir) if name.startswith('date='))
+
+    def _read_partitions(self, table: str, dates: List[str]) -> pd.DataFrame:
+        frames = [pd.read_parquet(os.path.join(self._table_dir(table), f"date={day}", 'part.parquet')) for day in dates]
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+    def aggregate(self, table: str) -> pd.DataFrame:
+        path = self._aggregate_path(table)
+        return pd.read_parquet(path) if os.path.exists(path) else pd.DataFrame()
+
+    def append(self, table: str, df: pd.DataFrame, date_column: Optional[str], since: Optional[str] = None) -> Dict:
+        """Replace every partition from `since` on (all of them if None) with `df`, and update the aggregate."""
+        spec = TABLES[table]
+        if date_column and date_column in df.columns:
+            days = pd.to_datetime(df[date_column]).dt.strftime('%Y-%m-%d')
+        else:
+            # No date to partition on: the fetch was a full one, so it replaces everything
+            days, since = pd.Series(UNDATED, index=df.index), None
+        replaced = [day for day in self.partitions(table) if since is None or day == UNDATED or day >= since]
+        old = self._read_partitions(table, replaced)
+
+        aggregate = self.aggregate(table) if since is not None else pd.DataFrame()
+        new_totals = spec['aggregate'](df) if len(df) else pd.DataFrame()
+        if len(old) and len(aggregate):
+            aggregate = aggregate.sub(spec['aggregate'](old), fill_value=0)
+        aggregate = aggregate.add(new_totals, fill_value=0) if len(aggregate) else new_totals
+        aggregate = aggregate[(aggregate != 0).any(axis=1)] if len(aggregate) else aggregate
+
+        for day in replaced:
+            shutil.rmtree(os.path.join(self._table_dir(table), f"date={day}"))
+        for day, rows in df.groupby(days):
+            partition = os.path.join(self._table_dir(table), f"date={day}")
+            os.makedirs(partition, exist_ok=True)
+            rows.to_parquet(os.path.join(partition, 'part.parquet'), index=False)
+        aggregate.index.name = spec['key']
+        aggregate.to_parquet(f"{self._aggregate_path(table)}.tmp")
+        os.replace(f"{self._aggregate_path(table)}.tmp", self._aggregate_path(table))
+
+        state = self.load_state()
+        previous = state.get(table, {}) if since else {}
+        dated = days[days != UNDATED]
+        watermarks = [day for day in (dated.max() if len(dated) else None, previous.get('watermark')) if day]
+        state[table] = {
+            'watermark': max(watermarks) if watermarks else None,
+            'updated_at': datetime.now().isoformat(),
+            'last_full_refresh': previous.get('last_full_refresh') or datetime.now().isoformat(),
+        }
+        self._save_state(state)
+        return {'rows': len(df), 'replaced_partitions': len(replaced), 'ads': len(aggregate)}
+
+    def refresh(self, table: str, fetch: Callable[[Optional[str]], pd.DataFrame], date_column: Optional[str],
+                lookback_days: int = 3, full_refresh_days: int = 7, force_full: bool = False) -> Dict:
+        """Fetch the rows since the watermark (less a lookback for late updates) and append them.
+
+        `fetch(since)` gets a YYYY-MM-DD string, or None when a full history is needed: on the
+        first run, after `full_refresh_days`, or when `force_full` or EXTRACT_FULL_REFRESH=1 asks.
+        """
+        table_state = self.load_state().get(table, {})
+        since = None
+        last_full = table_state.get('last_full_refresh')
+        force_full = force_full or os.getenv(FULL_REFRESH_ENV, '') not in ('', '0')
+        if (table_state.get('watermark') and last_full and not force_full
+                and datetime.now() - datetime.fromisoformat(last_full) < timedelta(days=full_refresh_days)):
+            since = (date.fromisoformat(table_state['watermark']) - timedelta(days=lookback_days)).isoformat()
+        result = self.append(table, fetch(since), date_column, since)
+        logging.info(f"{table}: {'incremental from ' + since if since else 'full refresh'}, {result}")
+        return result
+
+    def window(self, table: str, since: str, until: str) -> pd.DataFrame:
+        """Per-ad totals over the partitions dated `since` to `until` (YYYY-MM-DD, inclusive)."""
+        days = [day for day in self.partitions(table) if day != UNDATED and since <= day <= until]
+        rows = self._read_partitions(table, days)
+        return TABLES[table]['aggregate'](rows) if len(rows) else pd.DataFrame()
+
+    def latest(self, insights_since: Optional[str] = None, insights_until: Optional[str] = None) -> pd.DataFrame:
+        """Per-ad milestone totals with their insights totals, indexed by ad ID. A cheap read.
+
+        Insights are lifetime totals unless `insights_since` (and optionally `insights_until`)
+        restrict them to a date window, read from the daily partitions. Like the renderers'
+        merge, ads are those with Snowflake milestone rows.
+        """
+        milestones = self.aggregate('milestones')
+        if insights_since:
+            insights = self.window('insights', insights_since, insights_until or date.today().isoformat())
+        else:
+            insights = self.aggregate('insights')
+        combined = milestones.join(insights, how='left') if len(insights) else milestones
+        combined.index.name = 'id'
+        return combined.reindex(columns=list(MILESTONE_COLUMNS.values()) + INSIGHT_COLUMNS).fillna(0)
+
+
+def fetch_milestones(config: configparser.ConfigParser, sql_file_path: str, date_column: str,
+                     since: Optional[str]) -> pd.DataFrame:
+    """Run the Facebook milestone extract, restricted to rows on or after `since` when given."""
+    query = read_sql_file(sql_file_path)
+    with pooled_connection(config) as conn:
+        if since is None:
+            return fetch_dataframe(conn, query)
+        try:
+            return fetch_dataframe(conn, changed_rows_query(query, [date_column]), [since])
+        except Exception as e:
+            # The extract has no such column: fall back to the whole result, stored undated
+            logging.warning(f"Incremental milestone query failed ({e}); fetching everything")
+            return fetch_dataframe(conn, query)
+
+
+def self_test() -> Dict:
+    """Feed a store day by day from synthetic sources and check the aggregates match a full recompute."""
+    import tempfile
+
+    days = list(pd.date_range('2024-07-01', periods=20).strftime('%Y-%m-%d'))
+    n = 40 * len(days)
+    milestones = pd.DataFrame({
+        'CONTENT': [f"ad{i % 7}" for i in range(n)],
+        'MILESTONE': ['Sessions' if i % 3 else 'Referrals' for i in range(n)],
+        'DATE': [days[i % len(days)] for i in range(n)],
+        'VALUE': [(i * 7) % 11 for i in range(n)],
+        'BAA_VALUE': [(i * 3) % 5 for i in range(n)],
+    })
+    insights = pd.DataFrame({
+        'ad_id': [f"ad{i % 7}" for i in range(len(days) * 7)],
+        'date': [days[i // 7] for i in range(len(days) * 7)],
+        'reach': [str(i % 13) for i in range(len(days) * 7)],
+        'impressions': [str(i % 17 * 10) for i in range(len(days) * 7)],
+        'clicks': [str(i % 5) for i in range(len(days) * 7)],
+    })
+    with tempfile.TemporaryDirectory() as root:
+        store = AdFactStore(root)
+        for end in range(5, len(days) + 1, 5):
+            visible = days[:end]
+            # A late correction inside the lookback window on every run
+            milestones.loc[milestones['DATE'] == visible[-2], 'VALUE'] += 1
+            store.refresh('milestones', lambda since: milestones[milestones['DATE'].isin(visible)
+                                                                 & (milestones['DATE'] >= (since or ''))], 'DATE')
+            store.refresh('insights', lambda since: insights[insights['date'].isin(visible)
+                                                             & (insights['date'] >= (since or ''))], 'date')
+        expected = pivot_milestones(milestones).join(sum_insights(insights), how='left').fillna(0)
+        latest = store.latest()
+        in_window = insights[insights['date'].between(days[5], days[11])]
+        windowed = store.latest(days[5], days[11])[INSIGHT_COLUMNS].sort_index()
+        expected_window = sum_insights(in_window).reindex(windowed.index).fillna(0)
+        return {
+            'partitions': len(store.partitions('milestones')),
+            'ads': len(latest),
+            'matches_full_recompute': bool(((latest.sort_index() - expected[latest.columns].sort_index()).abs() < 1e-9).all().all()),
+            'window_matches': bool(((windowed - expected_window).abs() < 1e-9).all().all()),
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Date-partitioned Facebook/Snowflake ad fact store.")
+    parser.add_argument('--self-test', action='store_true', help="Check incremental aggregates against a full recompute")
+    args = parser.parse_args()
+
+    if args.self_test:
+        logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+        print(self_test())
+    else:
+        parser.print_help()
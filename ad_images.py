@@ -0,0 +1,218 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
+from io import BytesIO
+from typing import Dict, Iterable, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from PIL import Image
+
+SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
+CACHE_DIR = os.path.join(SCRIPT_DIR, '.ad_image_cache')
+PLACEHOLDER_URL = 'https://www.nomadfoods.com/wp-content/uploads/2018/08/placeholder-1-e1533569576673-1500x1500.png'
+
+
+class ImageCache:
+    """On-disk cache of ad creatives keyed by a hash of the image URL.
+
+    Images are stored already decoded and downscaled to fit `max_px`, next to a small JSON
+    file holding the ETag/Last-Modified validators. Entries younger than `max_age` seconds are
+    served without touching the network; older ones are revalidated with a conditional GET.
+    """
+
+    def __init__(self, cache_dir: str = CACHE_DIR, max_px: int = 600, max_age: float = 7 * 24 * 3600,
+                 max_workers: int = 8, timeout: float = 20):
+        self.cache_dir = cache_dir
+        self.max_px = max_px
+        self.max_age = max_age
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max_workers)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.stats = {'hits': 0, 'downloaded': 0, 'revalidated': 0, 'failed': 0}
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _paths(self, url: str):
+        key = hashlib.sha256(url.encode()).hexdigest()
+        return os.path.join(self.cache_dir, f"{key}.png"), os.path.join(self.cache_dir, f"{key}.json")
+
+    def _count(self, outcome: str):
+        with self._lock:
+            self.stats[outcome] += 1
+
+    def _load_meta(self, url: str) -> Optional[Dict]:
+        image_path, meta_path = self._paths(url)
+        if not os.path.exists(image_path):
+            return None
+        try:
+            with open(meta_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _save_meta(self, url: str, meta: Dict):
+        _, meta_path = self._paths(url)
+        with open(f"{meta_path}.tmp", 'w') as f:
+            json.dump(meta, f)
+        os.replace(f"{meta_path}.tmp", meta_path)
+
+    def _store(self, url: str, content: bytes):
+        image = Image.open(BytesIO(content))
+        image.thumbnail((self.max_px, self.max_px))
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA')
+        image_path, _ = self._paths(url)
+        # Written under a unique name so concurrent renders never read a half-written file
+        tmp_path = f"{image_path}.{threading.get_ident()}.tmp"
+        image.save(tmp_path, format='PNG')
+        os.replace(tmp_path, image_path)
+
+    def fetch(self, url: str) -> bool:
+        """Make sure `url` is cached, hitting the network only if the entry is missing or stale."""
+        meta = self._load_meta(url)
+        if meta and time.time() - meta['fetched_at'] < self.max_age:
+            self._count('hits')
+            return True
+
+        headers = {}
+        if meta:
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+        try:
+            response = self.session.get(url, headers=headers, timeout=self.timeout)
+            if meta and response.status_code == 304:
+                meta['fetched_at'] = time.time()
+                self._save_meta(url, meta)
+                self._count('revalidated')
+                return True
+            response.raise_for_status()
+            self._store(url, response.content)
+        except Exception as e:
+            logging.warning(f"Could not fetch image {url}: {e}")
+            self._count('failed')
+            # A stale copy is still better than no image
+            return meta is not None
+        self._save_meta(url, {
+            'url': url,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'fetched_at': time.time(),
+        })
+        self._count('downloaded')
+        return True
+
+    def prefetch(self, urls: Iterable[str]) -> Dict[str, bool]:
+        """Fetch every distinct URL concurrently; returns whether each one is available from the cache."""
+        urls = list(dict.fromkeys(url for url in urls if url))
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return dict(zip(urls, executor.map(self.fetch, urls)))
+
+    def image_path(self, url: str) -> Optional[str]:
+        """Path of the cached thumbnail for `url`, for readers in other processes."""
+        image_path, _ = self._paths(url)
+        return image_path if os.path.exists(image_path) else None
+
+    def load(self, url: str) -> Optional[Image.Image]:
+        """Open the cached thumbnail for `url`, or None if it was never fetched successfully."""
+        image_path, _ = self._paths(url)
+        try:
+            with Image.open(image_path) as image:
+                image.load()
+                return image
+        except OSError:
+            return None
+
+
+def _stand_in_server(images: Dict[str, bytes]):
+    """Local image host answering conditional GETs, counting requests and 304s."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    stats = {'requests': 0, 'not_modified': 0}
+    lock = threading.Lock()
+    last_modified = formatdate(time.time() - 3600, usegmt=True)
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            content = images.get(self.path)
+            etag = f'"{hashlib.md5(content).hexdigest()}"' if content else None
+            with lock:
+                stats['requests'] += 1
+                if content and self.headers.get('If-None-Match') == etag:
+                    stats['not_modified'] += 1
+            if content is None:
+                self.send_response(404)
+                self.end_headers()
+                return
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/png')
+            self.send_header('Content-Length', str(len(content)))
+            self.send_header('ETag', etag)
+            self.send_header('Last-Modified', last_modified)
+            self.end_headers()
+            self.wfile.write(content)
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, stats
+
+
+def self_test(count: int = 50, size_px: int = 1500) -> Dict:
+    """Prefetch generated creatives cold, warm and after expiry against a local image host."""
+    import tempfile
+
+    images = {}
+    for i in range(count):
+        buffer = BytesIO()
+        Image.new('RGB', (size_px, size_px), ((i * 5) % 256, 80, 160)).save(buffer, format='PNG')
+        images[f"/creative_{i}.png"] = buffer.getvalue()
+
+    server, stats = _stand_in_server(images)
+    urls = [f"http://127.0.0.1:{server.server_address[1]}{path}" for path in images]
+    report = {}
+    try:
+        with tempfile.TemporaryDirectory() as cache_dir:
+            for run, max_age in (('cold', 3600), ('warm', 3600), ('expired', 0)):
+                before = stats['requests']
+                cache = ImageCache(cache_dir, max_age=max_age)
+                start = time.perf_counter()
+                available = cache.prefetch(urls)
+                report[run] = {'available': sum(available.values()), 'network_requests': stats['requests'] - before,
+                               **cache.stats, 'seconds': round(time.perf_counter() - start, 2)}
+            report['thumbnail_size'] = cache.load(urls[0]).size
+            report['not_modified'] = stats['not_modified']
+    finally:
+        server.shutdown()
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Content-addressed cache of ad creative thumbnails.")
+    parser.add_argument('--self-test', action='store_true', help="Prefetch generated images from a local stand-in host")
+    parser.add_argument('--count', type=int, default=50)
+    args = parser.parse_args()
+
+    if args.self_test:
+        logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+        for key, value in self_test(args.count).items():
+            print(f"{key}: {value}")
+    else:
+        parser.print_help()
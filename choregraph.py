@@ -0,0 +1,681 @@
+import os
+import json
+import time
+import uuid
+import logging
+import argparse
+import configparser
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from snowflake_client import fetch_dataframe, load_config, pooled_connection, run_queries_async
+
+SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
+PROFILE_DIR = os.path.join(SCRIPT_DIR, '.choregraph_profiles')
+SCHEMA_CATALOG_PATH = os.path.join(PROFILE_DIR, 'schema.json')
+# How long a cached schema is trusted before LAST_ALTERED is checked again
+SCHEMA_CHECK_SECONDS = 6 * 3600
+
+VIEW_SCHEMA = 'PROD_US9_PAR_RPR'
+VIEW_NAME = 'PRSP_LGM_RPT_USER_V'
+VIEW = f"{VIEW_SCHEMA}.{VIEW_NAME}"
+AILMENT_PREFIX = 'AILMENT2_'
+
+# Profile categories, by column prefix, with their chart titles
+CATEGORIES = {
+    'TREATMENT2_': 'Treatment Preferences',
+    'SURVEY_HOBBY_': 'Hobbies & Activities',
+    'SURVEY_MUSIC_': 'Musical Tastes',
+    'SURVEY_OWN_': 'Owned Items',
+    'SURVEY_OCCUPATION_': 'Occupations',
+    'SURVEY_COLLECTIBLES_': 'Collectables',
+    'SURVEY_CREDIT_CARDS_': 'Credit Cards',
+    'SURVEY_DIET_CONCERNS_': 'Diet Concerns',
+    'SURVEY_MAIL_ORDER_': 'Mail Order',
+    'SURVEY_INVESTMENTS_': 'Investments',
+    'SURVEY_READING_': 'Reading Preferences',
+    'SURVEY_DONOR_': 'Donor Preferences',
+    'SURVEY_SPORTING_': 'Sporting Preferences',
+    'SURVEY_TRAVEL_': 'Travel Preferences',
+    'SURVEY_ELECTRONICS_': 'Electronics Preferences',
+    'SURVEY_PURCHASE_': 'Purchase Preferences',
+    'SURVEY_GROUP_': 'Group Preferences',
+    'BUYER_RETAIL_': 'Retail Preferences',
+}
+
+# Widest SELECT list the planner emits before splitting a profile into several queries
+MAX_QUERY_COLUMNS = 1000
+# Prefix of the temporary table a split live profile samples into, so every one of its queries reads the
+# same rows; each profile adds its own suffix, as concurrent profiles can share one session
+SAMPLE_TABLE_PREFIX = 'CHOREGRAPH_SAMPLE'
+# Ailments with more matching rows than this use block sampling, which skips whole micro-partitions
+BLOCK_SAMPLING_ROWS = 5_000_000
+# Two-sided 95% normal quantile for the confidence intervals
+Z_95 = 1.959963984540054
+# Every profile query carries these besides the category sums
+DEMOGRAPHIC_COLUMNS = ['GENDER', 'APPROX_AGE', 'USERS']
+
+# Constants rather than bind parameters, so it runs on sessions with any paramstyle
+COLUMNS_QUERY = f'''
+    SELECT column_name
+    FROM information_schema.columns
+    WHERE table_schema = '{VIEW_SCHEMA}' AND table_name = '{VIEW_NAME}'
+    ORDER BY ordinal_position
+'''
+LAST_ALTERED_QUERY = f'''
+    SELECT last_altered
+    FROM information_schema.tables
+    WHERE table_schema = '{VIEW_SCHEMA}' AND table_name = '{VIEW_NAME}'
+'''
+
+
+def approx_age_sql() -> str:
+    now = datetime.now()
+    return f"({now.year} - DATE_OF_BIRTH_YEAR) - ({now.month} - DATE_OF_BIRTH_MONTH_) / 12"
+
+
+def columns_by_prefix(columns: List[str], prefixes=CATEGORIES) -> Dict[str, List[str]]:
+    """The view's columns for each category prefix, in view order."""
+    return {prefix: [column for column in columns if column.startswith(prefix)] for prefix in prefixes}
+
+
+class SamplingPlan:
+    """How a live profile samples an ailment's rows: 'full' (no sampling), 'bernoulli' (rows) or 'block'.
+
+    Sampling is applied to the view before the ailment filter, so `percent` is the share of the
+    ailment's rows expected in the sample. Snowflake takes no SEED when sampling a view, so each
+    sample is a fresh draw; a profile split over several queries samples once into a temporary table.
+    """
+
+    def __init__(self, method: str, percent: float = 100.0, total_rows: int = 0):
+        self.method = method
+        self.percent = percent
+        self.total_rows = total_rows
+
+    @property
+    def sampled(self) -> bool:
+        return self.method != 'full'
+
+    @property
+    def intervals(self) -> bool:
+        """Whether confidence intervals hold: block samples take whole micro-partitions, so their rows are clustered."""
+        return self.method == 'bernoulli'
+
+    @property
+    def expected_rows(self) -> int:
+        return round(self.total_rows * self.percent / 100)
+
+    def clause(self) -> str:
+        if not self.sampled:
+            return ''
+        kind = 'SYSTEM' if self.method == 'block' else 'BERNOULLI'
+        return f" SAMPLE {kind} ({self.percent:.6g})"
+
+    def describe(self) -> str:
+        if not self.sampled:
+            return f"full scan of {self.total_rows:,} rows"
+        return f"{self.method} sample of ~{self.expected_rows:,} rows ({self.percent:.3g}%)"
+
+
+def choose_sampling(total_rows: int, sample_size: int, block_rows: int = BLOCK_SAMPLING_ROWS) -> SamplingPlan:
+    """Pick the sampling method from the ailment's size, never sorting the matching rows.
+
+    Ailments no bigger than the sample are read in full; larger ones get a Bernoulli row
+    sample, and the largest a block sample sized for the same expected number of rows.
+    """
+    if total_rows <= sample_size:
+        return SamplingPlan('full', total_rows=total_rows)
+    percent = 100.0 * sample_size / total_rows
+    return SamplingPlan('block' if total_rows > block_rows else 'bernoulli', percent, total_rows)
+
+
+def share_interval(counts, users: float, cross_counts, squared_total: float, z: float = Z_95):
+    """Delta-method interval for each column's share of a category's flags, estimated over sampled users.
+
+    A share is the ratio of two per-user means, a column's flag x and the user's flag total T, so
+    its variance is Var(x - share * T) / (users * mean(T)^2). `cross_counts` is each column's sum
+    of x * T over users and `squared_total` the sum of T^2, which give that variance without the
+    per-user rows. Bounds are clipped to [0, 1].
+    """
+    counts, cross_counts = np.asarray(counts, dtype=float), np.asarray(cross_counts, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        share = counts / counts.sum()
+        flag_rate, mean_total = counts / users, counts.sum() / users
+        covariance = cross_counts / users - flag_rate * mean_total
+        total_variance = squared_total / users - mean_total ** 2
+        variance = flag_rate * (1 - flag_rate) - 2 * share * covariance + share ** 2 * total_variance
+        half_width = z * np.sqrt(np.maximum(variance, 0) / users) / mean_total
+    return np.clip(share - half_width, 0, 1), np.clip(share + half_width, 0, 1)
+
+
+def category_proportions(counts: pd.Series, category_prefix: str, users: Optional[float] = None,
+                         cross_counts: Optional[pd.Series] = None, squared_total: Optional[float] = None) -> pd.DataFrame:
+    """Category/Proportion rows for one chart from per-column 'Y' counts, zero proportions dropped.
+
+    With `users` (the sampled user count) and the flag-total moments of a sampled profile (see
+    share_interval) Lower/Upper hold a 95% confidence interval; without them they equal the proportion.
+    """
+    counts = counts.astype(float)
+    total = counts.sum()
+    df = (counts / total if total else counts).rename_axis('Category').reset_index(name='Proportion')
+    df['Category'] = df['Category'].str.replace(category_prefix, '').str.replace('_', ' ')
+    if users and total and cross_counts is not None:
+        df['Lower'], df['Upper'] = share_interval(counts, users, cross_counts.reindex(counts.index), squared_total)
+    else:
+        df['Lower'] = df['Upper'] = df['Proportion']
+    return df[df['Proportion'] != 0].reset_index(drop=True)
+
+
+def plan_profile_queries(prefix_columns: Dict[str, List[str]], max_columns: int = MAX_QUERY_COLUMNS) -> List[List[str]]:
+    """Pack every category's columns into as few SELECT lists as `max_columns` allows.
+
+    A category is kept within one query when it fits; one wider than the limit on its own is
+    split across queries. There is always at least one (possibly empty) list.
+    """
+    budget = max(max_columns - len(DEMOGRAPHIC_COLUMNS), 1)
+    plans, current = [], []
+    for columns in prefix_columns.values():
+        if current and len(current) + len(columns) > budget:
+            plans.append(current)
+            current = []
+        for column in columns:
+            current.append(column)
+            if len(current) == budget:
+                plans.append(current)
+                current = []
+    if current or not plans:
+        plans.append(current)
+    return plans
+
+
+def _flag_sums(columns: Sequence[str]) -> str:
+    return ''.join(f",\n            SUM(CASE WHEN {column} = 'Y' THEN 1 ELSE 0 END) AS {column}" for column in columns)
+
+
+def _flag_total(prefix: str) -> str:
+    return f"FLAG_TOTAL__{prefix}"
+
+
+def _with_flag_totals(source: str, moment_categories: Dict[str, List[str]]) -> str:
+    """Add each user's flag total T per category to the sampled rows."""
+    totals = [' + '.join(f"CASE WHEN {column} = 'Y' THEN 1 ELSE 0 END" for column in columns)
+              + f" AS {_flag_total(prefix)}" for prefix, columns in moment_categories.items()]
+    return f"(SELECT *, {', '.join(totals)} FROM {source})"
+
+
+def _moment_sums(moment_categories: Dict[str, List[str]]) -> str:
+    """Per category, the sum over users of T^2 and of each column's flag times T."""
+    sums = []
+    for prefix, columns in moment_categories.items():
+        total = _flag_total(prefix)
+        sums.append(f"SUM({total} * {total}) AS SQUARED__{prefix}")
+        sums += [f"SUM(CASE WHEN {column} = 'Y' THEN {total} ELSE 0 END) AS CROSS__{column}" for column in columns]
+    return ''.join(f",\n            {sql}" for sql in sums)
+
+
+def _sampled_rows(ailment: str, category_columns: List[str], sampling: SamplingPlan) -> str:
+    selected = ''.join(f", {column}" for column in category_columns)
+    return (f"SELECT GENDER, DATE_OF_BIRTH_YEAR, DATE_OF_BIRTH_MONTH_{selected}\n"
+            f"             FROM {VIEW}{sampling.clause()}\n"
+            f"             WHERE {AILMENT_PREFIX}{ailment} = 'Y'")
+
+
+def sample_table_query(table: str, ailment: str, category_columns: List[str], sampling: SamplingPlan) -> str:
+    """Draw an ailment's sample once into a temporary `table`, for a profile whose columns span several queries."""
+    return f"CREATE TEMPORARY TABLE {table} AS {_sampled_rows(ailment, category_columns, sampling)}"
+
+
+def sampled_profile_query(ailment: str, category_columns: List[str], sampling: SamplingPlan,
+                          source: Optional[str] = None,
+                          moment_categories: Optional[Dict[str, List[str]]] = None) -> str:
+    """One sampled scan for an ailment: users and mean age per gender plus the 'Y' count of each category column.
+
+    `source` is a table already holding the ailment's sampled rows; without it the view is sampled inline.
+    `moment_categories` (prefix -> every column of that category, all in this query) adds the
+    flag-total moments their confidence intervals are computed from.
+    """
+    source = source or f"({_sampled_rows(ailment, category_columns, sampling)}\n            )"
+    if moment_categories:
+        source = _with_flag_totals(source, moment_categories)
+    return f'''
+        SELECT
+            GENDER,
+            AVG({approx_age_sql()}) AS APPROX_AGE,
+            COUNT(*) AS USERS{_flag_sums(category_columns)}{_moment_sums(moment_categories or {})}
+        FROM
+            {source}
+        GROUP BY GENDER
+        ORDER BY GENDER
+    '''
+
+
+def profile_query(ailment_columns: List[str], category_columns: List[str]) -> str:
+    """One scan of the view: per ailment and gender, users, mean age and the 'Y' count of every category column.
+
+    Ailment flags are unpivoted, so every ailment is profiled in the same pass.
+    """
+    return f'''
+        SELECT
+            REGEXP_REPLACE(AILMENT, '^{AILMENT_PREFIX}', '') AS AILMENT,
+            GENDER,
+            AVG({approx_age_sql()}) AS APPROX_AGE,
+            COUNT(*) AS USERS{_flag_sums(category_columns)}
+        FROM
+            (SELECT GENDER, DATE_OF_BIRTH_YEAR, DATE_OF_BIRTH_MONTH_, {", ".join(ailment_columns + category_columns)}
+             FROM {VIEW})
+            UNPIVOT (FLAG FOR AILMENT IN ({", ".join(ailment_columns)}))
+        WHERE FLAG = 'Y'
+        GROUP BY 1, 2
+    '''
+
+
+def merge_query_results(frames: List[pd.DataFrame], keys: List[str]) -> pd.DataFrame:
+    """Join the results of a split plan side by side on their group keys (demographics from the first)."""
+    merged = frames[0]
+    for frame in frames[1:]:
+        extra = [column for column in frame.columns if column not in merged.columns]
+        merged = merged.merge(frame[keys + extra], on=keys, how='outer')
+    return merged
+
+
+def fan_out(profile_rows: pd.DataFrame, prefix_columns: Dict[str, List[str]],
+            intervals: bool = False) -> Tuple[pd.DataFrame, Dict[str, pd.DataFrame]]:
+    """Split one profile result into the gender/age frame and a Category/Proportion frame per category.
+
+    With `intervals`, categories whose flag-total moments were queried carry confidence intervals
+    over the profile's sampled users.
+    """
+    age = pd.DataFrame({'gender': profile_rows['GENDER'].to_numpy(), 'approx_age': profile_rows['APPROX_AGE'].to_numpy(),
+                        'count': profile_rows['USERS'].to_numpy()})
+    totals = profile_rows.drop(columns=DEMOGRAPHIC_COLUMNS).apply(pd.to_numeric, errors='coerce').fillna(0).sum()
+    users = float(pd.to_numeric(profile_rows['USERS']).sum())
+    categories = {}
+    for prefix, columns in prefix_columns.items():
+        counts = totals.reindex(columns, fill_value=0)
+        if intervals and f"SQUARED__{prefix}" in totals:
+            cross_counts = totals.reindex([f"CROSS__{column}" for column in columns]).set_axis(columns)
+            categories[prefix] = category_proportions(counts, prefix, users, cross_counts, totals[f"SQUARED__{prefix}"])
+        else:
+            categories[prefix] = category_proportions(counts, prefix)
+    return age, categories
+
+
+class SchemaCatalog:
+    """Local catalog of PRSP_LGM_RPT_USER_V's columns: the ailment list and a prefix -> columns index.
+
+    Kept as JSON and trusted for `check_interval` seconds; after that one LAST_ALTERED lookup
+    decides whether the columns need listing again. `connect` is only called when a check is
+    due, so a warm catalog costs no Snowflake session and no metadata round trips.
+    """
+
+    def __init__(self, path: str = SCHEMA_CATALOG_PATH, check_interval: float = SCHEMA_CHECK_SECONDS):
+        self.path = path
+        self.check_interval = check_interval
+        self.round_trips = 0
+
+    def load(self) -> Dict:
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self, catalog: Dict):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(f"{self.path}.tmp", 'w') as f:
+            json.dump(catalog, f, indent=2)
+        os.replace(f"{self.path}.tmp", self.path)
+
+    def _fetch(self, conn, query: str) -> pd.DataFrame:
+        self.round_trips += 1
+        return fetch_dataframe(conn, query)
+
+    def get(self, connect: Callable, force_check: bool = False) -> Dict:
+        """The catalog, refreshed first if it is missing, or due a check and the view has changed since."""
+        catalog = self.load()
+        if catalog and not force_check and time.time() - catalog['checked_at'] < self.check_interval:
+            return catalog
+        conn = connect()
+        last_altered = self._fetch(conn, LAST_ALTERED_QUERY)
+        last_altered = str(last_altered.iloc[0, 0]) if len(last_altered) else None
+        if not catalog or catalog.get('last_altered') != last_altered:
+            columns = self._fetch(conn, COLUMNS_QUERY)['COLUMN_NAME'].tolist()
+            catalog = {
+                'last_altered': last_altered,
+                'ailments': [column for column in columns if column.startswith(AILMENT_PREFIX)],
+                'prefix_columns': columns_by_prefix(columns),
+            }
+            logging.info(f"Schema catalog for {VIEW} refreshed ({len(columns)} columns, last altered {last_altered})")
+        catalog['checked_at'] = time.time()
+        self._save(catalog)
+        return catalog
+
+    def ailments(self, connect: Callable) -> pd.DataFrame:
+        """COLUMN_NAME / COLUMN_NAME_ADJ for the ailment selector."""
+        names = self.get(connect)['ailments']
+        return pd.DataFrame({'COLUMN_NAME': names, 'COLUMN_NAME_ADJ': [name[len(AILMENT_PREFIX):] for name in names]})
+
+    def prefix_columns(self, connect: Callable) -> Dict[str, List[str]]:
+        return self.get(connect)['prefix_columns']
+
+
+def total_count_query(ailment: str) -> str:
+    return f"SELECT COUNT(*) AS TOTAL FROM {VIEW} WHERE {AILMENT_PREFIX}{ailment} = 'Y'"
+
+
+def live_profile(conn, ailment: str, sample_size: int, prefix_columns: Optional[Dict[str, List[str]]] = None,
+                 max_columns: int = MAX_QUERY_COLUMNS,
+                 total_count: Optional[int] = None) -> Tuple[pd.DataFrame, Dict[str, pd.DataFrame], SamplingPlan]:
+    """Profile an ailment from one sampled scan per planned query (normally one), fanned out per category.
+
+    The sampling method follows from the ailment's row count (see choose_sampling). A split
+    plan first samples into its own temporary table so its queries count the same users. Returns the age
+    frame, the category frames (with confidence intervals for Bernoulli samples), and the
+    sampling plan used.
+    """
+    prefix_columns = prefix_columns or SchemaCatalog().prefix_columns(lambda: conn)
+    if total_count is None:
+        total_count = int(fetch_dataframe(conn, total_count_query(ailment)).iloc[0, 0])
+    sampling = choose_sampling(total_count, sample_size)
+    # Interval moments take one more column per category column, and one per category
+    plans = plan_profile_queries(prefix_columns, (max_columns - len(prefix_columns)) // 2 if sampling.intervals
+                                 else max_columns)
+
+    def query(columns, source=None):
+        # Moments need the whole category in the query; a category too wide for one gets no intervals
+        moments = {prefix: category for prefix, category in prefix_columns.items()
+                   if category and set(category) <= set(columns)} if sampling.intervals else None
+        return sampled_profile_query(ailment, columns, sampling, source, moments)
+
+    if len(plans) == 1:
+        frames = [fetch_dataframe(conn, query(plans[0]))]
+    else:
+        source = None
+        if sampling.sampled:
+            source = f"{SAMPLE_TABLE_PREFIX}_{uuid.uuid4().hex.upper()}"
+            conn.cursor().execute(sample_table_query(source, ailment, sum(plans, []), sampling))
+        try:
+            # Split plans run side by side on the one session
+            results, _ = run_queries_async(conn, {f"profile_{i}": query(columns, source)
+                                                  for i, columns in enumerate(plans)})
+        finally:
+            if source:
+                conn.cursor().execute(f"DROP TABLE IF EXISTS {source}")
+        frames = [results[f"profile_{i}"] for i in range(len(plans))]
+    return (*fan_out(merge_query_results(frames, ['GENDER']), prefix_columns, sampling.intervals), sampling)
+
+
+class ProfileStore:
+    """Precomputed Choregraph profiles for every ailment, kept as local Parquet.
+
+    `demographics.parquet` holds users and mean age per ailment and gender, `categories.parquet`
+    the 'Y' count of every category column per ailment, and `snapshot.json` when they were built.
+    """
+
+    def __init__(self, root: str = PROFILE_DIR):
+        self.root = root
+        self._demographics = None
+        self._categories = None
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.root, name)
+
+    def snapshot(self) -> Dict:
+        try:
+            with open(self._path('snapshot.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def available(self) -> bool:
+        return bool(self.snapshot())
+
+    def write(self, profile_rows: pd.DataFrame, prefix_columns: Dict[str, List[str]]) -> Dict:
+        """Store the rows of profile_query: demographics as-is, category counts summed over gender in long form."""
+        os.makedirs(self.root, exist_ok=True)
+        demographics = profile_rows[['AILMENT', 'GENDER', 'APPROX_AGE', 'USERS']].sort_values(['AILMENT', 'GENDER'])
+        category_frames = []
+        for prefix, columns in prefix_columns.items():
+            if not columns:
+                continue
+            counts = profile_rows.groupby('AILMENT')[columns].sum()
+            long = counts.melt(ignore_index=False, var_name='COLUMN', value_name='COUNT').reset_index()
+            category_frames.append(long.assign(PREFIX=prefix))
+        categories = (pd.concat(category_frames, ignore_index=True) if category_frames
+                      else pd.DataFrame(columns=['AILMENT', 'COLUMN', 'COUNT', 'PREFIX']))
+        categories = categories[['AILMENT', 'PREFIX', 'COLUMN', 'COUNT']].sort_values(['AILMENT', 'PREFIX'], kind='stable')
+        for name, frame in (('demographics', demographics), ('categories', categories)):
+            frame.astype({'AILMENT': 'category'}).to_parquet(self._path(f"{name}.parquet.tmp"), index=False)
+            os.replace(self._path(f"{name}.parquet.tmp"), self._path(f"{name}.parquet"))
+
+        snapshot = {'built_at': datetime.now().isoformat(timespec='seconds'),
+                    'ailments': int(demographics['AILMENT'].nunique()), 'category_columns': int(categories['COLUMN'].nunique())}
+        with open(self._path('snapshot.json.tmp'), 'w') as f:
+            json.dump(snapshot, f, indent=2)
+        os.replace(self._path('snapshot.json.tmp'), self._path('snapshot.json'))
+        self._demographics = self._categories = None
+        return snapshot
+
+    def _load(self):
+        if self._demographics is None:
+            self._demographics = pd.read_parquet(self._path('demographics.parquet'))
+            categories = pd.read_parquet(self._path('categories.parquet'))
+            # Index once by (ailment, prefix) so each chart is a single slice
+            self._categories = categories.set_index(['AILMENT', 'PREFIX']).sort_index()
+
+    def ailments(self) -> pd.DataFrame:
+        """Same shape as the information_schema ailment lookup: COLUMN_NAME and COLUMN_NAME_ADJ."""
+        self._load()
+        names = sorted(self._demographics['AILMENT'].astype(str).unique())
+        return pd.DataFrame({'COLUMN_NAME': [f"{AILMENT_PREFIX}{name}" for name in names], 'COLUMN_NAME_ADJ': names})
+
+    def total_count(self, ailment: str) -> int:
+        self._load()
+        return int(self._demographics.loc[self._demographics['AILMENT'] == ailment, 'USERS'].sum())
+
+    def age_distribution(self, ailment: str) -> pd.DataFrame:
+        """gender / approx_age / count per gender, as the live age query returns them."""
+        self._load()
+        rows = self._demographics[self._demographics['AILMENT'] == ailment]
+        return pd.DataFrame({'gender': rows['GENDER'].to_numpy(), 'approx_age': rows['APPROX_AGE'].to_numpy(),
+                             'count': rows['USERS'].to_numpy()})
+
+    def category_distribution(self, ailment: str, category_prefix: str) -> pd.DataFrame:
+        self._load()
+        try:
+            rows = self._categories.loc[(ailment, category_prefix)]
+        except KeyError:
+            return pd.DataFrame(columns=['Category', 'Proportion', 'Lower', 'Upper'])
+        return category_proportions(rows.set_index('COLUMN')['COUNT'], category_prefix)
+
+
+def build_profile_store(config: Optional[configparser.ConfigParser] = None, store: Optional[ProfileStore] = None) -> Dict:
+    """Scheduled job: profile every AILMENT2_* column over the whole view and replace the local store."""
+    store = store or ProfileStore()
+    start = time.perf_counter()
+    config = config or load_config()
+    max_columns = config.getint('choregraph', 'max_query_columns', fallback=MAX_QUERY_COLUMNS)
+    with pooled_connection(config) as conn:
+        # The nightly build always checks LAST_ALTERED, keeping the app's catalog current too
+        catalog = SchemaCatalog().get(lambda: conn, force_check=True)
+        ailment_columns, prefix_columns = catalog['ailments'], catalog['prefix_columns']
+        # The AILMENT key is one more column in each of these queries
+        frames = [fetch_dataframe(conn, profile_query(ailment_columns, category_columns))
+                  for category_columns in plan_profile_queries(prefix_columns, max_columns - 1)]
+    profile_rows = merge_query_results(frames, ['AILMENT', 'GENDER'])
+    snapshot = store.write(profile_rows, prefix_columns)
+    logging.info(f"Choregraph profiles built in {time.perf_counter() - start:.1f}s: {snapshot}")
+    return snapshot
+
+
+def _synthetic_users(users: int, ailments: int = 40, seed: int = 7) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    columns = {f"{AILMENT_PREFIX}CONDITION_{i}": rng.random(users) < 0.05 + 0.01 * (i % 5) for i in range(ailments)}
+    for prefix in CATEGORIES:
+        for option in range(6):
+            columns[f"{prefix}OPTION_{option}"] = rng.random(users) < 0.1 * (option + 1) / 2
+    return pd.DataFrame({
+        **{column: np.where(values, 'Y', None) for column, values in columns.items()},
+        'GENDER': rng.choice(['F', 'M', 'U'], users),
+        'DATE_OF_BIRTH_YEAR': rng.integers(1940, 2005, users),
+        'DATE_OF_BIRTH_MONTH_': rng.integers(1, 13, users),
+    })
+
+
+def _profile_rows(users: pd.DataFrame, ailment_columns: List[str], category_columns: List[str]) -> pd.DataFrame:
+    """What profile_query returns, computed in pandas."""
+    now = datetime.now()
+    age = (now.year - users['DATE_OF_BIRTH_YEAR']) - (now.month - users['DATE_OF_BIRTH_MONTH_']) / 12
+    flags = pd.concat([(users[category_columns] == 'Y').astype(int),
+                       pd.DataFrame({'GENDER': users['GENDER'], 'APPROX_AGE': age, 'USERS': 1})], axis=1)
+    frames = {}
+    for column in ailment_columns:
+        grouped = flags[users[column] == 'Y'].groupby('GENDER')
+        frames[column[len(AILMENT_PREFIX):]] = pd.concat([grouped[category_columns + ['USERS']].sum(),
+                                                          grouped['APPROX_AGE'].mean()], axis=1)
+    return pd.concat(frames, names=['AILMENT', 'GENDER']).copy().reset_index()
+
+
+class _StandInConnection:
+    """Answers the catalog's two metadata queries from local values, like a Snowflake session would."""
+
+    def __init__(self, columns: List[str], last_altered: str):
+        self.columns = columns
+        self.last_altered = last_altered
+
+    def cursor(self):
+        return self
+
+    def execute(self, query, params=None):
+        if 'information_schema.tables' in query:
+            self._result = pd.DataFrame({'LAST_ALTERED': [self.last_altered]})
+        else:
+            self._result = pd.DataFrame({'COLUMN_NAME': self.columns})
+        self.description = [(name,) for name in self._result.columns]
+        return self
+
+    def fetch_arrow_batches(self):
+        import pyarrow as pa
+        yield pa.Table.from_pandas(self._result, preserve_index=False)
+
+
+def _catalog_round_trips(columns: List[str]) -> Tuple[List[int], bool]:
+    """Metadata round trips for a cold start, a warm start, a due check and a check after the view changed."""
+    import tempfile
+
+    conn = _StandInConnection(columns, '2024-07-19 09:00:00')
+    with tempfile.TemporaryDirectory() as root:
+        trips = []
+        for check_interval, altered in ((3600, None), (3600, None), (0, None), (0, '2024-08-01 09:00:00')):
+            if altered:
+                conn.last_altered, conn.columns = altered, columns + ['SURVEY_HOBBY_PICKLEBALL']
+            catalog = SchemaCatalog(os.path.join(root, 'schema.json'), check_interval)
+            prefix_columns = catalog.prefix_columns(lambda: conn)
+            trips.append(catalog.round_trips)
+        return trips, 'SURVEY_HOBBY_PICKLEBALL' in prefix_columns['SURVEY_HOBBY_']
+
+
+def _interval_coverage(users: int = 2000, options: int = 6, draws: int = 2000, seed: int = 7) -> Tuple[int, int]:
+    """Covered and total intervals over `draws` fresh samples of `users` from an infinite population.
+
+    Each user has a latent activity level that raises all of their flags together, and 30% of
+    users prefer the options the others avoid, so a user's flags are far from independent. A
+    user flags option k with probability activity * (their preference for k).
+    """
+    rng = np.random.default_rng(seed)
+    weights = np.arange(1, options + 1) / options
+    truth = 0.7 * weights + 0.3 * weights[::-1]
+    truth = truth / truth.sum()
+    covered = trials = 0
+    for _ in range(draws):
+        activity = rng.beta(2, 3, users)
+        preference = np.where(rng.random(users)[:, None] < 0.3, weights[::-1], weights)
+        flags = (rng.random((users, options)) < activity[:, None] * preference).astype(float)
+        flag_total = flags.sum(axis=1)
+        columns = [f"OPTION_{k}" for k in range(options)]
+        estimate = category_proportions(pd.Series(flags.sum(axis=0), index=columns), '', users,
+                                        pd.Series(flags.T @ flag_total, index=columns), float(flag_total @ flag_total))
+        expected = truth[flags.sum(axis=0) > 0]
+        covered += int(((estimate['Lower'] <= expected) & (expected <= estimate['Upper'])).sum())
+        trials += len(estimate)
+    return covered, trials
+
+
+def self_test(users: int = 20000, max_columns: int = 40) -> Dict:
+    """Write synthetic profiles to a store and check every chart matches a direct computation.
+
+    Results are produced under a `max_columns` query plan, so the split-and-merge path is exercised too.
+    """
+    import tempfile
+
+    data = _synthetic_users(users)
+    ailment_columns = [column for column in data.columns if column.startswith(AILMENT_PREFIX)]
+    prefix_columns = columns_by_prefix(list(data.columns))
+    plans = plan_profile_queries(prefix_columns, max_columns)
+    planned_ok = (sorted(sum(plans, [])) == sorted(sum(prefix_columns.values(), []))
+                  and max(map(len, plans)) <= max_columns - len(DEMOGRAPHIC_COLUMNS))
+
+    # Live path: one ailment, its split plan merged on gender and fanned out per category
+    ailment_column = ailment_columns[0]
+    live_rows = merge_query_results([_profile_rows(data, [ailment_column], columns).drop(columns='AILMENT')
+                                     for columns in plans], ['GENDER'])
+    _, live = fan_out(live_rows, prefix_columns)
+    members = data[data[ailment_column] == 'Y']
+    live_matches = all(category_proportions((members[columns] == 'Y').sum(), prefix).equals(live[prefix])
+                       for prefix, columns in prefix_columns.items())
+
+    # Sampling: method choice by ailment size, and how often the intervals cover the true share when
+    # users are drawn from a known population whose flags are correlated within each user
+    methods = [choose_sampling(total, 10_000).method for total in (5_000, 200_000, 50_000_000)]
+    covered, trials = _interval_coverage()
+    # A one-column category is its whole share whatever the sample, e.g. 3 of 7 users flagging it
+    single = category_proportions(pd.Series({'OPTION_0': 3}), '', 7, pd.Series({'OPTION_0': 3}), 3.0)
+    single_bounded = bool((single[['Lower', 'Upper']].to_numpy() == 1.0).all())
+
+    catalog_trips, catalog_picked_up_change = _catalog_round_trips(list(data.columns))
+
+    with tempfile.TemporaryDirectory() as root:
+        store = ProfileStore(root)
+        profile_rows = merge_query_results([_profile_rows(data, ailment_columns, columns) for columns in plans],
+                                           ['AILMENT', 'GENDER'])
+        snapshot = store.write(profile_rows, prefix_columns)
+
+        store = ProfileStore(root)
+        start = time.perf_counter()
+        ailments = store.ailments()['COLUMN_NAME_ADJ']
+        load_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        profile = [store.category_distribution(ailments.iloc[-1], prefix) for prefix in CATEGORIES]
+        render_ms = (time.perf_counter() - start) * 1000
+
+        matches = True
+        for ailment in ailments:
+            members = data[data[f"{AILMENT_PREFIX}{ailment}"] == 'Y']
+            matches &= store.total_count(ailment) == len(members)
+            for prefix, columns in prefix_columns.items():
+                expected = category_proportions((members[columns] == 'Y').sum(), prefix)
+                matches &= expected.equals(store.category_distribution(ailment, prefix))
+        return {'snapshot': snapshot, 'queries_per_profile': len(plans), 'plan_covers_columns': planned_ok,
+                'catalog_round_trips_cold_warm_due_altered': catalog_trips,
+                'catalog_picked_up_change': catalog_picked_up_change,
+                'sampling_for_5k_200k_50m_rows': methods, 'interval_95_coverage': round(covered / trials, 3),
+                'single_column_interval_is_one': single_bounded,
+                'live_matches_direct_computation': live_matches, 'load_ms': round(load_ms, 1),
+                'charts': len(profile), 'profile_ms': round(render_ms, 1),
+                'matches_direct_computation': bool(matches)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the local Choregraph profile store for every ailment.")
+    parser.add_argument('--self-test', action='store_true', help="Check the store against a direct computation")
+    # Known args only: nightly_reports runs this file in-process with its own argv
+    args, _ = parser.parse_known_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if args.self_test:
+        print(self_test())
+    else:
+        build_profile_store()
@@ -2,15 +2,14 @@ import streamlit as st
 import pandas as pd
 import configparser
 import os
-import datetime
 import snowflake.connector
 import plotly.express as px
 
+from choregraph import CATEGORIES, MAX_QUERY_COLUMNS, ProfileStore, SchemaCatalog, live_profile
+
 st.set_page_config(layout="wide", initial_sidebar_state="expanded", page_icon=None, page_title=None)
 
 # Constants
-CURRENT_YEAR = datetime.datetime.now().year
-CURRENT_MONTH = datetime.datetime.now().month
 SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
 CONFIG_PATH = os.path.join(SCRIPT_DIR, 'config.ini')
 
@@ -39,77 +38,24 @@ def execute_query(_conn, query):
         column_names = [column[0] for column in cur.description]
     return pd.DataFrame(results, columns=column_names)
 
-# Get Snowflake connection
-conn = get_snowflake_connection()
-
-# SQL queries
-AILMENT_QUERY = '''
-    SELECT 
-        column_name,
-        REGEXP_REPLACE(column_name, 'AILMENT2_', '') AS column_name_adj
-    FROM information_schema.columns
-    WHERE 
-        table_name = 'PRSP_LGM_RPT_USER_V'
-        AND table_schema = 'PROD_US9_PAR_RPR'
-        AND lower(column_name) LIKE 'ailment%'
-'''
+# Ailments and category columns come from the local schema catalog; Snowflake is only
+# asked (for the view's LAST_ALTERED) when the catalog is missing or due a check
+schema_catalog = SchemaCatalog()
 
-@st.cache_data
+@st.cache_data(ttl=3600)
 def get_ailments():
-    return execute_query(conn, AILMENT_QUERY)
+    return schema_catalog.ailments(get_snowflake_connection)
 
-@st.cache_data
-def get_age_distribution(selected_ailment, sample_size=100000):
-    query = f'''
-        SELECT 
-            GENDER,
-            AVG(({CURRENT_YEAR} - DATE_OF_BIRTH_YEAR) - ({CURRENT_MONTH} - DATE_OF_BIRTH_MONTH_) / 12) as approx_age,
-            COUNT(*) as count
-        FROM 
-            (SELECT DATE_OF_BIRTH_YEAR, DATE_OF_BIRTH_MONTH_, GENDER
-             FROM PROD_US9_PAR_RPR.PRSP_LGM_RPT_USER_V 
-             WHERE AILMENT2_{selected_ailment} = 'Y'
-             ORDER BY RANDOM()
-             LIMIT {sample_size}
-            )
-        GROUP BY GENDER
-        ORDER BY GENDER
-    '''
-    df = execute_query(conn, query)
-    df.columns = df.columns.str.lower()  # convert column names to lowercase
-    return df
+@st.cache_data(ttl=3600)
+def get_prefix_columns():
+    return schema_catalog.prefix_columns(get_snowflake_connection)
 
 @st.cache_data
-def get_category_distribution(selected_ailment, category_prefix, sample_size=100000):
-    # Get column names for the category
-    columns_query = f"SELECT column_name FROM information_schema.columns WHERE table_name = 'PRSP_LGM_RPT_USER_V' AND column_name LIKE '{category_prefix}%'"
-    columns_df = execute_query(conn, columns_query)
-    
-    columns = ", ".join([f"SUM(CASE WHEN {col} = 'Y' THEN 1 ELSE 0 END) as {col}" for col in columns_df['COLUMN_NAME']])
-    
-    query = f'''
-        SELECT {columns}
-        FROM 
-            (SELECT *
-             FROM PROD_US9_PAR_RPR.PRSP_LGM_RPT_USER_V 
-             WHERE AILMENT2_{selected_ailment} = 'Y'
-             ORDER BY RANDOM()
-             LIMIT {sample_size}
-            )
-    '''
-    df = execute_query(conn, query)
-    
-    # Normalize the results
-    total = df.iloc[0].sum()
-    df = df.apply(lambda x: x / total)
-    
-    df = df.melt(var_name='Category', value_name='Proportion')
-    df['Category'] = df['Category'].str.replace(category_prefix, '').str.replace('_', ' ')
-
-    # Exclude rows with Proportion value of 0
-    df = df[df['Proportion'] != 0]
-
-    return df
+def get_live_profile(selected_ailment, sample_size):
+    # The age chart and all categories from one sample, sized from the ailment's row count
+    return live_profile(get_snowflake_connection(), selected_ailment, sample_size, get_prefix_columns(),
+                        config.getint("choregraph", "max_query_columns", fallback=MAX_QUERY_COLUMNS),
+                        total_count=int(get_total_count(selected_ailment)))
 
 @st.cache_data
 def get_total_count(selected_ailment):
@@ -118,127 +64,76 @@ def get_total_count(selected_ailment):
         FROM PROD_US9_PAR_RPR.PRSP_LGM_RPT_USER_V 
         WHERE AILMENT2_{selected_ailment} = 'Y'
     '''
-    return execute_query(conn, query).iloc[0, 0]
+    return execute_query(get_snowflake_connection(), query).iloc[0, 0]
 
 # Streamlit UI
 st.title("Choregraph Profiles")
 
-df = get_ailments()
+# Charts per grid column, after the gender/age chart in the first
+LAYOUT = [
+    ['TREATMENT2_', 'SURVEY_HOBBY_', 'SURVEY_CREDIT_CARDS_', 'SURVEY_INVESTMENTS_', 'SURVEY_SPORTING_', 'SURVEY_PURCHASE_'],
+    ['SURVEY_MUSIC_', 'SURVEY_OWN_', 'SURVEY_DIET_CONCERNS_', 'SURVEY_READING_', 'SURVEY_TRAVEL_', 'SURVEY_GROUP_'],
+    ['SURVEY_OCCUPATION_', 'SURVEY_COLLECTIBLES_', 'SURVEY_MAIL_ORDER_', 'SURVEY_DONOR_', 'SURVEY_ELECTRONICS_', 'BUYER_RETAIL_'],
+]
+
+@st.cache_resource
+def get_profile_store(built_at):
+    # Keyed on the snapshot time, so a nightly rebuild is picked up without restarting the app
+    return ProfileStore()
+
+snapshot = ProfileStore().snapshot()
+use_store = st.sidebar.checkbox("Use precomputed profiles", value=bool(snapshot), disabled=not snapshot,
+                                help="Profiles built offline by `python choregraph.py` over every user, instead of live samples")
+store = get_profile_store(snapshot.get('built_at')) if use_store else None
+
+df = store.ailments() if store else get_ailments()
 
 # Create Ailment Selector 
 ailment = st.sidebar.selectbox("Select Ailment", df['COLUMN_NAME_ADJ'])
-sample_size = st.sidebar.number_input('Sample Size', min_value=1, max_value=1000000, value=10000, step=1000)
+if store:
+    show_snapshot = st.sidebar.checkbox("Show snapshot date", value=True)
+else:
+    sample_size = st.sidebar.number_input('Sample Size', min_value=1, max_value=1000000, value=10000, step=1000)
 run_button = st.sidebar.button("Run")
 
 if run_button:
-    total_count = get_total_count(ailment)
+    total_count = store.total_count(ailment) if store else get_total_count(ailment)
     st.write(f"Total records for this ailment: {total_count}")
+    if store and show_snapshot:
+        st.caption(f"Precomputed profile snapshot from {snapshot['built_at'].replace('T', ' ')}")
     
     with st.spinner("Fetching and processing data..."):
+        if not store:
+            live_age, live_categories, sampling = get_live_profile(ailment, sample_size)
+            if sampling.intervals:
+                st.caption(f"Profiled from a {sampling.describe()}; bars show 95% confidence intervals")
+            else:
+                st.caption(f"Profiled from a {sampling.describe()}"
+                           + ("; block samples are clustered, so no confidence intervals are shown"
+                              if sampling.sampled else ""))
+
         # Age distribution
-        df_age = get_age_distribution(ailment)
+        df_age = store.age_distribution(ailment) if store else live_age
         fig_age = px.bar(df_age, x="gender", y="count", color="gender",
                  labels={'count':'Count', 'gender':'Gender'},
                  title=f'Distribution of Gender (Avg Age: {df_age["approx_age"].mean():.2f})')
-        
-        fig_hobbies = px.bar(get_category_distribution(ailment, 'SURVEY_HOBBY_', sample_size=sample_size), 
-                     x='Proportion', y='Category', orientation='h', title='Hobbies & Activities',
-                     labels={'Proportion':'', 'Category':''})
-
-        fig_music = px.bar(get_category_distribution(ailment, 'SURVEY_MUSIC_', sample_size=sample_size), 
-                        x='Proportion', y='Category', orientation='h', title='Musical Tastes',
-                        labels={'Proportion':'', 'Category':''})
-
-        fig_owned = px.bar(get_category_distribution(ailment, 'SURVEY_OWN_', sample_size=sample_size), 
-                        x='Proportion', y='Category', orientation='h', title='Owned Items',
-                        labels={'Proportion':'', 'Category':''})
-
-        fig_occupation = px.bar(get_category_distribution(ailment, 'SURVEY_OCCUPATION_', sample_size=sample_size), 
-                                x='Proportion', y='Category', orientation='h', title='Occupations',
-                                labels={'Proportion':'', 'Category':''})
-
-        fig_collectables = px.bar(get_category_distribution(ailment, 'SURVEY_COLLECTIBLES_', sample_size=sample_size), 
-                                x='Proportion', y='Category', orientation='h', title='Collectables',
-                                labels={'Proportion':'', 'Category':''})
-        
-        fig_credit_cards = px.bar(get_category_distribution(ailment, 'SURVEY_CREDIT_CARDS_', sample_size=sample_size), 
-                                x='Proportion', y='Category', orientation='h', title='Credit Cards',
-                                labels={'Proportion':'', 'Category':''})
-        
-        fig_diet_concerns = px.bar(get_category_distribution(ailment, 'SURVEY_DIET_CONCERNS_', sample_size=sample_size), 
-                                x='Proportion', y='Category', orientation='h', title='Diet Concerns',
-                                labels={'Proportion':'', 'Category':''})
-        
-        fig_mail_order = px.bar(get_category_distribution(ailment, 'SURVEY_MAIL_ORDER_', sample_size=sample_size), 
-                                x='Proportion', y='Category', orientation='h', title='Mail Order',
-                                labels={'Proportion':'', 'Category':''})
-        fig_investments = px.bar(get_category_distribution(ailment, 'SURVEY_INVESTMENTS_', sample_size=sample_size),
-                                x='Proportion', y='Category', orientation='h', title='Investments',
-                                labels={'Proportion':'', 'Category':''})
-        
-        fig_reading = px.bar(get_category_distribution(ailment, 'SURVEY_READING_', sample_size=sample_size),
-                                x='Proportion', y='Category', orientation='h', title='Reading Preferences',
-                                labels={'Proportion':'', 'Category':''})
-        
-        fig_donor = px.bar(get_category_distribution(ailment, 'SURVEY_DONOR_', sample_size=sample_size),
-                                x='Proportion', y='Category', orientation='h', title='Donor Preferences',
-                                labels={'Proportion':'', 'Category':''})
-        
-        fig_sporting = px.bar(get_category_distribution(ailment, 'SURVEY_SPORTING_', sample_size=sample_size),
-                                x='Proportion', y='Category', orientation='h', title='Sporting Preferences',
-                                labels={'Proportion':'', 'Category':''})
-        
-        fig_travel = px.bar(get_category_distribution(ailment, 'SURVEY_TRAVEL_', sample_size=sample_size),
-                                x='Proportion', y='Category', orientation='h', title='Travel Preferences',
-                                labels={'Proportion':'', 'Category':''})
-        
-        fig_electronics = px.bar(get_category_distribution(ailment, 'SURVEY_ELECTRONICS_', sample_size=sample_size),
-                                x='Proportion', y='Category', orientation='h', title='Electronics Preferences',
-                                labels={'Proportion':'', 'Category':''})
-        
-        fig_purchase = px.bar(get_category_distribution(ailment, 'SURVEY_PURCHASE_', sample_size=sample_size),
-                                x='Proportion', y='Category', orientation='h', title='Purchase Preferences',
-                                labels={'Proportion':'', 'Category':''})
-        
-        fig_group = px.bar(get_category_distribution(ailment, 'SURVEY_GROUP_', sample_size=sample_size),
-                                x='Proportion', y='Category', orientation='h', title='Group Preferences',
-                                labels={'Proportion':'', 'Category':''})
-        
-        fig_retail = px.bar(get_category_distribution(ailment, 'BUYER_RETAIL_', sample_size=sample_size),
-                                x='Proportion', y='Category', orientation='h', title='Retail Preferences',
-                                labels={'Proportion':'', 'Category':''})
-        
-        fig_treatment = px.bar(get_category_distribution(ailment, 'TREATMENT2_', sample_size=sample_size),
-                                x='Proportion', y='Category', orientation='h', title='Treatment Preferences',
-                                labels={'Proportion':'', 'Category':''})
+
+        figures = {}
+        for prefix, title in CATEGORIES.items():
+            distribution = store.category_distribution(ailment, prefix) if store else live_categories[prefix]
+            figures[prefix] = px.bar(distribution, x='Proportion', y='Category', orientation='h', title=title,
+                                     labels={'Proportion':'', 'Category':''},
+                                     error_x=distribution['Upper'] - distribution['Proportion'],
+                                     error_x_minus=distribution['Proportion'] - distribution['Lower'])
     
     # Display plots in a grid
-    col1, col2, col3 = st.columns(3)
-    
-    with col1:
+    grid = st.columns(3)
+    with grid[0]:
         st.plotly_chart(fig_age, use_container_width=True)
-        st.plotly_chart(fig_treatment, use_container_width=True)
-        st.plotly_chart(fig_hobbies, use_container_width=True)
-        st.plotly_chart(fig_credit_cards, use_container_width=True)
-        st.plotly_chart(fig_investments, use_container_width=True)
-        st.plotly_chart(fig_sporting, use_container_width=True)
-        st.plotly_chart(fig_purchase, use_container_width=True)
-    
-    with col2:
-        st.plotly_chart(fig_music, use_container_width=True)
-        st.plotly_chart(fig_owned, use_container_width=True)
-        st.plotly_chart(fig_diet_concerns, use_container_width=True)
-        st.plotly_chart(fig_reading, use_container_width=True)
-        st.plotly_chart(fig_travel, use_container_width=True)
-        st.plotly_chart(fig_group, use_container_width=True)
-    
-    with col3:
-        st.plotly_chart(fig_occupation, use_container_width=True)
-        st.plotly_chart(fig_collectables, use_container_width=True)
-        st.plotly_chart(fig_mail_order, use_container_width=True)
-        st.plotly_chart(fig_donor, use_container_width=True)
-        st.plotly_chart(fig_electronics, use_container_width=True)
-        st.plotly_chart(fig_retail, use_container_width=True)
+    for column, prefixes in zip(grid, LAYOUT):
+        with column:
+            for prefix in prefixes:
+                st.plotly_chart(figures[prefix], use_container_width=True)
 
 # Close the Snowflake connection when the app is done
 st.cache_resource.clear()
@@ -1,4 +1,5 @@
 import snowflake.connector
+from snowflake_client import execute_query_file, load_config, pooled_connection
 import configparser
 import pandas as pd
 from pathlib import Path
@@ -96,8 +97,8 @@ def main() -> None:
         config = load_config(config_path)
         logging.info("Configuration loaded successfully")
 
-        with connect_to_snowflake(config) as ctx:
-            df_snowflake = execute_snowflake_query(ctx, script_dir / 'dnq_reasons.sql')
+        with pooled_connection(config) as ctx:
+            df_snowflake = execute_query_file(ctx, script_dir / 'dnq_reasons.sql')
 
         # Preprocess and analyze the data
         processed_df, key_phrases = preprocess_and_analyze(df_snowflake, 'NON_ENRL_RSN')
@@ -1,5 +1,4 @@
 import streamlit as st
-import snowflake.connector
 import pandas as pd
 import pycountry
 import plotly.graph_objects as go
@@ -7,6 +6,9 @@ import numpy as np
 import configparser
 from dotenv import load_dotenv
 import os
+from snowflake_client import query_file
+from forecast_engine import PROTOCOL_COMPLEXITY, build_cpr_cube, forecast_scenario
+from forecast_simulation import PERCENTILES, fit_funnel_distributions, simulate_budget
 
 # Get the directory of the current script
 script_dir = os.path.dirname(os.path.realpath(__file__))
@@ -87,45 +89,46 @@ config.read("config.ini")
 # Load environment variables from a .env file
 load_dotenv()
 
-# # Connect to Snowflake database
-# conn = snowflake.connector.connect(
-#     user = config.get("snowflake", "user", fallback=os.getenv("SNOWFLAKE_USER")),
-#     password = config.get("snowflake", "password", fallback=os.getenv("SNOWFLAKE_PASSWORD")),
-#     account= config.get("snowflake", "account", fallback=os.getenv("SNOWFLAKE_ACCOUNT")),
-#     warehouse = config.get("snowflake", "warehouse", fallback=os.getenv("SNOWFLAKE_WAREHOUSE")),
-#     schema = config.get("snowflake", "schema", fallback=os.getenv("SNOWFLAKE_SCHEMA")),
-#     role = config.get("snowflake", "role", fallback=os.getenv("SNOWFLAKE_ROLE")))
-
-# Connect to Snowflake database
-conn = snowflake.connector.connect(
-    user = 'srv_us9pparrpr',
-    password = 'OIafqe47dsS!ad',
-    account= 'iqviaidporg-prdb_reporting',
-    warehouse = 'PRDB_PROD',
-    schema = 'PROD_US9_PAR_RPR',
-    role = 'PROD_PAR_RPR_SEL')
-
 
 # Define SQL query to execute
 sql_query = os.path.join(script_dir, 'query.sql')
 @st.cache_data(show_spinner=False)
 def load_data():
     st.spinner(text="Loading Historical Study Data...")
-    # Execute the SQL query and load the data into a DataFrame
-    data = pd.read_sql_query(sql_query, conn)
+    # Served from the on-disk query cache across reloads; a pooled session is only borrowed on a miss
+    data = query_file(sql_query, max_age=12 * 3600, config=config)
     return data
 
-# Call the load_data function to get the cached data
-data = load_data()
+@st.cache_resource(show_spinner=False)
+def load_cpr_cube():
+    # Costs, referrals and country CPRs for every filter combination, built once per data load
+    return build_cpr_cube(load_data())
+
+@st.cache_resource(show_spinner=False)
+def load_funnel_distributions():
+    # Funnel rate and CPR distributions per therapy area, indication and country, fitted once per data load
+    return fit_funnel_distributions(load_data())
+
+@st.cache_data(show_spinner=False)
+def run_simulation(therapy_area, primary_indication, country_sites, rands, cpr_multiplier, scenarios):
+    # Cached per input tuple, so moving an unrelated slider does not re-run the scenarios
+    return simulate_budget(load_funnel_distributions(), therapy_area, primary_indication, dict(country_sites),
+                           rands, cpr_multiplier, scenarios)
+
+if st.sidebar.button("Refresh data", help="Re-run query.sql instead of using the cached historical data"):
+    # Replace the on-disk result first, so the cleared caches below reload the fresh one
+    query_file(sql_query, max_age=12 * 3600, config=config, refresh=True)
+    for cached in (load_data, load_cpr_cube, load_funnel_distributions, run_simulation):
+        cached.clear()
+
+# Every widget interaction below is a lookup into the cube rather than a filter over the data
+cube = load_cpr_cube()
 
 # Get unique therapy areas
-list_of_therapy_areas = data['THERAPY_AREA'].unique().tolist()
+list_of_therapy_areas = cube.therapy_areas
 
-# Create the therapy_area_to_indications dictionary from the DataFrame
-therapy_area_groups = data.groupby(
-    ["THERAPY_AREA", "PRIMARY_INDICATION"]).size().reset_index().drop(columns=[0])
-therapy_area_to_indications = therapy_area_groups.groupby(
-    "THERAPY_AREA")["PRIMARY_INDICATION"].apply(list).to_dict()
+# Primary indications seen under each therapy area
+therapy_area_to_indications = cube.therapy_area_to_indications
 
 
 # UI components for filtering
@@ -153,14 +156,6 @@ with st.sidebar.expander("Filter by Therapy Area/Primary indication"):
         key="primary_indication_selectbox"
     )
 
-# Apply filters to the data
-if therapy_area != "All": data = data[data["THERAPY_AREA"] == therapy_area]
-if primary_indication != "All": data = data[data["PRIMARY_INDICATION"] == primary_indication]
-
-# Sum the costs and referrals
-sum_costs = data["COSTS"].sum()
-sum_referrals = data["REFERRALS"].sum()
-
 # Protocol Complexity
 protocol_complexity = "Mid"
 
@@ -180,18 +175,13 @@ with st.sidebar.expander("Recruitment Inputs"):
     st.markdown(render_tooltip("Target DtP Contribution (%)", "The % of patients DtP intends to contribute to the Study Patient Goal"), unsafe_allow_html=True)
     dtp_contribution = st.number_input("", min_value=1, max_value=100, value=10)
     recruitment_duration = st.number_input("Recruitment Duration", min_value=1, max_value=12, value=6)
-    protocol_complexity = st.selectbox("Protocol Complexity", options=["Lowest", "Low", "Mid", "High", "Highest"], index=2)
-
-    
-    # Sum the costs and referrals
-sum_costs = data["COSTS"].sum()
-sum_referrals = data["REFERRALS"].sum()
+    protocol_complexity = st.selectbox("Protocol Complexity", options=list(PROTOCOL_COMPLEXITY), index=2)
 
-# Calculate the CPR based on the summed costs and referrals
-cpr = sum_costs / sum_referrals
 
 # Get a comprehensive global country list
 iso_to_country = {country.alpha_2: country.name for country in pycountry.countries}
+# Reverse index so a selected name maps straight to its ISO 2 code
+country_to_iso = {name: iso for iso, name in iso_to_country.items()}
 
 # UI components for selecting countries
 with st.sidebar.expander("Country Selection"):
@@ -205,19 +195,10 @@ with st.sidebar.expander("Country Selection"):
     if selected_country_names:
         st.subheader("Configure Country Contributions")
         for country_name in selected_country_names:
-            # Get the ISO 2 code for the selected country
-            country = [iso for iso, name in iso_to_country.items() if name == country_name][0]
+            country = country_to_iso[country_name]
             country_sites[country] = st.number_input(f"{country_name} Sites", min_value=1, value=1, step=1)
             total_sites += country_sites[country]
 
-# Initialize the country_contribution_perc dictionary
-country_contribution_perc = {}
-
-# Normalize country contributions to sum up to 100%
-if total_sites > 0:
-    for country in country_sites:
-        country_contribution_perc[country] = (country_sites[country] / total_sites) * 100
-
 
 # UI Components for Confiuring Full Funnel
 with st.sidebar.expander("Funnel Configuration"):
@@ -225,118 +206,25 @@ with st.sidebar.expander("Funnel Configuration"):
     fov_rate = st.number_input("F.O.V. Rate (%)", min_value=0.5, max_value=20.0, value=4.0, step=0.1)
     consent_rate = st.number_input("Consent Rate (%)", min_value=40.0, max_value=99.0, value=85.0, step=0.1)
     screen_fail_rate = st.number_input("Screen Fail Rate (%)", min_value=1.0, max_value=100.0, value=50.0, step=0.1)
-
-# Calculate average CPR for the US
-us_cpr = data[data['COUNTRY'] == 'US']['COUNTRY_CPR'].mean()
-
-for country_datum in data['COUNTRY']:
-  print(country_datum)
-
-# Calculate the CPR for each selected country based on their % contribution and modifier
-country_cpr_list = []
-for country_name in selected_country_names:
-    # Get the ISO 2 code for the selected country
-    country = [iso for iso, name in iso_to_country.items() if name == country_name][0]
-    print(data['COUNTRY'])
-    print(country)
-    country_data = data[data['COUNTRY'] == country]
-    print(country_data)
-    if not country_data.empty:
-        country_avg_cpr = country_data['COUNTRY_CPR'].mean()
-        cpr_modifier = (country_avg_cpr - us_cpr) / us_cpr
-    else:
-        cpr_modifier = 1  # Default modifier for countries with no data
-
-    weighted_cpr = (1 + cpr_modifier) * cpr
-    country_cpr_list.append((country, weighted_cpr, country_contribution_perc.get(country, 0)))
-
-# Initialize num_sites
-num_sites = 0
-
-# Check if country_sites is defined and is a dictionary
-if isinstance(country_sites, dict):
-    # Calculate the total number of patients from country contributions
-    num_sites = sum(country_sites.values())
-
-# Initialize the enrollment rate and dtp_volume
-dtp_volume = 0
-
-# Calculate the No. Sites weighting multiplier and enrollment rate based on the enrollment rate
-if num_sites == 0:
-    enrollment_rate = 0  # Set enrollment_rate to 0 to avoid division by zero error
-else:
-    dtp_volume = total_patient_goal * (dtp_contribution / 100)
-    enrollment_rate = dtp_volume / (num_sites * recruitment_duration)
-
-# Define the range boundaries and multipliers
-min_enrollment_rate, max_enrollment_rate = 0.01, 10
-min_multiplier, max_multiplier = 0, 2
-
-# Calculate the No. Sites weighting multiplier based on the enrollment rate
-if enrollment_rate <= min_enrollment_rate:
-    num_sites_multiplier = min_multiplier
-elif enrollment_rate >= max_enrollment_rate:
-    num_sites_multiplier = max_multiplier
-else:
-    num_sites_multiplier = min_multiplier + (enrollment_rate - min_enrollment_rate) * (max_multiplier - min_multiplier) / (max_enrollment_rate - min_enrollment_rate)
-
-# Update the "Calculate No. Sites weighting multiplier" section
-#num_sites_multiplier = multipliers[range_index]
-
-# Create a dictionary with multipliers for protocol complexity
-protocol_complexity_dict = {
-    "Lowest": -0.3,
-    "Low": -0.2,
-    "Mid": 0,
-    "High": 0.25,
-    "Highest": 1,
-}
-
-# Determine the protocol complexity multiplier based on user selection
-protocol_complexity_multiplier = protocol_complexity_dict[protocol_complexity]
-
-# Apply filters to the data
-if therapy_area != "All":
-    data = data[data["THERAPY_AREA"] == therapy_area]
-
-if primary_indication != "All":
-    data = data[data["PRIMARY_INDICATION"] == primary_indication]
-
-# Apply weightings and multipliers to the CPR
-cpr = cpr * (1 + protocol_complexity_multiplier) \
-    * (1 + num_sites_multiplier)
-
-# Determine the protocol complexity multiplier based on user selection
-protocol_complexity_multiplier = protocol_complexity_dict[protocol_complexity]
-
-# Calculate percentage values based on multipliers
-protocol_complexity_percentage = protocol_complexity_dict[protocol_complexity] * 100
-num_sites_percentage = num_sites_multiplier * 10
-
-# Calculate the initial CPR based on the summed costs and referrals (without any weightings applied)
-initial_cpr = sum_costs / sum_referrals
-
-# Apply weightings and multipliers to the initial CPR to get the final CPR
-cpr = initial_cpr * (1 + protocol_complexity_multiplier) * \
-    (1 + num_sites_multiplier)
-
-# Calculate the CPR for each selected country based on their % contribution and modifier
-country_cpr_list = []
-for country_name in selected_country_names:
-    # Get the ISO 2 code for the selected country
-    country = [iso for iso, name in iso_to_country.items() if name == country_name][0]
-    country_data = data[data['COUNTRY'] == country]
-    if not country_data.empty:
-        country_avg_cpr = country_data['COUNTRY_CPR'].mean()
-        cpr_modifier = (country_avg_cpr - us_cpr) / us_cpr
-    else:
-        cpr_modifier = 1  # Default modifier for countries with no data
-
-    weighted_cpr = (1 + cpr_modifier) * cpr
-    country_cpr_list.append((country, weighted_cpr, country_contribution_perc.get(country, 0)))
-
-# Calculate the final CPR as a weighted average of each selected country's CPR
-final_cpr = sum(weighted_cpr * contribution / 100 for country, weighted_cpr, contribution in country_cpr_list)
+    simulate = st.checkbox("Monte Carlo Simulation", value=False,
+                           help="Draw funnel rates and CPR from the historical data instead of the fixed rates above")
+    scenarios = st.number_input("Scenarios", min_value=10_000, max_value=1_000_000, value=100_000, step=10_000,
+                                disabled=not simulate)
+
+# The CPR weightings, country markups and funnel for this study, as forecast_engine computes them
+# for a whole batch of scenarios from the command line
+forecast = forecast_scenario(cube, therapy_area, primary_indication, total_patient_goal, dtp_contribution,
+                             recruitment_duration, protocol_complexity, country_sites,
+                             fov_rate, consent_rate, screen_fail_rate)
+num_sites = forecast["num_sites"]
+dtp_volume = forecast["rands"] if num_sites else 0
+enrollment_rate = forecast["enrollment_rate"]
+num_sites_multiplier = forecast["num_sites_multiplier"]
+protocol_complexity_multiplier = forecast["protocol_complexity_multiplier"]
+protocol_complexity_percentage = protocol_complexity_multiplier * 100
+initial_cpr = forecast["initial_cpr"]
+cpr = forecast["cpr"]
+countries, final_cpr = forecast["countries"], forecast["final_cpr"]
 
 # Create two columns
 col1, col2 = st.columns([1, 1])
@@ -373,36 +261,14 @@ with st.container():
     # Display the discrete country-level CPRs and patient volumes set by the % modifiers
     st.subheader("Country-Level CPRs and Patient Volumes")
 
-    # Create an empty DataFrame to store the results
-    results = pd.DataFrame(columns=["Country", "Markup", "CPR", "Patients", "Contribution"])
-
-    for country, weighted_cpr, contribution in country_cpr_list:
-        patient_volume = total_patient_goal * (dtp_contribution / 100) * (contribution / 100)
-        country_data = data[data['COUNTRY'] == country]
-        if not country_data.empty:
-            country_avg_cpr = country_data['COUNTRY_CPR'].mean()
-            cpr_modifier = (country_avg_cpr - us_cpr) / us_cpr
-            cpr_markup = cpr_modifier * 100
-        else:
-            cpr_modifier = 1  # Default modifier for countries with no data
-            cpr_markup = 100
-
-        country_name = iso_to_country[country]
-
-        # Append the row to the DataFrame
-        row = pd.DataFrame({"Country": [country_name], "Markup": [f"{cpr_markup:+.0f}%"], "CPR": [f"${weighted_cpr:.2f}"], "Patients": [f"{patient_volume:.0f}"], "Contribution": [f"{contribution:.0f}%"]})
-        results = pd.concat([results, row], ignore_index=True)
-
-    # Check if final_cpr and dtp_volume are not None before creating the total_row DataFrame
-    if final_cpr is not None and dtp_volume is not None:
-        total_row = pd.DataFrame({
-            "Country": ["Summary"], 
-            "Markup": "", 
-            "CPR": [f"${final_cpr:.2f}"], 
-            "Patients": int(dtp_volume) if dtp_volume else "", 
-            "Contribution": [""]
-        })
-        results = pd.concat([results, total_row], ignore_index=True)
+    # Format the country rows and the summary row into the table in one construction
+    results = pd.DataFrame({
+        "Country": [iso_to_country[country] for country in countries.index] + ["Summary"],
+        "Markup": [f"{markup:+.0f}%" for markup in countries["Markup"]] + [""],
+        "CPR": [f"${weighted_cpr:.2f}" for weighted_cpr in countries["CPR"]] + [f"${final_cpr:.2f}"],
+        "Patients": [f"{patients:.0f}" for patients in countries["Patients"]] + [int(dtp_volume) if dtp_volume else ""],
+        "Contribution": [f"{contribution:.0f}%" for contribution in countries["Contribution"]] + [""],
+    })
 
     # Display the DataFrame as a table without the index column
     st.write(results.to_html(index=False), unsafe_allow_html=True)
@@ -428,15 +294,15 @@ with st.container():
         #    unsafe_allow_html=True
         #)
 
-dtp_rands = (total_patient_goal * (dtp_contribution / 100))
+dtp_rands = forecast["rands"]
 
 with st.container():
     st.markdown("### Funnel & Budget")
 
-    total_referrals = int(dtp_rands / (fov_rate / 100) / (consent_rate / 100) / (1 - (screen_fail_rate / 100)))
-    total_consents = int(dtp_rands / (1 - (screen_fail_rate / 100)))
-    total_fovs = int(dtp_rands / (consent_rate / 100) / (1 - (screen_fail_rate / 100)))
-    cost_per_patient = int(final_cpr / (fov_rate / 100) / (consent_rate / 100) / (1 - (screen_fail_rate / 100)))
+    total_referrals = int(forecast["referrals"])
+    total_consents = int(forecast["consents"])
+    total_fovs = int(forecast["fovs"])
+    cost_per_patient = int(forecast["cost_per_patient"])
     total_budget = int(dtp_rands * cost_per_patient)
     total_internal_media_budget = total_budget * 1.45
 
@@ -451,3 +317,20 @@ with st.container():
 
     # Display the DataFrame as a table without the index column
     st.write(df.to_html(index=False), unsafe_allow_html=True)
+
+if simulate and dtp_rands > 0:
+    with st.container():
+        st.markdown("### Simulated Funnel & Budget")
+        with st.spinner(text=f"Simulating {scenarios:,} scenarios..."):
+            simulation = run_simulation(therapy_area, primary_indication, tuple(country_sites.items()), dtp_rands,
+                                        (1 + protocol_complexity_multiplier) * (1 + num_sites_multiplier), scenarios)
+        st.write(
+            f"Funnel rates and CPR drawn from {therapy_area} / {primary_indication} history for the selected "
+            f"countries, weighted by sites.")
+        simulated = pd.DataFrame({
+            "Metric": ["Referrals", "CPR", "Projected Cost per Patient (Internal)", "Total Media Budget (Internal)"],
+            **{f"P{percentile}": [f"{simulation['referrals'][i]:,.0f}"]
+               + [f"${simulation[name][i]:,.0f}" for name in ("cpr", "cost_per_patient", "budget")]
+               for i, percentile in enumerate(PERCENTILES)},
+        })
+        st.write(simulated.to_html(index=False), unsafe_allow_html=True)
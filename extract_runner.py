@@ -0,0 +1,196 @@
+import os
+import time
+import logging
+import argparse
+import configparser
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, List, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from sharepoint_upload import DEFAULT_CHUNK_SIZE, upload_to_sharepoint
+from snowflake_client import iter_arrow_batches, pooled_connection, read_sql_file
+
+
+def _normalize_type(data_type: pa.DataType) -> pa.DataType:
+    # Snowflake sizes integer columns per result chunk, so widen them to keep one schema per file
+    if pa.types.is_integer(data_type):
+        return pa.int64()
+    if pa.types.is_floating(data_type):
+        return pa.float64()
+    return data_type
+
+
+def _normalize_schema(schema: pa.Schema) -> pa.Schema:
+    return pa.schema([field.with_type(_normalize_type(field.type)) for field in schema])
+
+
+def _csv_dtype(data_type: pa.DataType):
+    # Nullable Int64 for every batch, so a batch with nulls doesn't turn its integers into floats
+    return pd.Int64Dtype() if pa.types.is_integer(data_type) else None
+
+
+class ExtractError(RuntimeError):
+    """One or more extracts failed; `results` holds the ones that completed."""
+
+    def __init__(self, failures: Dict[str, Exception], results: Dict[str, Dict]):
+        super().__init__(f"{len(failures)} extract(s) failed: {', '.join(sorted(failures))}")
+        self.failures = failures
+        self.results = results
+
+
+class _ArtifactWriter:
+    """Write Arrow batches to a Parquet file (and optionally a CSV twin) via temp files swapped in on close."""
+
+    def __init__(self, base_path: str, write_csv: bool = True):
+        self.paths = [f"{base_path}.parquet"] + ([f"{base_path}.csv"] if write_csv else [])
+        self.schema = None
+        self.rows = 0
+        self._parquet = None
+        self._csv = None
+
+    def write(self, batch):
+        if self.schema is None:
+            self.schema = _normalize_schema(batch.schema)
+            self._parquet = pq.ParquetWriter(f"{self.paths[0]}.tmp", self.schema, compression='snappy')
+            if len(self.paths) > 1:
+                self._csv = open(f"{self.paths[1]}.tmp", 'w', newline='', encoding='utf-8')
+        table = batch if isinstance(batch, pa.Table) else pa.Table.from_batches([batch])
+        table = table.cast(self.schema)
+        self._parquet.write_table(table)
+        if self._csv is not None:
+            # pandas does the formatting, with one type mapping for every batch so the columns read the same throughout
+            table.to_pandas(types_mapper=_csv_dtype).to_csv(self._csv, index=False, header=self._csv.tell() == 0)
+        self.rows += table.num_rows
+
+    def close(self, empty_columns: Optional[List[str]] = None) -> List[str]:
+        try:
+            if self.schema is None:
+                # No batches came back: still publish an empty, correctly-headed file
+                self.write(pa.table({name: pa.array([], pa.string()) for name in empty_columns or []}))
+            self._close_files()
+            for path in self.paths:
+                os.replace(f"{path}.tmp", path)
+        except BaseException:
+            self.abort()
+            raise
+        return self.paths
+
+    def _close_files(self):
+        for handle in (self._parquet, self._csv):
+            if handle is not None:
+                handle.close()
+        self._parquet = self._csv = None
+
+    def abort(self):
+        """Close and delete the temp files, leaving any previously published artifacts in place."""
+        try:
+            self._close_files()
+        except Exception:
+            pass
+        for path in self.paths:
+            try:
+                os.remove(f"{path}.tmp")
+            except OSError:
+                pass
+
+
+def stream_extract(conn, sql_file_path: str, base_path: str, write_csv: bool = True) -> Dict:
+    """Run one extract and stream its Arrow batches straight to disk without building the full frame."""
+    start = time.perf_counter()
+    cursor = conn.cursor()
+    writer = _ArtifactWriter(base_path, write_csv)
+    try:
+        for batch in iter_arrow_batches(cursor, read_sql_file(sql_file_path)):
+            writer.write(batch)
+    except BaseException:
+        writer.abort()
+        raise
+    columns = [column[0] for column in cursor.description] if cursor.description else []
+    paths = writer.close(columns)
+    return {'paths': paths, 'rows': writer.rows, 'seconds': time.perf_counter() - start}
+
+
+def write_dataframe(df: pd.DataFrame, base_path: str, write_csv: bool = True) -> List[str]:
+    """Write an in-memory frame (e.g. Google Analytics) as the same Parquet/CSV artifacts."""
+    writer = _ArtifactWriter(base_path, write_csv)
+    try:
+        writer.write(pa.Table.from_pandas(df, preserve_index=False))
+    except BaseException:
+        writer.abort()
+        raise
+    return writer.close()
+
+
+def run_extracts(extracts: Dict[str, str], sql_dir: str, output_path: str,
+                 config: configparser.ConfigParser, max_workers: int = 3, write_csv: bool = True,
+                 runners: Optional[Dict[str, Callable]] = None) -> Dict[str, Dict]:
+    """Run `{sql name: output file name}` extracts concurrently, each on its own pooled session.
+
+    `runners` swaps stream_extract for another function with the same signature for some
+    extracts (e.g. incremental_extract). Returns per-extract artifact paths, row counts and
+    timings. A failed extract doesn't stop the others; once they have all finished, an
+    ExtractError carrying the completed results is raised.
+    """
+    runners = runners or {}
+
+    def run(sql_name, file_name):
+        extract = runners.get(sql_name, stream_extract)
+        with pooled_connection(config) as conn:
+            return extract(conn, os.path.join(sql_dir, f'{sql_name}.sql'),
+                           os.path.join(output_path, file_name), write_csv)
+
+    results, failures = {}, {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(run, sql_name, file_name): sql_name for sql_name, file_name in extracts.items()}
+        for future in as_completed(futures):
+            sql_name = futures[future]
+            try:
+                results[sql_name] = future.result()
+                logging.info(f"{sql_name}: {results[sql_name]['rows']} rows in {results[sql_name]['seconds']:.1f}s")
+            except Exception as e:
+                logging.error(f"Extract {sql_name} failed: {e}")
+                failures[sql_name] = e
+    if failures:
+        raise ExtractError(failures, results)
+    return results
+
+
+def upload_artifact(ctx, sharepoint_folder: str, local_path: str, chunk_size: int = DEFAULT_CHUNK_SIZE):
+    """Upload an already-written local artifact to SharePoint as-is, in resumable chunks."""
+    target_url = f"{sharepoint_folder}/{os.path.basename(local_path)}"
+    upload_to_sharepoint(ctx, target_url, local_path, chunk_size)
+    return target_url
+
+
+def self_test() -> Dict:
+    """Stream batches whose integer column has nulls in only some of them, and check the CSV reads the same throughout."""
+    import tempfile
+
+    batches = [pa.table({'REFRL_ID': pa.array([1, 2], pa.int32()), 'SCORE': [0.5, 1.5]}),
+               pa.table({'REFRL_ID': pa.array([3, None], pa.int64()), 'SCORE': [2.5, None]})]
+    with tempfile.TemporaryDirectory() as root:
+        writer = _ArtifactWriter(os.path.join(root, 'extract'))
+        for batch in batches:
+            writer.write(batch)
+        parquet_path, csv_path = writer.close()
+        with open(csv_path, encoding='utf-8') as f:
+            lines = f.read().splitlines()
+        round_trip = pd.read_csv(csv_path, dtype={'REFRL_ID': 'Int64'})
+        expected = pq.read_table(parquet_path).to_pandas(types_mapper=_csv_dtype)
+    return {'csv': lines, 'rows': writer.rows,
+            'integers_unchanged': lines[1:] == ['1,0.5', '2,1.5', '3,2.5', ','],
+            'matches_parquet': round_trip.equals(expected)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stream Snowflake extracts to Parquet/CSV artifacts.")
+    parser.add_argument('--self-test', action='store_true', help="Write batches with mixed nulls and check the CSV")
+    args = parser.parse_args()
+
+    if args.self_test:
+        print(self_test())
+    else:
+        parser.print_help()
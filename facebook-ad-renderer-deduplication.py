@@ -1,25 +1,11 @@
+import ad_dedup
 
-def deduplicate_ads(df: pd.DataFrame) -> pd.DataFrame:
+def deduplicate_ads(df: pd.DataFrame, near_duplicates: bool = False) -> pd.DataFrame:
     """
-    Deduplicate ads based on body and title, aggregating metrics and retaining all unique IDs.
+    Deduplicate ads on normalized body and title, aggregating metrics and retaining all unique IDs.
+    Near-duplicate wording can optionally be grouped too (see ad_dedup).
     """
-    # Group by body and title
-    grouped = df.groupby(['body', 'title'])
-    
-    # Aggregate metrics, keep all unique IDs, and choose one image URL
-    deduplicated = grouped.agg({
-        'id': lambda x: list(set(x)),  # Keep all unique IDs as a list
-        'image_url': 'first',  # Keep the first image URL
-        'call_to_action_type': 'first',  # Keep the first CTA type
-        'reach': 'sum',
-        'impressions': 'sum',
-        'clicks': 'sum'
-    }).reset_index()
-    
-    # Explode the ID list to create separate rows for each unique ID
-    deduplicated = deduplicated.explode('id')
-    
-    return deduplicated
+    return ad_dedup.deduplicate_ads(df, near_duplicates=near_duplicates)
 
 def main():
     # ... (keep the existing code)
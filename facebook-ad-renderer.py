@@ -1,8 +1,11 @@
-import requests
 import pandas as pd
 import os 
-import snowflake.connector
+import argparse
 import configparser
+from facebook_graph import GraphError, fetch_ads
+from html_leaderboard import stream_leaderboard
+from query_cache import request_refresh
+from snowflake_client import query_file
 from typing import Dict, List
 from pathlib import Path
 import logging
@@ -12,7 +15,6 @@ import matplotlib.pyplot as plt
 from matplotlib.gridspec import GridSpec
 from matplotlib import patches
 import textwrap
-import html
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -23,54 +25,14 @@ def load_config(config_path: str) -> configparser.ConfigParser:
     config.read(config_path)
     return config
 
-def fetch_facebook_ads_data(api_url: str, params: Dict) -> List[Dict]:
-    """Fetch Facebook Ads data from the API."""
-    response = requests.get(api_url, params=params)
-    if response.status_code != 200:
-        logging.error(f"Failed to retrieve data: {response.status_code}")
-        logging.error(response.text)
+def fetch_facebook_ads_data(api_url: str, params: Dict, batched: bool = False) -> List[Dict]:
+    """Fetch every ad from the API, following paging cursors; creatives and insights optionally via cached batch requests."""
+    try:
+        return fetch_ads(params['access_token'], api_url, params['fields'], limit=params.get('limit', 100),
+                         batched=batched)
+    except GraphError as e:
+        logging.error(f"Failed to retrieve data: {e}")
         return []
-    
-    data = response.json()
-    ads_data = []
-    for ad in data.get('data', []):
-        creative = ad.get('creative', {})
-        insights = ad.get('insights', {}).get('data', [{}])[0]
-        ads_data.append({
-            'id': ad.get('id'),
-            'title': creative.get('title'),
-            'body': creative.get('body'),
-            'image_url': creative.get('image_url'),
-            'call_to_action_type': creative.get('call_to_action'),
-            'reach': insights.get('reach'),
-            'impressions': insights.get('impressions'),
-            'clicks': insights.get('clicks'),
-        })
-    #print(ads_data)
-    return ads_data
-
-def connect_to_snowflake(config: configparser.ConfigParser) -> snowflake.connector.SnowflakeConnection:
-    """Establish a connection to Snowflake."""
-    return snowflake.connector.connect(
-        user=config.get("snowflake", "user"),
-        password=config.get("snowflake", "password"),
-        account=config.get("snowflake", "account"),
-        warehouse=config.get("snowflake", "warehouse"),
-        schema=config.get("snowflake", "schema"),
-        role=config.get("snowflake", "role")
-    )
-
-def execute_snowflake_query(ctx: snowflake.connector.SnowflakeConnection, query_path: str) -> pd.DataFrame:
-    """Execute a Snowflake query from a file and return the results as a DataFrame."""
-    with open(query_path, 'r') as file:
-        query = file.read()
-    #logging.info(f"Executing query: {query}")
-    
-    cursor = ctx.cursor()
-    cursor.execute(query)
-    results = cursor.fetchall()
-    column_names = [column[0] for column in cursor.description]
-    return pd.DataFrame(results, columns=column_names)
 
 def process_snowflake_data(df: pd.DataFrame) -> pd.DataFrame:
     """Process Snowflake data: filter for Black or African American and pivot the data to sum Sessions and Referrals."""
@@ -102,12 +64,14 @@ def process_snowflake_data(df: pd.DataFrame) -> pd.DataFrame:
    
     return df_pivoted
 
-def create_ad_leaderboard(merged_df: pd.DataFrame, output_dir: Path, max_ads: int = 50):
-    """Create an HTML leaderboard of Facebook ads with their statistics, sorted by sessions."""
-    # Sort ads by sessions in descending order
-    sorted_df = merged_df.sort_values(by='sessions', ascending=False).head(max_ads)
-    
-    html_content = """
+def _format_stats(ad: Dict) -> str:
+    return (f"""
+            {f"B/AA Sessions: {ad['baa_sessions']:,}" if ad.get('baa_sessions', 0) != 0 else ""} <br>
+            {f"Pre Screener Sessions: {ad['sessions']:,}" if ad.get('sessions', 0) != 0 else ""} <br>
+            {f"Referrals: {ad['referrals']:,}" if ad.get('referrals', 0) != 0 else ""}
+            """)
+
+LEADERBOARD_HEAD = """
     <!DOCTYPE html>
     <html lang="en">
     <head>
@@ -127,33 +91,33 @@ def create_ad_leaderboard(merged_df: pd.DataFrame, output_dir: Path, max_ads: in
     </head>
     <body>
     """
-    
-    for _, ad in sorted_df.iterrows():
-        html_content += f"""
+
+LEADERBOARD_CARD = """
         <div class="ad">
-            <div class="ad-body">{html.escape(ad['body'])}</div>
-            <img class="ad-image" src="{html.escape(ad['image_url'])}" alt="Ad Image" onerror="this.onerror=null;this.src='https://www.nomadfoods.com/wp-content/uploads/2018/08/placeholder-1-e1533569576673-1500x1500.png';">
+            <div class="ad-body">{body}</div>
+            <img class="ad-image" src="{image_url}" loading="{loading}" decoding="async" alt="Ad Image" onerror="this.onerror=null;this.src='{placeholder}';">
             <div class="ad-url">https://www.librexiaafstudy.com/</div>
-            <div class="ad-title">{html.escape(ad['title'])}</div>
+            <div class="ad-title">{title}</div>
             <div class="ad-cta">Learn More</div>
-            <div class="ad-stats">
-            {f"B/AA Sessions: {ad['baa_sessions']:,}" if 'baa_sessions' in ad and ad['baa_sessions'] != 0 else ""} <br>
-            {f"Pre Screener Sessions: {ad['sessions']:,}" if 'sessions' in ad and ad['sessions'] != 0 else ""} <br>
-            {f"Referrals: {ad['referrals']:,}" if 'referrals' in ad and ad['referrals'] != 0 else ""}
-            </div>
+            <div class="ad-stats">{stats}</div>
         </div>
         """
-    
-    html_content += """
+
+LEADERBOARD_FOOT = """
     </body>
     </html>
     """
+
+def create_ad_leaderboard(merged_df: pd.DataFrame, output_dir: Path, max_ads: int = 50, page_size: int = 500):
+    """Create an HTML leaderboard of Facebook ads with their statistics, sorted by sessions."""
+    # Sort ads by sessions in descending order
+    sorted_df = merged_df.sort_values(by='sessions', ascending=False).head(max_ads)
     
     output_file = output_dir / "janssen_librexia_fb_ads_summary.html"
-    with open(output_file, 'w', encoding='utf-8') as f:
-        f.write(html_content)
+    result = stream_leaderboard(sorted_df, output_file, LEADERBOARD_HEAD, LEADERBOARD_CARD, LEADERBOARD_FOOT,
+                                _format_stats, page_size=page_size)
     
-    logging.info(f"Leaderboard saved to {output_file}")
+    logging.info(f"Leaderboard saved to {output_file} ({result['ads']} ads, {len(result['paths'])} pages)")
 
 def main():
     script_dir = Path(__file__).parent
@@ -168,7 +132,8 @@ def main():
     }
     
     # Fetch and process Facebook Ads data
-    ads_data = fetch_facebook_ads_data(api_url, params)
+    ads_data = fetch_facebook_ads_data(api_url, params,
+                                       batched=config.getboolean("facebook", "batch_requests", fallback=True))
     if not ads_data:
         logging.error("No data returned from the Facebook API.")
         return
@@ -176,8 +141,7 @@ def main():
     
     
     # Connect to Snowflake and fetch data
-    with connect_to_snowflake(config) as ctx:
-        df_snowflake = execute_snowflake_query(ctx, script_dir / 'fb.sql')
+    df_snowflake = query_file(script_dir / 'fb.sql', max_age=6 * 3600, config=config)
     
     logging.info(f"Snowflake data loaded: {len(df_snowflake.columns)}")
 
@@ -202,4 +166,8 @@ def main():
     logging.info(f"Merged data saved to {output_dir / 'output_merged.csv'}")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render the Facebook ad leaderboard.")
+    parser.add_argument('--refresh', action='store_true', help="Re-run fb.sql instead of using a cached result")
+    if parser.parse_args().refresh:
+        request_refresh()
     main()
@@ -1,13 +1,15 @@
-import requests
 import pandas as pd
 import os 
-import snowflake.connector
+import argparse
 import configparser
+from ad_images import PLACEHOLDER_URL, ImageCache
+from facebook_graph import GraphError, fetch_ads
+from leaderboard_tiles import create_tiled_ad_leaderboard
+from query_cache import request_refresh
+from snowflake_client import query_file
 from typing import Dict, List
 from pathlib import Path
 import logging
-from PIL import Image
-from io import BytesIO
 import matplotlib.pyplot as plt
 from matplotlib.gridspec import GridSpec
 from matplotlib import patches
@@ -22,48 +24,14 @@ def load_config(config_path: str) -> configparser.ConfigParser:
     config.read(config_path)
     return config
 
-def fetch_facebook_ads_data(api_url: str, params: Dict) -> List[Dict]:
-    """Fetch Facebook Ads data from the API."""
-    response = requests.get(api_url, params=params)
-    if response.status_code != 200:
-        logging.error(f"Failed to retrieve data: {response.status_code}")
-        logging.error(response.text)
+def fetch_facebook_ads_data(api_url: str, params: Dict, batched: bool = False) -> List[Dict]:
+    """Fetch every ad from the API, following paging cursors; creatives and insights optionally via cached batch requests."""
+    try:
+        return fetch_ads(params['access_token'], api_url, params['fields'], limit=params.get('limit', 100),
+                         batched=batched)
+    except GraphError as e:
+        logging.error(f"Failed to retrieve data: {e}")
         return []
-    
-    data = response.json()
-    ads_data = []
-    for ad in data.get('data', []):
-        creative = ad.get('creative', {})
-        ads_data.append({
-            'id': ad.get('id'),
-            'title': creative.get('title'),
-            'body': creative.get('body'),
-            'image_url': creative.get('image_url'),
-            'call_to_action_type': creative.get('call_to_action_type')
-        })
-    return ads_data
-
-def connect_to_snowflake(config: configparser.ConfigParser) -> snowflake.connector.SnowflakeConnection:
-    """Establish a connection to Snowflake."""
-    return snowflake.connector.connect(
-        user=config.get("snowflake", "user"),
-        password=config.get("snowflake", "password"),
-        account=config.get("snowflake", "account"),
-        warehouse=config.get("snowflake", "warehouse"),
-        schema=config.get("snowflake", "schema"),
-        role=config.get("snowflake", "role")
-    )
-
-def execute_snowflake_query(ctx: snowflake.connector.SnowflakeConnection, query_path: str) -> pd.DataFrame:
-    """Execute a Snowflake query from a file and return the results as a DataFrame."""
-    with open(query_path, 'r') as file:
-        query = file.read()
-    
-    cursor = ctx.cursor()
-    cursor.execute(query)
-    results = cursor.fetchall()
-    column_names = [column[0] for column in cursor.description]
-    return pd.DataFrame(results, columns=column_names)
 
 def process_snowflake_data(df: pd.DataFrame) -> pd.DataFrame:
     """Process Snowflake data: filter for Black or African American and pivot the data to sum Sessions and Referrals."""
@@ -88,10 +56,17 @@ def process_snowflake_data(df: pd.DataFrame) -> pd.DataFrame:
     
     return df_pivoted
 
-def create_ad_leaderboard(merged_df: pd.DataFrame, output_dir: Path, max_ads: int = 50):
+def create_ad_leaderboard(merged_df: pd.DataFrame, output_dir: Path, max_ads: int = 50,
+                          image_cache: ImageCache = None):
     """Create a leaderboard of Facebook ads with their statistics, sorted by sessions."""
     # Sort ads by sessions in descending order
     sorted_df = merged_df.sort_values(by='sessions', ascending=False).head(max_ads)
+    image_urls = sorted_df['image_url'].where(sorted_df['image_url'].notna(), PLACEHOLDER_URL)
+
+    # Download every creative up front (cached thumbnails are reused without any network call)
+    image_cache = image_cache or ImageCache()
+    image_cache.prefetch(list(image_urls) + [PLACEHOLDER_URL])
+    logging.info(f"Ad images: {image_cache.stats}")
     
     num_ads = len(sorted_df)
     rows = (num_ads + 2) // 3  # Number of rows in the grid, rounded up
@@ -103,11 +78,12 @@ def create_ad_leaderboard(merged_df: pd.DataFrame, output_dir: Path, max_ads: in
     for idx, (_, ad) in enumerate(sorted_df.iterrows()):
         ax = fig.add_subplot(gs[idx // 3, idx % 3])
         
-        # Load and display the image
-        image_url = ad['image_url'] if pd.notna(ad['image_url']) else 'https://www.nomadfoods.com/wp-content/uploads/2018/08/placeholder-1-e1533569576673-1500x1500.png'
-        response = requests.get(image_url)
-        img = Image.open(BytesIO(response.content))
-        ax.imshow(img)
+        # Display the cached thumbnail, falling back to the placeholder if the creative could not be fetched
+        img = image_cache.load(image_urls.iloc[idx])
+        if img is None:
+            img = image_cache.load(PLACEHOLDER_URL)
+        if img is not None:
+            ax.imshow(img)
 
         # Add semi-transparent overlay for better text visibility
         overlay = patches.Rectangle((0, 0), 1, 1, transform=ax.transAxes, alpha=0.6, facecolor='white')
@@ -154,15 +130,15 @@ def main():
     }
     
     # Fetch and process Facebook Ads data
-    ads_data = fetch_facebook_ads_data(api_url, params)
+    ads_data = fetch_facebook_ads_data(api_url, params,
+                                       batched=config.getboolean("facebook", "batch_requests", fallback=True))
     if not ads_data:
         logging.error("No data returned from the Facebook API.")
         return
     df_facebook = pd.DataFrame(ads_data)
     
     # Connect to Snowflake and fetch data
-    with connect_to_snowflake(config) as ctx:
-        df_snowflake = execute_snowflake_query(ctx, script_dir / 'fb.sql')
+    df_snowflake = query_file(script_dir / 'fb.sql', max_age=6 * 3600, config=config)
     
     # Process Snowflake data
     df_snowflake_processed = process_snowflake_data(df_snowflake)
@@ -178,11 +154,19 @@ def main():
     output_dir = script_dir / 'output'
     output_dir.mkdir(exist_ok=True)
     
-    create_ad_leaderboard(merged_df, output_dir)
+    # Tiles render on every core and are reused between runs; the single-figure version is kept as a fallback
+    if config.getboolean("leaderboard", "tiled", fallback=True):
+        create_tiled_ad_leaderboard(merged_df, output_dir / "ad_leaderboard.png")
+    else:
+        create_ad_leaderboard(merged_df, output_dir)
     
     # Save the merged DataFrame to a CSV file
     merged_df.to_csv(output_dir / 'output_merged.csv', index=False)
     logging.info(f"Merged data saved to {output_dir / 'output_merged.csv'}")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render the Facebook ad leaderboard.")
+    parser.add_argument('--refresh', action='store_true', help="Re-run fb.sql instead of using a cached result")
+    if parser.parse_args().refresh:
+        request_refresh()
     main()
@@ -0,0 +1,530 @@
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import argparse
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlencode
+
+import requests
+from requests.adapters import HTTPAdapter
+
+GRAPH_URL = "https://graph.facebook.com"
+API_VERSION = "v20.0"
+SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
+CACHE_DIR = os.path.join(SCRIPT_DIR, '.graph_cache')
+BATCH_SIZE = 50
+# Creatives rarely change once an ad is live; insights move through the day
+CACHE_TTLS = {'creative': 7 * 24 * 3600, 'insights': 3600}
+
+# Graph error codes that mean "slow down" rather than "this request is wrong"
+THROTTLE_CODES = {4, 17, 32, 613, 80000, 80001, 80002, 80003, 80004, 80005, 80006, 80008, 80009, 80014}
+USAGE_HEADERS = ('x-business-use-case-usage', 'x-ad-account-usage', 'x-app-usage')
+
+
+class GraphError(Exception):
+    pass
+
+
+def _usage(headers) -> Tuple[float, float]:
+    """Highest usage percentage and longest regain-access wait (seconds) reported in the rate-limit headers."""
+    percent, regain = 0.0, 0.0
+    for name in USAGE_HEADERS:
+        raw = headers.get(name)
+        if not raw:
+            continue
+        try:
+            payload = json.loads(raw)
+        except ValueError:
+            continue
+        # Business use case usage is {account_id: [ {...}, ... ]}; the others are a flat object
+        entries = [entry for value in payload.values() for entry in value] if name == 'x-business-use-case-usage' else [payload]
+        for entry in entries:
+            for key in ('call_count', 'total_time', 'total_cputime', 'acc_id_util_pct'):
+                percent = max(percent, float(entry.get(key, 0) or 0))
+            regain = max(regain, float(entry.get('estimated_time_to_regain_access', 0) or 0) * 60)
+    return percent, regain
+
+
+class GraphClient:
+    """Thread-safe Graph API client on one pooled HTTP session, pacing itself from the rate-limit headers."""
+
+    def __init__(self, access_token: str, api_version: str = API_VERSION, base_url: str = GRAPH_URL,
+                 max_workers: int = 8, max_retries: int = 5, backoff: float = 2.0, max_pause: float = 300,
+                 timeout: float = 60):
+        self.access_token = access_token
+        self.base_url = f"{base_url.rstrip('/')}/{api_version}"
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_pause = max_pause
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers + 1)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self._lock = threading.Lock()
+        self._resume_at = 0.0
+        self.requests = 0
+        self.sub_requests = 0
+
+    def _url(self, path: str) -> str:
+        return path if path.startswith('http') else f"{self.base_url}/{path.lstrip('/')}"
+
+    def _pause(self, seconds: float):
+        with self._lock:
+            self._resume_at = max(self._resume_at, time.monotonic() + min(seconds, self.max_pause))
+
+    def _wait_for_capacity(self):
+        with self._lock:
+            delay = self._resume_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def _adapt(self, headers):
+        percent, regain = _usage(headers)
+        if regain:
+            self._pause(regain)
+        elif percent >= 75:
+            # Slow down smoothly as usage approaches the cap instead of running into it
+            self._pause((percent - 75) / 25 * self.max_pause / 10)
+
+    def request(self, method: str, path: str, params: Optional[Dict] = None, data: Optional[Dict] = None) -> Dict:
+        """Make one Graph call, retrying throttling and server errors with exponential backoff."""
+        url = self._url(path)
+        params = dict(params or {})
+        if 'access_token=' not in url:
+            params.setdefault('access_token', self.access_token)
+        for attempt in range(self.max_retries + 1):
+            self._wait_for_capacity()
+            with self._lock:
+                self.requests += 1
+            try:
+                response = self.session.request(method, url, params=params, data=data, timeout=self.timeout)
+            except requests.RequestException as e:
+                error = str(e)
+            else:
+                self._adapt(response.headers)
+                try:
+                    body = response.json() if response.content else {}
+                except ValueError:
+                    # Not Graph answering (e.g. a gateway's HTML error page), so worth another try
+                    body = None
+                if response.status_code == 200 and body is not None:
+                    return body
+                if body is None:
+                    error = f"{response.status_code}: non-JSON response {response.text[:200]!r}"
+                else:
+                    code = body.get('error', {}).get('code') if isinstance(body, dict) else None
+                    error = f"{response.status_code}: {body.get('error', {}).get('message', response.text[:200]) if isinstance(body, dict) else response.text[:200]}"
+                    if response.status_code not in (429, 500, 502, 503, 504) and code not in THROTTLE_CODES:
+                        raise GraphError(error)
+            if attempt == self.max_retries:
+                raise GraphError(f"{url} failed after {self.max_retries + 1} attempts: {error}")
+            delay = self.backoff * 2 ** attempt
+            logging.warning(f"Graph request throttled or failed ({error}); retrying in {delay:.1f}s")
+            self._pause(delay)
+
+    def get(self, path: str, params: Optional[Dict] = None) -> Dict:
+        return self.request('GET', path, params)
+
+    def iter_pages(self, path: str, params: Optional[Dict] = None) -> Iterator[Dict]:
+        """Yield every item of an edge, following paging.next cursors until the last page."""
+        body = self.get(path, params)
+        while True:
+            yield from body.get('data', [])
+            next_url = body.get('paging', {}).get('next')
+            if not next_url:
+                return
+            # The next URL already carries fields, limit, cursor and token
+            body = self.get(next_url)
+
+    def _post_batch(self, relative_urls: List[str]) -> List[Optional[Dict]]:
+        with self._lock:
+            self.sub_requests += len(relative_urls)
+        batch = [{'method': 'GET', 'relative_url': url} for url in relative_urls]
+        return self.request('POST', '', data={'batch': json.dumps(batch), 'include_headers': 'false'})
+
+    def batch(self, relative_urls: List[str]) -> List[Dict]:
+        """GET many relative URLs through the batch endpoint, BATCH_SIZE per call, returning bodies in input order.
+
+        Batches run concurrently on the client's workers. Sub-requests that were throttled,
+        timed out or hit a server error are collected and retried together in a later round
+        with exponential backoff; any other sub-request error raises GraphError.
+        """
+        results: List[Optional[Dict]] = [None] * len(relative_urls)
+        pending = list(range(len(relative_urls)))
+        for attempt in range(self.max_retries + 1):
+            chunks = [pending[i:i + BATCH_SIZE] for i in range(0, len(pending), BATCH_SIZE)]
+            retry, error = [], None
+            with ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(chunks)))) as executor:
+                responses = executor.map(self._post_batch, [[relative_urls[i] for i in chunk] for chunk in chunks])
+                for chunk, chunk_responses in zip(chunks, responses):
+                    for index, response in zip(chunk, chunk_responses):
+                        # Graph returns null for sub-requests it did not get to before timing out
+                        body = json.loads(response['body']) if response and response.get('body') else {}
+                        if response and response.get('code') == 200:
+                            results[index] = body
+                            continue
+                        status = response.get('code') if response else None
+                        code = body.get('error', {}).get('code') if isinstance(body, dict) else None
+                        error = f"{status}: {body.get('error', {}).get('message') if isinstance(body, dict) else body}"
+                        if response and status not in (429, 500, 502, 503, 504) and code not in THROTTLE_CODES:
+                            raise GraphError(f"{relative_urls[index]} failed: {error}")
+                        retry.append(index)
+            if not retry:
+                return results
+            if attempt == self.max_retries:
+                raise GraphError(f"{len(retry)} batched requests failed after {self.max_retries + 1} attempts: {error}")
+            delay = self.backoff * 2 ** attempt
+            logging.warning(f"{len(retry)} batched requests throttled or failed ({error}); retrying in {delay:.1f}s")
+            self._pause(delay)
+            pending = retry
+
+
+def split_edge_fields(fields: str, edge: str) -> Tuple[str, Optional[str]]:
+    """Pull `<edge>{...}` out of an ads field list so the edge can be fetched separately."""
+    match = re.search(rf",?\s*{edge}\{{([^}}]*)\}}", fields)
+    if not match:
+        return fields, None
+    return (fields[:match.start()] + fields[match.end():]).strip(','), match.group(1)
+
+
+def split_insights_fields(fields: str) -> Tuple[str, Optional[str]]:
+    return split_edge_fields(fields, 'insights')
+
+
+def flatten_ad(ad: Dict) -> Dict:
+    """Flatten an ad with its creative and insights into the row shape the renderers use."""
+    creative = ad.get('creative', {})
+    insights = (ad.get('insights', {}).get('data') or [{}])[0]
+    return {
+        'id': ad.get('id'),
+        'title': creative.get('title'),
+        'body': creative.get('body'),
+        'image_url': creative.get('image_url'),
+        'call_to_action_type': creative.get('call_to_action'),
+        'reach': insights.get('reach'),
+        'impressions': insights.get('impressions'),
+        'clicks': insights.get('clicks'),
+    }
+
+
+def stream_ads(client: GraphClient, ads_path: str, fields: str, limit: int = 100,
+               max_workers: Optional[int] = None) -> Iterator[Dict]:
+    """Stream flattened ads from an ad account or ad set `ads` edge.
+
+    Ad pages are followed cursor by cursor. If `fields` asks for insights, each ad's insights
+    edge is fetched on a bounded thread pool while later pages are still being read, and ads
+    are yielded as soon as their insights arrive (so not necessarily in page order).
+    """
+    ad_fields, insights_fields = split_insights_fields(fields)
+    ads = client.iter_pages(ads_path, {'fields': ad_fields, 'limit': limit})
+    if insights_fields is None:
+        yield from (flatten_ad(ad) for ad in ads)
+        return
+
+    def with_insights(ad):
+        ad['insights'] = client.get(f"{ad['id']}/insights", {'fields': insights_fields})
+        return flatten_ad(ad)
+
+    max_workers = max_workers or client.max_workers
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = set()
+        for ad in ads:
+            pending.add(executor.submit(with_insights, ad))
+            # Bound the work in flight so a huge account doesn't queue every ad up front
+            if len(pending) >= max_workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                yield from (future.result() for future in done)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            yield from (future.result() for future in done)
+
+
+class EdgeCache:
+    """Per-ad JSON cache of one edge (creative or insights) for one field list, expiring after `ttl` seconds.
+
+    Expired entries are dropped when the cache is saved, so ads that stop appearing don't linger.
+    """
+
+    def __init__(self, edge: str, fields: str, ttl: float, cache_dir: str = CACHE_DIR):
+        digest = hashlib.sha1(fields.encode()).hexdigest()[:12]
+        self.path = os.path.join(cache_dir, f"{edge}_{digest}.json")
+        self.ttl = ttl
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def fresh(self, ad_ids: List[str]) -> Dict[str, Dict]:
+        cutoff = time.time() - self.ttl
+        return {ad_id: self.entries[ad_id]['data'] for ad_id in ad_ids
+                if ad_id in self.entries and self.entries[ad_id]['fetched_at'] >= cutoff}
+
+    def update(self, fetched: Dict[str, Dict]):
+        now = time.time()
+        self.entries.update({ad_id: {'fetched_at': now, 'data': data} for ad_id, data in fetched.items()})
+
+    def prune(self):
+        cutoff = time.time() - self.ttl
+        self.entries = {ad_id: entry for ad_id, entry in self.entries.items() if entry['fetched_at'] >= cutoff}
+
+    def save(self):
+        self.prune()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(f"{self.path}.tmp", 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f)
+        os.replace(f"{self.path}.tmp", self.path)
+
+
+def _resolve_edge(client: GraphClient, cache: Optional[EdgeCache], ad_ids: List[str], relative_url) -> Dict[str, Dict]:
+    known = cache.fresh(ad_ids) if cache else {}
+    missing = [ad_id for ad_id in ad_ids if ad_id not in known]
+    if missing:
+        fetched = dict(zip(missing, client.batch([relative_url(ad_id) for ad_id in missing])))
+        if cache:
+            cache.update(fetched)
+        known.update(fetched)
+    return known
+
+
+def stream_ads_batched(client: GraphClient, ads_path: str, fields: str, limit: int = 100,
+                       cache_dir: Optional[str] = CACHE_DIR, ttls: Dict[str, float] = CACHE_TTLS) -> Iterator[Dict]:
+    """Stream flattened ads, fetching creatives and insights through batch requests instead of per ad.
+
+    The `ads` edge is paged for IDs (and any plain fields) only. Creatives and insights are then
+    fetched for BATCH_SIZE ads per HTTP call and cached separately, so a rerun inside an edge's
+    TTL makes no calls for it. Pass `cache_dir=None` to skip the caches.
+    """
+    ad_fields, insights_fields = split_edge_fields(fields, 'insights')
+    ad_fields, creative_fields = split_edge_fields(ad_fields, 'creative')
+    caches = {}
+    if cache_dir:
+        if creative_fields is not None:
+            caches['creative'] = EdgeCache('creative', creative_fields, ttls['creative'], cache_dir)
+        if insights_fields is not None:
+            caches['insights'] = EdgeCache('insights', insights_fields, ttls['insights'], cache_dir)
+
+    def resolve(ads):
+        ad_ids = [ad['id'] for ad in ads]
+        if creative_fields is not None:
+            query = urlencode({'fields': f"creative{{{creative_fields}}}"})
+            creatives = _resolve_edge(client, caches.get('creative'), ad_ids, lambda ad_id: f"{ad_id}?{query}")
+            for ad in ads:
+                ad['creative'] = creatives[ad['id']].get('creative', {})
+        if insights_fields is not None:
+            query = urlencode({'fields': insights_fields})
+            insights = _resolve_edge(client, caches.get('insights'), ad_ids, lambda ad_id: f"{ad_id}/insights?{query}")
+            for ad in ads:
+                ad['insights'] = insights[ad['id']]
+        return [flatten_ad(ad) for ad in ads]
+
+    # Enough ads to keep every worker busy with a full batch
+    group_size = BATCH_SIZE * client.max_workers
+    try:
+        group = []
+        for ad in client.iter_pages(ads_path, {'fields': ad_fields or 'id', 'limit': limit}):
+            group.append(ad)
+            if len(group) >= group_size:
+                yield from resolve(group)
+                group = []
+        if group:
+            yield from resolve(group)
+    finally:
+        for cache in caches.values():
+            cache.save()
+
+
+def _client_for(access_token: str, url: str, **client_options) -> Tuple[GraphClient, str]:
+    match = re.match(r"(https?://[^/]+)/(v[\d.]+)/(.+)", url)
+    base_url, api_version, path = match.groups() if match else (GRAPH_URL, API_VERSION, url)
+    return GraphClient(access_token, api_version=api_version, base_url=base_url, **client_options), path
+
+
+def fetch_ads(access_token: str, ads_url: str, fields: str, limit: int = 100, batched: bool = False,
+              cache_dir: Optional[str] = CACHE_DIR, **client_options) -> List[Dict]:
+    """Fetch every ad behind an `ads` edge URL, e.g. https://graph.facebook.com/v20.0/act_<id>/ads.
+
+    With `batched`, creatives and insights go through cached batch requests (stream_ads_batched)
+    rather than one insights call per ad.
+    """
+    client, path = _client_for(access_token, ads_url, **client_options)
+    if batched:
+        ads = list(stream_ads_batched(client, path, fields, limit, cache_dir))
+    else:
+        ads = list(stream_ads(client, path, fields, limit))
+    logging.info(f"Fetched {len(ads)} ads in {client.requests} Graph requests ({client.sub_requests} batched)")
+    return ads
+
+
+def fetch_daily_insights(access_token: str, ads_url: str, ad_ids: List[str], since: Optional[str] = None,
+                         until: Optional[str] = None, fields: str = 'impressions,clicks',
+                         **client_options) -> List[Dict]:
+    """Daily insights rows ({'ad_id', 'date', <fields>}) for the given ads, fetched through batch requests.
+
+    `since`/`until` are YYYY-MM-DD; without `since` the ads' whole lifetime is returned. Only ask
+    for metrics that add up across days: daily reach rows can't be summed into a total reach.
+    """
+    client, _ = _client_for(access_token, ads_url, **client_options)
+    query = {'fields': fields, 'time_increment': 1, 'limit': 500}
+    if since:
+        query['time_range'] = json.dumps({'since': since, 'until': until or time.strftime('%Y-%m-%d')})
+    else:
+        query['date_preset'] = 'maximum'
+    encoded = urlencode(query)
+    rows = []
+    for ad_id, body in zip(ad_ids, client.batch([f"{ad_id}/insights?{encoded}" for ad_id in ad_ids])):
+        pages = [body]
+        # Each batched response is only the first page; follow any cursors directly
+        while pages[-1].get('paging', {}).get('next'):
+            pages.append(client.get(pages[-1]['paging']['next']))
+        rows.extend({'ad_id': ad_id, 'date': day.get('date_start'), **{f: day.get(f) for f in fields.split(',')}}
+                    for page in pages for day in page.get('data', []))
+    logging.info(f"Fetched {len(rows)} daily insights rows for {len(ad_ids)} ads in {client.requests} Graph requests")
+    return rows
+
+
+def _recorded_pages(ads: int, page_size: int) -> Dict:
+    """Synthetic stand-in for recorded Graph responses: ads pages plus one insights payload per ad."""
+    records = {}
+    ids = [f"2385{i:08d}" for i in range(ads)]
+    for page, start in enumerate(range(0, ads, page_size)):
+        records[('ads', page)] = [{
+            'id': ad_id,
+            'creative': {'title': f"Ad {ad_id}", 'body': f"Body {ad_id}", 'image_url': f"https://img.example/{ad_id}.png"},
+        } for ad_id in ids[start:start + page_size]]
+    for i, ad_id in enumerate(ids):
+        records[('insights', ad_id)] = [{'reach': str(100 + i), 'impressions': str(1000 + i), 'clicks': str(i)}]
+    return records
+
+
+def _mock_graph_server(records: Dict, page_size: int, latency: float = 0.0, throttle_every: int = 0):
+    """Local HTTP server replaying recorded pages, with usage headers and periodic 429s.
+
+    Also answers POSTed batch requests. `latency` is paid once per HTTP request, and
+    `throttle_every` throttles every Nth request and every Nth batched sub-request.
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import parse_qs, urlparse
+
+    stats = {'requests': 0, 'sub_requests': 0}
+    lock = threading.Lock()
+    pages = sum(1 for key in records if key[0] == 'ads')
+    creatives = {ad['id']: ad['creative'] for key, ads in records.items() if key[0] == 'ads' for ad in ads}
+    throttled = {'error': {'code': 17, 'message': 'User request limit reached'}}
+
+    def count(key):
+        with lock:
+            stats[key] += 1
+            return stats[key]
+
+    def resolve(path: str, host: str):
+        url = urlparse(path)
+        query = parse_qs(url.query)
+        fields = query.get('fields', [''])[0]
+        parts = url.path.strip('/').split('/')
+        if parts[-1] == 'ads':
+            page = int(query.get('after', ['0'])[0])
+            data = records[('ads', page)]
+            if 'creative' not in fields:
+                data = [{'id': ad['id']} for ad in data]
+            body = {'data': data}
+            if page + 1 < pages:
+                body['paging'] = {'next': f"{host}{url.path}?{urlencode({'fields': fields})}&limit={page_size}"
+                                          f"&after={page + 1}&access_token=test"}
+            return 200, body
+        if parts[-1] == 'insights':
+            return 200, {'data': records[('insights', parts[-2])]}
+        if parts[-1] in creatives:
+            return 200, {'id': parts[-1], 'creative': creatives[parts[-1]]}
+        return 404, {'error': {'code': 100, 'message': 'Unknown path'}}
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _reply(self, status, body, usage=10):
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.send_header('x-app-usage', json.dumps({'call_count': usage, 'total_time': usage, 'total_cputime': usage}))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            number = count('requests')
+            time.sleep(latency)
+            if throttle_every and number % throttle_every == 0:
+                return self._reply(429, throttled, usage=100)
+            return self._reply(*resolve(self.path, f"http://{self.headers['Host']}"))
+
+        def do_POST(self):
+            number = count('requests')
+            form = parse_qs(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode())
+            time.sleep(latency)
+            if throttle_every and number % throttle_every == 0:
+                return self._reply(429, throttled, usage=100)
+            responses = []
+            for sub in json.loads(form['batch'][0]):
+                if throttle_every and count('sub_requests') % throttle_every == 0:
+                    status, body = 400, throttled
+                else:
+                    status, body = resolve(f"/{API_VERSION}/{sub['relative_url']}", f"http://{self.headers['Host']}")
+                responses.append({'code': status, 'body': json.dumps(body)})
+            return self._reply(200, responses)
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, stats
+
+
+def self_test(ads: int = 450, page_size: int = 100, latency: float = 0.02, throttle_every: int = 40) -> Dict:
+    """Fetch the same recorded ads per ad, batched and batched again from a warm cache, counting server requests."""
+    import tempfile
+
+    records = _recorded_pages(ads, page_size)
+    fields = 'id,creative{title,body,image_url},insights{reach,impressions,clicks}'
+    expected = {ad['id']: flatten_ad({**ad, 'insights': {'data': records[('insights', ad['id'])]}})
+                for key, page in records.items() if key[0] == 'ads' for ad in page}
+    report = {}
+    with tempfile.TemporaryDirectory() as cache_dir:
+        for mode, batched in (('per_ad', False), ('batched', True), ('batched_warm', True)):
+            server, stats = _mock_graph_server(records, page_size, latency, throttle_every)
+            try:
+                start = time.perf_counter()
+                rows = fetch_ads('test', f"http://127.0.0.1:{server.server_address[1]}/{API_VERSION}/act_1/ads",
+                                 fields, limit=page_size, batched=batched, cache_dir=cache_dir,
+                                 backoff=0.05, max_pause=2)
+                report[mode] = {
+                    'ads': len(rows),
+                    'matches': {row['id']: row for row in rows} == expected,
+                    'server_requests': stats['requests'],
+                    'sub_requests': stats['sub_requests'],
+                    'seconds': round(time.perf_counter() - start, 2),
+                }
+            finally:
+                server.shutdown()
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Paginated, concurrent Facebook Graph API ads fetcher.")
+    parser.add_argument('--self-test', action='store_true',
+                        help="Compare per-ad and batched fetching against a local mock Graph server")
+    parser.add_argument('--ads', type=int, default=450)
+    parser.add_argument('--latency', type=float, default=0.02)
+    args = parser.parse_args()
+
+    if args.self_test:
+        logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+        for mode, result in self_test(args.ads, latency=args.latency).items():
+            print(f"{mode}: {result}")
+    else:
+        parser.print_help()
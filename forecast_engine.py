@@ -0,0 +1,457 @@
+import os
+import time
+import argparse
+from itertools import product
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
+ALL = "All"
+KEY_COLUMNS = ["THERAPY_AREA", "PRIMARY_INDICATION", "COUNTRY"]
+
+# CPR weighting for protocol complexity, as offered in the forecast tool
+PROTOCOL_COMPLEXITY = {
+    "Lowest": -0.3,
+    "Low": -0.2,
+    "Mid": 0,
+    "High": 0.25,
+    "Highest": 1,
+}
+# Patients per site per month mapped linearly onto the No. Sites CPR weighting, clamped at both ends
+ENROLLMENT_RATE_RANGE = (0.01, 10)
+NUM_SITES_MULTIPLIER_RANGE = (0, 2)
+
+# Batch scenario inputs and the values the forecast tool starts with; percentages are 0-100
+SCENARIO_DEFAULTS = {
+    "therapy_area": ALL,
+    "primary_indication": ALL,
+    "total_patient_goal": 10,
+    "dtp_contribution": 10,
+    "recruitment_duration": 6,
+    "protocol_complexity": "Mid",
+    "countries": "",
+    "fov_rate": 4.0,
+    "consent_rate": 85.0,
+    "screen_fail_rate": 50.0,
+}
+
+
+class CprCube:
+    """Cost and referral totals for every therapy area × primary indication × country, with "All" rollups.
+
+    Built once from the historical study data; every filter combination the forecast tool can
+    ask for is then a dictionary lookup instead of a boolean mask over the full frame.
+    """
+
+    def __init__(self, cells: Dict[Tuple[str, str, str], Tuple[float, float, float, int]],
+                 therapy_area_to_indications: Dict[str, List[str]]):
+        # (therapy area, indication, country) -> (costs, referrals, COUNTRY_CPR sum, COUNTRY_CPR count)
+        self.cells = cells
+        self.therapy_area_to_indications = therapy_area_to_indications
+        self._country_tables = {}
+
+    def totals(self, therapy_area: str = ALL, primary_indication: str = ALL, country: str = ALL) -> Tuple[float, float]:
+        """Summed costs and referrals for a filter combination (zeros if no rows match)."""
+        costs, referrals, _, _ = self.cells.get((therapy_area, primary_indication, country), (0.0, 0.0, 0.0, 0))
+        return costs, referrals
+
+    def cpr(self, therapy_area: str = ALL, primary_indication: str = ALL) -> float:
+        """Pooled cost per referral: summed costs over summed referrals."""
+        costs, referrals = self.totals(therapy_area, primary_indication)
+        return costs / referrals if referrals else np.nan
+
+    def country_cpr(self, therapy_area: str, primary_indication: str, country: str) -> float:
+        """Mean COUNTRY_CPR of the matching rows, NaN when the country has no history under the filter."""
+        _, _, cpr_sum, cpr_count = self.cells.get((therapy_area, primary_indication, country), (0.0, 0.0, 0.0, 0))
+        return cpr_sum / cpr_count if cpr_count else np.nan
+
+    def country_cprs(self, therapy_area: str, primary_indication: str) -> pd.Series:
+        """Mean COUNTRY_CPR per ISO code under a filter, as one lookup table. Built on first use, then reused."""
+        key = (therapy_area, primary_indication)
+        if key not in self._country_tables:
+            table = {country: cpr_sum / cpr_count
+                     for (area, indication, country), (_, _, cpr_sum, cpr_count) in self.cells.items()
+                     if area == therapy_area and indication == primary_indication and country != ALL and cpr_count}
+            self._country_tables[key] = pd.Series(table, dtype=float)
+        return self._country_tables[key]
+
+    @property
+    def therapy_areas(self) -> List[str]:
+        return list(self.therapy_area_to_indications)
+
+
+def build_cpr_cube(data: pd.DataFrame) -> CprCube:
+    """Aggregate the historical data over every grouping set of therapy area, indication and country."""
+    frame = data[KEY_COLUMNS].copy()
+    frame["COSTS"] = pd.to_numeric(data["COSTS"], errors="coerce")
+    frame["REFERRALS"] = pd.to_numeric(data["REFERRALS"], errors="coerce")
+    frame["COUNTRY_CPR"] = pd.to_numeric(data["COUNTRY_CPR"], errors="coerce")
+
+    cells = {}
+    # Each key column is either grouped on or rolled up to "All": 2^3 grouping sets
+    for rolled_up in product((False, True), repeat=len(KEY_COLUMNS)):
+        by = [column for column, rolled in zip(KEY_COLUMNS, rolled_up) if not rolled]
+        aggregations = dict(costs=("COSTS", "sum"), referrals=("REFERRALS", "sum"),
+                            cpr_sum=("COUNTRY_CPR", "sum"), cpr_count=("COUNTRY_CPR", "count"))
+        if by:
+            grouped = frame.groupby(by, dropna=False).agg(**aggregations)
+        else:
+            grouped = frame.groupby(lambda _: ALL).agg(**aggregations)
+        for key, row in zip(grouped.index, grouped.itertuples(index=False)):
+            key = key if isinstance(key, tuple) else (key,)
+            values = iter(key)
+            cell = tuple(ALL if rolled else next(values) for rolled in rolled_up)
+            cells[cell] = (float(row.costs), float(row.referrals), float(row.cpr_sum), int(row.cpr_count))
+
+    pairs = data[["THERAPY_AREA", "PRIMARY_INDICATION"]].drop_duplicates()
+    therapy_area_to_indications = {area: list(indications) for area, indications
+                                   in pairs.groupby("THERAPY_AREA", sort=False)["PRIMARY_INDICATION"]}
+    return CprCube(cells, therapy_area_to_indications)
+
+
+def num_sites_multiplier(enrollment_rate):
+    """No. Sites CPR weighting for an enrollment rate (scalar or array)."""
+    return np.interp(enrollment_rate, ENROLLMENT_RATE_RANGE, NUM_SITES_MULTIPLIER_RANGE)
+
+
+def enrollment_rate(dtp_volume, num_sites, recruitment_duration):
+    """DtP patients per site per month; 0 where no sites are selected."""
+    num_sites = np.asarray(num_sites, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rate = np.asarray(dtp_volume, dtype=float) / (num_sites * recruitment_duration)
+    return np.where(num_sites > 0, rate, 0.0)
+
+
+def country_markups(country_cprs: pd.Series, countries) -> pd.Series:
+    """Each country's CPR markup over the US, as a fraction; +100% for countries without history."""
+    us_cpr = country_cprs.get('US', np.nan)
+    known = country_cprs.reindex(countries)
+    return ((known - us_cpr) / us_cpr).where(known.notna(), 1.0)
+
+
+def funnel(rands, final_cpr, fov_rate, consent_rate, screen_fail_rate) -> Dict[str, np.ndarray]:
+    """Work back from randomisations through the funnel. Rates are fractions; scalars or arrays."""
+    rand_rate = 1 - np.asarray(screen_fail_rate, dtype=float)
+    conversion = np.asarray(fov_rate, dtype=float) * consent_rate * rand_rate
+    cost_per_patient = np.asarray(final_cpr, dtype=float) / conversion
+    return {
+        "referrals": rands / conversion,
+        "fovs": rands / consent_rate / rand_rate,
+        "consents": rands / rand_rate,
+        "cost_per_patient": cost_per_patient,
+        "budget": rands * cost_per_patient,
+    }
+
+
+def parse_country_sites(value: Union[str, Dict[str, int], None]) -> Dict[str, int]:
+    """ISO code -> sites from a dict or a "US:3;GB:1" string (a bare code counts as one site)."""
+    if isinstance(value, dict):
+        return {country: int(sites) for country, sites in value.items()}
+    if not isinstance(value, str):
+        return {}
+    country_sites = {}
+    for item in value.replace(',', ';').split(';'):
+        country, _, sites = item.strip().partition(':')
+        if country:
+            country_sites[country.strip().upper()] = int(sites) if sites.strip() else 1
+    return country_sites
+
+
+def forecast_scenario(cube: CprCube, therapy_area: str = ALL, primary_indication: str = ALL,
+                      total_patient_goal: float = 10, dtp_contribution: float = 10, recruitment_duration: float = 6,
+                      protocol_complexity: str = "Mid", country_sites: Dict[str, int] = None,
+                      fov_rate: float = 4.0, consent_rate: float = 85.0, screen_fail_rate: float = 50.0) -> Dict:
+    """The forecast tool's calculation for one study, with every intermediate value it displays.
+
+    Percentages are 0-100 as entered in the tool. Returns the CPR weightings, the country table
+    (see country_table), the final CPR and the funnel and budget.
+    """
+    country_sites = country_sites or {}
+    rands = total_patient_goal * (dtp_contribution / 100)
+    num_sites = sum(country_sites.values())
+    rate = float(enrollment_rate(rands, num_sites, recruitment_duration))
+    sites_multiplier = float(num_sites_multiplier(rate))
+    complexity_multiplier = PROTOCOL_COMPLEXITY[protocol_complexity]
+    initial_cpr = cube.cpr(therapy_area, primary_indication)
+    cpr = initial_cpr * (1 + complexity_multiplier) * (1 + sites_multiplier)
+    countries, final_cpr = country_table(cube, therapy_area, primary_indication, country_sites, cpr, rands)
+    return {
+        "rands": rands,
+        "num_sites": num_sites,
+        "enrollment_rate": rate,
+        "num_sites_multiplier": sites_multiplier,
+        "protocol_complexity_multiplier": complexity_multiplier,
+        "initial_cpr": initial_cpr,
+        "cpr": cpr,
+        "countries": countries,
+        "final_cpr": final_cpr,
+        **{name: float(value) for name, value in funnel(rands, final_cpr, fov_rate / 100, consent_rate / 100,
+                                                        screen_fail_rate / 100).items()},
+    }
+
+
+def forecast_batch(cube: CprCube, scenarios: pd.DataFrame) -> pd.DataFrame:
+    """Price a table of study scenarios in one vectorized pass.
+
+    Columns are those of SCENARIO_DEFAULTS (missing ones take the tool's defaults), with
+    `countries` as a "US:3;GB:1" string or an ISO -> sites dict. Returns the scenarios with
+    rands, num_sites, enrollment_rate, the CPR weightings, initial_cpr, cpr, final_cpr,
+    referrals, fovs, consents, cost_per_patient and budget added.
+    """
+    frame = scenarios.assign(**{column: default for column, default in SCENARIO_DEFAULTS.items()
+                                if column not in scenarios.columns})
+    unknown = set(frame["protocol_complexity"]) - set(PROTOCOL_COMPLEXITY)
+    if unknown:
+        raise ValueError(f"Unknown protocol complexity {sorted(unknown)}; expected one of {list(PROTOCOL_COMPLEXITY)}")
+    n = len(frame)
+    numbers = {column: frame[column].to_numpy(dtype=float) for column in
+               ("total_patient_goal", "dtp_contribution", "recruitment_duration",
+                "fov_rate", "consent_rate", "screen_fail_rate")}
+
+    # One row per (scenario, selected country), so country markups are a grouped lookup
+    parsed = [parse_country_sites(value) for value in frame["countries"]]
+    selections = pd.DataFrame({
+        "scenario": np.repeat(np.arange(n), [len(country_sites) for country_sites in parsed]),
+        "country": [country for country_sites in parsed for country in country_sites],
+        "sites": [sites for country_sites in parsed for sites in country_sites.values()],
+    }, columns=["scenario", "country", "sites"])
+    selections["sites"] = selections["sites"].astype(float)
+    num_sites = np.bincount(selections["scenario"], weights=selections["sites"], minlength=n)
+
+    rands = numbers["total_patient_goal"] * numbers["dtp_contribution"] / 100
+    rate = enrollment_rate(rands, num_sites, numbers["recruitment_duration"])
+    sites_multiplier = num_sites_multiplier(rate)
+    complexity_multiplier = frame["protocol_complexity"].map(PROTOCOL_COMPLEXITY).to_numpy(dtype=float)
+
+    filters = pd.MultiIndex.from_arrays([frame["therapy_area"], frame["primary_indication"]])
+    unique_filters = filters.unique()
+    initial_cpr = pd.Series([cube.cpr(area, indication) for area, indication in unique_filters],
+                            index=unique_filters, dtype=float).reindex(filters).to_numpy()
+    cpr = initial_cpr * (1 + complexity_multiplier) * (1 + sites_multiplier)
+
+    # Final CPR = cpr x site-weighted mean of (1 + markup) over the scenario's countries
+    markup = np.empty(len(selections))
+    area_of = frame["therapy_area"].to_numpy()[selections["scenario"]]
+    indication_of = frame["primary_indication"].to_numpy()[selections["scenario"]]
+    for (area, indication), rows in selections.groupby([area_of, indication_of], sort=False).indices.items():
+        markup[rows] = country_markups(cube.country_cprs(area, indication), selections["country"].to_numpy()[rows]).to_numpy()
+    weight = selections["sites"].to_numpy() / num_sites[selections["scenario"]]
+    final_cpr = cpr * np.bincount(selections["scenario"], weights=weight * (1 + markup), minlength=n)
+
+    outcomes = funnel(rands, final_cpr, numbers["fov_rate"] / 100, numbers["consent_rate"] / 100,
+                      numbers["screen_fail_rate"] / 100)
+    return frame.assign(rands=rands, num_sites=num_sites, enrollment_rate=rate, num_sites_multiplier=sites_multiplier,
+                        protocol_complexity_multiplier=complexity_multiplier, initial_cpr=initial_cpr, cpr=cpr,
+                        final_cpr=final_cpr, **outcomes)
+
+
+def load_history(history_path: str = None) -> pd.DataFrame:
+    """Historical study data from a CSV/Parquet export, or query.sql through the shared query cache."""
+    if history_path:
+        return pd.read_parquet(history_path) if history_path.endswith('.parquet') else pd.read_csv(history_path)
+    from snowflake_client import query_file
+    return query_file(os.path.join(SCRIPT_DIR, 'query.sql'), max_age=12 * 3600)
+
+
+def country_table(cube: CprCube, therapy_area: str, primary_indication: str, country_sites: Dict[str, int],
+                  cpr: float, dtp_volume: float) -> Tuple[pd.DataFrame, float]:
+    """Country-level markups, weighted CPRs and patient volumes for the selected countries, in one pass.
+
+    `country_sites` maps ISO code to number of sites, in selection order. Each country's CPR is
+    the weighted `cpr` moved by its markup over the US average; countries without history get
+    a +100% markup. Returns the table (indexed by ISO code, percentages as 0-100) and the final
+    CPR, the contribution-weighted average.
+    """
+    sites = pd.Series(country_sites, dtype=float)
+    markup = country_markups(cube.country_cprs(therapy_area, primary_indication), sites.index)
+    contribution = sites / sites.sum() * 100 if len(sites) else sites
+    table = pd.DataFrame({
+        'Markup': markup * 100,
+        'CPR': (1 + markup) * cpr,
+        'Patients': dtp_volume * contribution / 100,
+        'Contribution': contribution,
+    }, index=sites.index)
+    final_cpr = float((table['CPR'] * table['Contribution'] / 100).sum())
+    return table, final_cpr
+
+
+def _looped_country_table(cube: CprCube, therapy_area: str, primary_indication: str, selected_country_names: List[str],
+                          iso_to_country: Dict[str, str], cpr: float, dtp_volume: float) -> pd.DataFrame:
+    """What the app did: reverse-scan the ISO dict per country and concat one row at a time."""
+    country_sites = {}
+    for country_name in selected_country_names:
+        country = [iso for iso, name in iso_to_country.items() if name == country_name][0]
+        country_sites[country] = 1
+    total_sites = sum(country_sites.values())
+    us_cpr = cube.country_cpr(therapy_area, primary_indication, 'US')
+    results = pd.DataFrame(columns=["Country", "Markup", "CPR", "Patients", "Contribution"])
+    for country, sites in country_sites.items():
+        contribution = sites / total_sites * 100
+        country_avg_cpr = cube.country_cpr(therapy_area, primary_indication, country)
+        cpr_modifier = (country_avg_cpr - us_cpr) / us_cpr if not np.isnan(country_avg_cpr) else 1
+        row = pd.DataFrame({"Country": [country], "Markup": [cpr_modifier * 100], "CPR": [(1 + cpr_modifier) * cpr],
+                            "Patients": [dtp_volume * contribution / 100], "Contribution": [contribution]})
+        results = pd.concat([results, row], ignore_index=True)
+    return results
+
+
+def _masked_reference(data: pd.DataFrame, therapy_area: str, primary_indication: str,
+                      countries: List[str]) -> Tuple[float, float, List[float]]:
+    """What the app did per interaction: mask the frame, then the pooled CPR, US mean and country means."""
+    if therapy_area != ALL:
+        data = data[data["THERAPY_AREA"] == therapy_area]
+    if primary_indication != ALL:
+        data = data[data["PRIMARY_INDICATION"] == primary_indication]
+    cpr = data["COSTS"].sum() / data["REFERRALS"].sum()
+    us_cpr = data[data["COUNTRY"] == "US"]["COUNTRY_CPR"].mean()
+    return cpr, us_cpr, [data[data["COUNTRY"] == country]["COUNTRY_CPR"].mean() for country in countries]
+
+
+def _synthetic_history(rows: int, seed: int = 7) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    areas = {f"TA{a}": [f"TA{a} indication {i}" for i in range(8)] for a in range(10)}
+    area = rng.choice(list(areas), rows)
+    countries = np.array(["US", "GB", "DE", "FR", "ES", "IT", "PL", "CA", "AU", "JP", "BR", "MX"])
+    country = rng.choice(countries, rows, p=np.r_[0.45, np.full(11, 0.05)])
+    referrals = rng.integers(1, 400, rows).astype(float)
+    costs = referrals * rng.gamma(4.0, 60.0, rows)
+    history = pd.DataFrame({
+        "THERAPY_AREA": area,
+        "PRIMARY_INDICATION": [areas[a][i] for a, i in zip(area, rng.integers(0, 8, rows))],
+        "COUNTRY": country,
+        "REFERRALS": referrals,
+        "COSTS": costs,
+    })
+    history["COUNTRY_CPR"] = history.groupby("COUNTRY")["COSTS"].transform("sum") / \
+        history.groupby("COUNTRY")["REFERRALS"].transform("sum")
+    return history
+
+
+def _synthetic_scenarios(cube: CprCube, scenarios: int, seed: int = 7) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    areas = rng.choice([ALL] + cube.therapy_areas, scenarios)
+    countries = np.array(["US", "GB", "DE", "FR", "ES", "IT", "PL", "CA", "AU", "JP", "BR", "MX", "NZ"])
+    return pd.DataFrame({
+        "therapy_area": areas,
+        "primary_indication": [rng.choice([ALL] + cube.therapy_area_to_indications.get(area, [])) for area in areas],
+        "total_patient_goal": rng.integers(50, 2000, scenarios),
+        "dtp_contribution": rng.integers(5, 60, scenarios),
+        "recruitment_duration": rng.integers(3, 13, scenarios),
+        "protocol_complexity": rng.choice(list(PROTOCOL_COMPLEXITY), scenarios),
+        "countries": [";".join(f"{country}:{rng.integers(1, 40)}" for country in
+                               rng.choice(countries, rng.integers(0, 6), replace=False)) for _ in range(scenarios)],
+        "fov_rate": rng.uniform(1, 10, scenarios).round(1),
+        "consent_rate": rng.uniform(50, 95, scenarios).round(1),
+        "screen_fail_rate": rng.uniform(20, 80, scenarios).round(1),
+    })
+
+
+def benchmark(rows: int = 50_000, interactions: int = 1_000, countries: int = 60, scenarios: int = 5_000,
+              seed: int = 7) -> Dict:
+    """Replay random widget interactions through the masked path and the cube, checking they agree.
+
+    Also builds the country table for `countries` selected countries both the looped way and in
+    one pass, and prices `scenarios` studies one at a time and with forecast_batch.
+    """
+    rng = np.random.default_rng(seed)
+    data = _synthetic_history(rows, seed)
+
+    start = time.perf_counter()
+    cube = build_cpr_cube(data)
+    build_seconds = time.perf_counter() - start
+
+    choices = []
+    for _ in range(interactions):
+        area = rng.choice([ALL] + cube.therapy_areas)
+        indications = cube.therapy_area_to_indications.get(area) or \
+            [i for values in cube.therapy_area_to_indications.values() for i in values]
+        indication = rng.choice([ALL] + indications)
+        choices.append((area, indication, list(rng.choice(["US", "GB", "DE", "JP", "NZ"], 3, replace=False))))
+
+    start = time.perf_counter()
+    masked = [_masked_reference(data, *choice) for choice in choices]
+    masked_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    looked_up = [(cube.cpr(area, indication), cube.country_cpr(area, indication, "US"),
+                  [cube.country_cpr(area, indication, country) for country in countries])
+                 for area, indication, countries in choices]
+    cube_seconds = time.perf_counter() - start
+
+    # Every country in a 250-name list selected at once, as a user picking a global study would
+    iso_to_country = {f"C{i:03d}": f"Country {i}" for i in range(250)}
+    iso_to_country.update({code: f"Country {code}" for code in ["US", "GB", "DE", "FR", "ES", "IT", "PL", "CA", "AU", "JP"]})
+    selected = list(iso_to_country.values())[-countries:]
+    name_to_iso = {name: iso for iso, name in iso_to_country.items()}
+    area, indication = cube.therapy_areas[0], ALL
+
+    start = time.perf_counter()
+    looped = _looped_country_table(cube, area, indication, selected, iso_to_country, 1000.0, 20.0)
+    looped_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    table, _ = country_table(cube, area, indication, {name_to_iso[name]: 1 for name in selected}, 1000.0, 20.0)
+    table_seconds = time.perf_counter() - start
+
+    bids = _synthetic_scenarios(cube, scenarios, seed)
+    start = time.perf_counter()
+    one_at_a_time = [forecast_scenario(cube, country_sites=parse_country_sites(bid.pop("countries")), **bid)
+                     for bid in bids.to_dict("records")]
+    scenario_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    priced = forecast_batch(cube, bids)
+    batch_seconds = time.perf_counter() - start
+    outputs = ["final_cpr", "referrals", "fovs", "consents", "budget"]
+    expected = np.array([[result[column] for column in outputs] for result in one_at_a_time])
+
+    flat = lambda results: np.array([[cpr, us] + countries for cpr, us, countries in results], dtype=float)
+    return {
+        'rows': rows,
+        'interactions': interactions,
+        'cube_cells': len(cube.cells),
+        'build_seconds': round(build_seconds, 3),
+        'masked_seconds': round(masked_seconds, 3),
+        'cube_seconds': round(cube_seconds, 4),
+        'matches': bool(np.allclose(flat(masked), flat(looked_up), equal_nan=True)),
+        'countries': countries,
+        'country_loop_seconds': round(looped_seconds, 4),
+        'country_table_seconds': round(table_seconds, 4),
+        'country_table_matches': bool(np.allclose(looped[table.columns].to_numpy(float), table.to_numpy(float),
+                                                  equal_nan=True)),
+        'scenarios': scenarios,
+        'scenario_loop_seconds': round(scenario_seconds, 3),
+        'batch_seconds': round(batch_seconds, 3),
+        'batch_matches': bool(np.allclose(priced[outputs].to_numpy(float), expected, equal_nan=True)),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Headless DtP forecasting: price a table of study scenarios.")
+    parser.add_argument('scenarios_file', nargs='?', help="CSV of scenarios with columns from SCENARIO_DEFAULTS")
+    parser.add_argument('--output', help="Where to write the priced scenarios (CSV); stdout if omitted")
+    parser.add_argument('--history', help="CSV/Parquet export of query.sql to use instead of Snowflake")
+    parser.add_argument('--benchmark', action='store_true', help="Simulate widget interactions on synthetic history")
+    parser.add_argument('--rows', type=int, default=50_000)
+    parser.add_argument('--interactions', type=int, default=1_000)
+    parser.add_argument('--countries', type=int, default=60)
+    parser.add_argument('--scenarios', type=int, default=5_000)
+    parser.add_argument('--refresh', action='store_true', help="Re-run query.sql instead of using a cached result")
+    args = parser.parse_args()
+    if args.refresh:
+        from query_cache import request_refresh
+        request_refresh()
+
+    if args.benchmark:
+        for key, value in benchmark(args.rows, args.interactions, args.countries, args.scenarios).items():
+            print(f"{key}: {value}")
+    elif args.scenarios_file:
+        priced = forecast_batch(build_cpr_cube(load_history(args.history)), pd.read_csv(args.scenarios_file))
+        if args.output:
+            priced.to_csv(args.output, index=False)
+        else:
+            print(priced.to_csv(index=False), end='')
+    else:
+        parser.print_help()
@@ -0,0 +1,189 @@
+import time
+import argparse
+from itertools import product
+from typing import Dict, Tuple
+
+import numpy as np
+import pandas as pd
+
+from forecast_engine import ALL, funnel
+
+# Each funnel rate is a ratio of two query.sql columns; the rand rate is 1 - screen fail rate
+FUNNEL_RATES = {
+    'fov_rate': ('FOVS', 'REFERRALS'),
+    'consent_rate': ('CONSENTS', 'FOVS'),
+    'rand_rate': ('RANDS', 'CONSENTS'),
+}
+PERCENTILES = (10, 50, 90)
+# Fewer (therapy area, indication, country) rows than this and the fit falls back to a broader group
+MIN_ROWS = 5
+# Rates are kept off 0 and 1 so the funnel divisions stay finite
+RATE_BOUNDS = (0.001, 0.999)
+# Concentration used when a group's rates show no spread to fit a Beta from
+MAX_CONCENTRATION = 1000.0
+# Grouping columns of a fit, most to least specific; an indication is only fitted within its therapy area
+FIT_COLUMNS = ('THERAPY_AREA', 'PRIMARY_INDICATION', 'COUNTRY')
+
+
+def _history_rows(data: pd.DataFrame) -> pd.DataFrame:
+    """Per-row funnel rates and log CPR from the query.sql history, NaN where a denominator is zero."""
+    frame = data[list(FIT_COLUMNS)].copy()
+    numeric = {column: pd.to_numeric(data[column], errors='coerce')
+               for column in {'REFERRALS', 'FOVS', 'CONSENTS', 'RANDS', 'COSTS'}}
+    for rate, (numerator, denominator) in FUNNEL_RATES.items():
+        ratio = numeric[numerator] / numeric[denominator].where(numeric[denominator] > 0)
+        frame[rate] = ratio.clip(*RATE_BOUNDS)
+    cpr = numeric['COSTS'] / numeric['REFERRALS'].where(numeric['REFERRALS'] > 0)
+    frame['log_cpr'] = np.log(cpr.where(cpr > 0))
+    return frame
+
+
+def _beta_parameters(mean: float, var: float) -> Tuple[float, float]:
+    """Method-of-moments Beta(alpha, beta) for a rate's mean and variance."""
+    mean = min(max(mean, RATE_BOUNDS[0]), RATE_BOUNDS[1])
+    if not var > 0:
+        concentration = MAX_CONCENTRATION
+    else:
+        concentration = min(max(mean * (1 - mean) / var - 1, 1.0), MAX_CONCENTRATION)
+    return mean * concentration, (1 - mean) * concentration
+
+
+def fit_funnel_distributions(data: pd.DataFrame, min_rows: int = MIN_ROWS) -> Dict[Tuple[str, str, str], Dict]:
+    """Fit Beta funnel rates and a lognormal CPR for every therapy area × indication × country, with "All" rollups.
+
+    Returns {(therapy area, indication, country): {'fov_rate': (alpha, beta), 'consent_rate': ...,
+    'rand_rate': ..., 'cpr': (mu, sigma), 'rows': n}}; groups with fewer than `min_rows`
+    usable rows are left out so lookups fall back to a broader group.
+    """
+    rows = _history_rows(data)
+    fits = {}
+    for rolled_up in product((False, True), repeat=len(FIT_COLUMNS)):
+        if rolled_up[0] and not rolled_up[1]:
+            continue
+        by = [column for column, rolled in zip(FIT_COLUMNS, rolled_up) if not rolled]
+        grouped = rows.groupby(by, dropna=False) if by else rows.groupby(lambda _: ALL)
+        means, variances, counts = grouped.mean(numeric_only=True), grouped.var(numeric_only=True), grouped.count()
+        for key in means.index:
+            values = iter(key if isinstance(key, tuple) else (key,))
+            cell = tuple(ALL if rolled else next(values) for rolled in rolled_up)
+            if counts.loc[key, list(FUNNEL_RATES) + ['log_cpr']].min() < min_rows:
+                continue
+            fit = {rate: _beta_parameters(means.loc[key, rate], variances.loc[key, rate]) for rate in FUNNEL_RATES}
+            sigma = variances.loc[key, 'log_cpr'] ** 0.5
+            fit['cpr'] = (float(means.loc[key, 'log_cpr']), float(sigma) if sigma > 0 else 0.0)
+            fit['rows'] = int(counts.loc[key, 'log_cpr'])
+            fits[cell] = fit
+    return fits
+
+
+def distribution_for(fits: Dict[Tuple[str, str, str], Dict], therapy_area: str, primary_indication: str,
+                     country: str) -> Dict:
+    """Most specific fit available: the indication, then the therapy area, then everything in the country,
+    and the same again across all countries."""
+    for key in ((therapy_area, primary_indication, country), (therapy_area, ALL, country), (ALL, ALL, country),
+                (therapy_area, primary_indication, ALL), (therapy_area, ALL, ALL), (ALL, ALL, ALL)):
+        if key in fits:
+            return fits[key]
+    raise KeyError("No history to fit funnel distributions from")
+
+
+def simulate_budget(fits: Dict[Tuple[str, str, str], Dict], therapy_area: str, primary_indication: str,
+                    country_sites: Dict[str, int], rands: float, cpr_multiplier: float = 1.0,
+                    scenarios: int = 100_000, seed: int = 0) -> Dict[str, Tuple[float, float, float]]:
+    """P10/P50/P90 of CPR, referrals, cost per patient and budget over `scenarios` random draws.
+
+    Every scenario takes each selected country's funnel rates and CPR from its fitted
+    distributions and blends them by the countries' share of sites, as the deterministic
+    calculator does; the CPR is then scaled by `cpr_multiplier` (protocol complexity and
+    number-of-sites weightings). With no countries selected the pooled fit is used.
+
+    The countries share one quantile per scenario: a bad draw in one country is a bad draw in
+    all of them, so the blend keeps each country's spread instead of averaging it away.
+    """
+    rng = np.random.default_rng(seed)
+    weights = pd.Series(country_sites, dtype=float)
+    weights = weights / weights.sum() if len(weights) and weights.sum() > 0 else pd.Series({ALL: 1.0})
+
+    # Sorting each country's draws lines them up quantile by quantile; one shuffle per quantity
+    # then assigns those quantiles to scenarios, independently of the other quantities
+    blended = {name: np.zeros(scenarios) for name in list(FUNNEL_RATES) + ['cpr']}
+    for country, weight in weights.items():
+        fit = distribution_for(fits, therapy_area, primary_indication, country)
+        for rate in FUNNEL_RATES:
+            blended[rate] += weight * np.sort(rng.beta(*fit[rate], scenarios))
+        blended['cpr'] += weight * np.sort(rng.lognormal(*fit['cpr'], scenarios))
+    blended = {name: rng.permutation(values) for name, values in blended.items()}
+
+    cpr = blended['cpr'] * cpr_multiplier
+    outcomes = funnel(rands, cpr, blended['fov_rate'], blended['consent_rate'], 1 - blended['rand_rate'])
+    outcomes = {'cpr': cpr, **{name: outcomes[name] for name in ('referrals', 'cost_per_patient', 'budget')}}
+    return {name: tuple(float(value) for value in np.percentile(values, PERCENTILES))
+            for name, values in outcomes.items()}
+
+
+def _synthetic_history(rows: int, seed: int = 7) -> pd.DataFrame:
+    """query.sql-shaped rows with known funnel rates: 5% FOV, 80% consent, 50% screen fail."""
+    rng = np.random.default_rng(seed)
+    referrals = rng.integers(200, 2000, rows)
+    fovs = rng.binomial(referrals, 0.05)
+    consents = rng.binomial(fovs, 0.8)
+    area = rng.choice(['Cardiology', 'Oncology', 'Neurology'], rows)
+    return pd.DataFrame({
+        'THERAPY_AREA': area,
+        'PRIMARY_INDICATION': [f"{a} indication {i}" for a, i in zip(area, rng.integers(0, 3, rows))],
+        'COUNTRY': rng.choice(['US', 'GB', 'DE', 'JP'], rows),
+        'REFERRALS': referrals,
+        'FOVS': fovs,
+        'CONSENTS': consents,
+        'RANDS': rng.binomial(consents, 0.5),
+        'COSTS': referrals * rng.lognormal(np.log(250), 0.3, rows),
+    })
+
+
+def self_test(rows: int = 4000, scenarios: int = 100_000) -> Dict:
+    """Fit synthetic history with known rates, check the simulated P50 budget sits near the point estimate
+    and that blending countries with the same history keeps the single-country P10-P90 spread."""
+    data = _synthetic_history(rows)
+    start = time.perf_counter()
+    fits = fit_funnel_distributions(data)
+    fit_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    result = simulate_budget(fits, 'Cardiology', 'Cardiology indication 0', {'US': 3, 'GB': 1, 'NZ': 1},
+                             rands=20, scenarios=scenarios)
+    simulate_seconds = time.perf_counter() - start
+
+    single = simulate_budget(fits, 'Cardiology', ALL, {'US': 1}, rands=20, scenarios=scenarios)
+    blend = simulate_budget(fits, 'Cardiology', ALL, {'US': 1, 'GB': 1, 'DE': 1, 'JP': 1}, rands=20,
+                            scenarios=scenarios)
+    spread_ratio = (blend['budget'][2] - blend['budget'][0]) / (single['budget'][2] - single['budget'][0])
+
+    pooled = fits[(ALL, ALL, ALL)]
+    fitted_means = {rate: pooled[rate][0] / sum(pooled[rate]) for rate in FUNNEL_RATES}
+    point_budget = 20 * 250 / (0.05 * 0.8 * 0.5)
+    return {
+        'groups': len(fits),
+        'fitted_means': {rate: round(float(mean), 3) for rate, mean in fitted_means.items()},
+        'fit_seconds': round(fit_seconds, 3),
+        'scenarios': scenarios,
+        'simulate_seconds': round(simulate_seconds, 3),
+        'budget_p10_p50_p90': tuple(round(value) for value in result['budget']),
+        'referrals_p10_p50_p90': tuple(round(value) for value in result['referrals']),
+        'point_budget': round(point_budget),
+        'p50_within_10pct': bool(abs(result['budget'][1] / point_budget - 1) < 0.1),
+        'blend_spread_ratio': round(float(spread_ratio), 3),
+        'blend_keeps_spread': bool(spread_ratio > 0.8),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Monte Carlo funnel and budget simulation for the DtP forecast tool.")
+    parser.add_argument('--self-test', action='store_true', help="Fit and simulate synthetic history with known rates")
+    parser.add_argument('--scenarios', type=int, default=100_000)
+    args = parser.parse_args()
+
+    if args.self_test:
+        for key, value in self_test(scenarios=args.scenarios).items():
+            print(f"{key}: {value}")
+    else:
+        parser.print_help()
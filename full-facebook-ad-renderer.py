@@ -1,11 +1,15 @@
-import requests
 import pandas as pd
-import snowflake.connector
+import argparse
 import configparser
+from ad_facts import INSIGHT_COLUMNS, AdFactStore, fetch_milestones
+from facebook_graph import GraphError, fetch_ads, fetch_daily_insights
+from html_leaderboard import stream_leaderboard
+from query_cache import request_refresh
+from snowflake_client import query_file
 from typing import Dict, List
 from pathlib import Path
 import logging
-import html
+from datetime import date, timedelta
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -16,52 +20,14 @@ def load_config(config_path: str) -> configparser.ConfigParser:
     config.read(config_path)
     return config
 
-def fetch_facebook_ads_data(api_url: str, params: Dict) -> List[Dict]:
-    """Fetch Facebook Ads data from the API."""
-    response = requests.get(api_url, params=params)
-    if response.status_code != 200:
-        logging.error(f"Failed to retrieve data: {response.status_code}")
-        logging.error(response.text)
+def fetch_facebook_ads_data(api_url: str, params: Dict, batched: bool = False) -> List[Dict]:
+    """Fetch every ad from the API, following paging cursors; creatives and insights optionally via cached batch requests."""
+    try:
+        return fetch_ads(params['access_token'], api_url, params['fields'], limit=params.get('limit', 100),
+                         batched=batched)
+    except GraphError as e:
+        logging.error(f"Failed to retrieve data: {e}")
         return []
-    
-    data = response.json()
-    ads_data = []
-    for ad in data.get('data', []):
-        creative = ad.get('creative', {})
-        insights = ad.get('insights', {}).get('data', [{}])[0]
-        ads_data.append({
-            'id': ad.get('id'),
-            'title': creative.get('title'),
-            'body': creative.get('body'),
-            'image_url': creative.get('image_url'),
-            'call_to_action_type': creative.get('call_to_action'),
-            'reach': insights.get('reach'),
-            'impressions': insights.get('impressions'),
-            'clicks': insights.get('clicks'),
-        })
-    return ads_data
-
-def connect_to_snowflake(config: configparser.ConfigParser) -> snowflake.connector.SnowflakeConnection:
-    """Establish a connection to Snowflake."""
-    return snowflake.connector.connect(
-        user=config.get("snowflake", "user"),
-        password=config.get("snowflake", "password"),
-        account=config.get("snowflake", "account"),
-        warehouse=config.get("snowflake", "warehouse"),
-        schema=config.get("snowflake", "schema"),
-        role=config.get("snowflake", "role")
-    )
-
-def execute_snowflake_query(ctx: snowflake.connector.SnowflakeConnection, query_path: str) -> pd.DataFrame:
-    """Execute a Snowflake query from a file and return the results as a DataFrame."""
-    with open(query_path, 'r') as file:
-        query = file.read()
-    
-    cursor = ctx.cursor()
-    cursor.execute(query)
-    results = cursor.fetchall()
-    column_names = [column[0] for column in cursor.description]
-    return pd.DataFrame(results, columns=column_names)
 
 def process_snowflake_data(df: pd.DataFrame) -> pd.DataFrame:
     """Process Snowflake data: pivot the data to sum Sessions, Referrals, and BAA_VALUE."""
@@ -93,12 +59,13 @@ def process_snowflake_data(df: pd.DataFrame) -> pd.DataFrame:
     
     return df_pivoted
 
-def create_ad_leaderboard(merged_df: pd.DataFrame, output_dir: Path, max_ads: int = 50):
-    """Create an HTML leaderboard of Facebook ads with their statistics, sorted by sessions."""
-    # Sort ads by baa_referrals, baa_sessions, referrals, sessions in descending order
-    sorted_df = merged_df.sort_values(by=['baa_referrals', 'baa_sessions', 'referrals', 'sessions'], ascending=False).head(max_ads)
-    
-    html_content = """
+def _format_stats(ad: Dict) -> str:
+    return (f"""                
+                Pre Screener Sessions: {round(ad['sessions']):,} (B/AA: {round(ad['baa_sessions']):,})<br>
+                Referrals: {round(ad['referrals']):,} (B/AA: {round(ad['baa_referrals']):,})
+            """)
+
+LEADERBOARD_HEAD = """
     <!DOCTYPE html>
     <html lang="en">
     <head>
@@ -167,35 +134,62 @@ def create_ad_leaderboard(merged_df: pd.DataFrame, output_dir: Path, max_ads: in
         </style>
     </head>
     <body>
+        <!-- pages -->
         <div class="grid-container">
     """
-    
-    for _, ad in sorted_df.iterrows():
-        html_content += f"""
+
+LEADERBOARD_CARD = """
         <div class="ad">
-            <img class="ad-image" src="{html.escape(str(ad['image_url']))}" alt="Ad Image" onerror="this.onerror=null;this.src='https://www.nomadfoods.com/wp-content/uploads/2018/08/placeholder-1-e1533569576673-1500x1500.png';">
-            <div class="ad-title">{html.escape(str(ad['title']))}</div>
-            <div class="ad-body">{html.escape(str(ad['body']))}</div>
+            <img class="ad-image" src="{image_url}" loading="{loading}" decoding="async" alt="Ad Image" onerror="this.onerror=null;this.src='{placeholder}';">
+            <div class="ad-title">{title}</div>
+            <div class="ad-body">{body}</div>
             <div class="ad-url">librexiaafstudy.com/</div>
             <div class="ad-cta">Learn More</div>
-            <div class="ad-stats">                
-                Pre Screener Sessions: {round(ad['sessions']):,} (B/AA: {round(ad['baa_sessions']):,})<br>
-                Referrals: {round(ad['referrals']):,} (B/AA: {round(ad['baa_referrals']):,})
-            </div>
+            <div class="ad-stats">{stats}</div>
         </div>
         """
-    
-    html_content += """
+
+LEADERBOARD_FOOT = """
         </div>
+        <!-- pages -->
     </body>
     </html>
     """
+
+def create_ad_leaderboard(merged_df: pd.DataFrame, output_dir: Path, max_ads: int = 50, page_size: int = 500):
+    """Create an HTML leaderboard of Facebook ads with their statistics, sorted by sessions."""
+    # Sort ads by baa_referrals, baa_sessions, referrals, sessions in descending order
+    sorted_df = merged_df.sort_values(by=['baa_referrals', 'baa_sessions', 'referrals', 'sessions'], ascending=False).head(max_ads)
     
     output_file = output_dir / "janssen_librexia_fb_ads_summary.html"
-    with open(output_file, 'w', encoding='utf-8') as f:
-        f.write(html_content)
+    result = stream_leaderboard(sorted_df, output_file, LEADERBOARD_HEAD, LEADERBOARD_CARD, LEADERBOARD_FOOT,
+                                _format_stats, page_size=page_size)
     
-    logging.info(f"Leaderboard saved to {output_file}")
+    logging.info(f"Leaderboard saved to {output_file} ({result['ads']} ads, {len(result['paths'])} pages)")
+
+def merge_from_fact_store(df_facebook: pd.DataFrame, api_url: str, access_token: str, script_dir: Path,
+                          config: configparser.ConfigParser) -> pd.DataFrame:
+    """Append new milestone and insights rows to the fact store and merge the ads with its per-ad totals.
+
+    Impressions and clicks are summed over the same trailing window Graph's insights edge
+    defaults to (last 30 days, ending yesterday); reach stays as the API reported it for the ad.
+    """
+    store = AdFactStore()
+    date_column = config.get("facebook", "milestone_date_column", fallback="DATE")
+    store.refresh('milestones', lambda since: fetch_milestones(config, script_dir / 'fb.sql', date_column, since),
+                  date_column)
+    try:
+        store.refresh('insights', lambda since: pd.DataFrame(
+            fetch_daily_insights(access_token, api_url, df_facebook['id'].tolist(), since),
+            columns=['ad_id', 'date'] + INSIGHT_COLUMNS), 'date')
+    except GraphError as e:
+        logging.error(f"Failed to refresh insights, using stored totals: {e}")
+    
+    window_days = config.getint("facebook", "insights_window_days", fallback=30)
+    yesterday = date.today() - timedelta(days=1)
+    since = (yesterday - timedelta(days=window_days - 1)).isoformat() if window_days else None
+    aggregates = store.latest(since, yesterday.isoformat()).reset_index()
+    return pd.merge(df_facebook.drop(columns=INSIGHT_COLUMNS, errors='ignore'), aggregates, on='id', how='inner')
 
 def main():
     script_dir = Path(__file__).parent
@@ -209,26 +203,35 @@ def main():
         'access_token': config.get("facebook", "access_token")
     }
     
+    use_fact_store = config.getboolean("facebook", "fact_store", fallback=True)
+    if use_fact_store:
+        # Impressions and clicks come from the fact store's daily rows; reach counts unique people,
+        # so it can't be summed from daily rows and is still read from the ads' insights edge
+        params['fields'] = 'id,creative{title,body,image_url},insights{reach}'
+
     # Fetch and process Facebook Ads data
-    ads_data = fetch_facebook_ads_data(api_url, params)
+    ads_data = fetch_facebook_ads_data(api_url, params,
+                                       batched=config.getboolean("facebook", "batch_requests", fallback=True))
     if not ads_data:
         logging.error("No data returned from the Facebook API.")
         return
     df_facebook = pd.DataFrame(ads_data)
     
-    # Connect to Snowflake and fetch data
-    with connect_to_snowflake(config) as ctx:
-        df_snowflake = execute_snowflake_query(ctx, script_dir / 'fb.sql')
-    
-    logging.info(f"Snowflake data loaded: {len(df_snowflake.columns)}")
+    if use_fact_store:
+        merged_df = merge_from_fact_store(df_facebook, api_url, params['access_token'], script_dir, config)
+    else:
+        # Connect to Snowflake and fetch data
+        df_snowflake = query_file(script_dir / 'fb.sql', max_age=6 * 3600, config=config)
+        
+        logging.info(f"Snowflake data loaded: {len(df_snowflake.columns)}")
 
-    # Process Snowflake data
-    df_snowflake_processed = process_snowflake_data(df_snowflake)
-    
-    # Merge Facebook and Snowflake data
-    merged_df = pd.merge(df_facebook, df_snowflake_processed, left_on='id', right_on='CONTENT', how='right')
-    merged_df = merged_df.drop(['CONTENT'], axis=1)
-    merged_df = merged_df.dropna(subset=['id'])
+        # Process Snowflake data
+        df_snowflake_processed = process_snowflake_data(df_snowflake)
+        
+        # Merge Facebook and Snowflake data
+        merged_df = pd.merge(df_facebook, df_snowflake_processed, left_on='id', right_on='CONTENT', how='right')
+        merged_df = merged_df.drop(['CONTENT'], axis=1)
+        merged_df = merged_df.dropna(subset=['id'])
     
     # Convert numeric columns
     for col in ['sessions', 'referrals', 'baa_sessions', 'baa_referrals']:
@@ -245,4 +248,8 @@ def main():
     logging.info(f"Merged data saved to {output_dir / 'output_merged.csv'}")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render the Facebook ad leaderboard.")
+    parser.add_argument('--refresh', action='store_true', help="Re-run fb.sql instead of using a cached result")
+    if parser.parse_args().refresh:
+        request_refresh()
     main()
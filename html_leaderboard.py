@@ -0,0 +1,199 @@
+import os
+import html
+import time
+import argparse
+import tracemalloc
+from typing import Callable, Dict, List, Optional
+
+import pandas as pd
+
+from ad_images import PLACEHOLDER_URL
+
+TEXT_COLUMNS = ('image_url', 'title', 'body')
+CHUNK_ROWS = 1000
+BUFFER_BYTES = 1 << 16
+# Where head/foot templates want the page links; without it they go straight after head and before foot
+NAV_MARKER = '<!-- pages -->'
+
+NAV_STYLE = """
+        <style>
+            .pages { margin: 20px auto; text-align: center; font-family: Arial, sans-serif; font-size: 14px; }
+            .pages a, .pages span { margin: 0 4px; }
+        </style>
+"""
+
+
+def page_path(output_file: str, page: int) -> str:
+    """Page 1 keeps the requested name; later pages get a _page<N> suffix next to it."""
+    if page == 1:
+        return str(output_file)
+    stem, ext = os.path.splitext(str(output_file))
+    return f"{stem}_page{page}{ext}"
+
+
+def _nav(output_file: str, page: int, pages: int) -> str:
+    if pages == 1:
+        return ''
+    links = [f'<span>{number}</span>' if number == page else
+             f'<a href="{html.escape(os.path.basename(page_path(output_file, number)))}">{number}</a>'
+             for number in range(1, pages + 1)]
+    return f'<nav class="pages">{" ".join(links)}</nav>\n'
+
+
+def _with_nav(template: str, nav: str, before: bool) -> str:
+    if NAV_MARKER in template:
+        return template.replace(NAV_MARKER, nav)
+    return nav + template if before else template + nav
+
+
+def _escaped(values: List) -> List[str]:
+    return [html.escape(str(value)) if pd.notna(value) else '' for value in values]
+
+
+def stream_leaderboard(sorted_df: pd.DataFrame, output_file: str, head: str, card: str, foot: str,
+                       format_stats: Callable[[Dict], str], page_size: Optional[int] = 500,
+                       chunk_rows: int = CHUNK_ROWS) -> Dict:
+    """Write an already-sorted leaderboard as HTML in one pass, `page_size` cards per file.
+
+    `card` is a str.format template with {image_url}, {title}, {body}, {stats}, {placeholder}
+    and {loading} fields; `head` and `foot` are written as-is apart from the page links
+    (see NAV_MARKER). Rows are read column by column
+    a chunk at a time and written through a buffered file, so memory does not grow with the
+    number of ads. Images after the first row of each page are lazy-loaded.
+    """
+    start = time.perf_counter()
+    total = len(sorted_df)
+    page_size = page_size or max(total, 1)
+    pages = max(1, -(-total // page_size))
+    stats_columns = [column for column in sorted_df.columns if column not in TEXT_COLUMNS]
+    render_card = card.format
+    paths, written, out = [], 0, None
+
+    def open_page(page):
+        path = page_path(output_file, page)
+        f = open(f"{path}.tmp", 'w', encoding='utf-8', buffering=BUFFER_BYTES)
+        page_head = head.replace('</head>', f"{NAV_STYLE}    </head>", 1) if pages > 1 else head
+        f.write(_with_nav(page_head, _nav(output_file, page, pages), before=False))
+        paths.append(path)
+        return f
+
+    def close_page(f, page):
+        f.write(_with_nav(foot, _nav(output_file, page, pages), before=True))
+        f.close()
+        os.replace(f"{paths[-1]}.tmp", paths[-1])
+
+    try:
+        for chunk_start in range(0, max(total, 1), chunk_rows):
+            chunk = sorted_df.iloc[chunk_start:chunk_start + chunk_rows]
+            text = {column: _escaped(chunk[column].tolist()) if column in chunk.columns else [''] * len(chunk)
+                    for column in TEXT_COLUMNS}
+            stats = {column: chunk[column].tolist() for column in stats_columns}
+            for i in range(len(chunk)):
+                if written % page_size == 0:
+                    if out is not None:
+                        close_page(out, written // page_size)
+                    out = open_page(written // page_size + 1)
+                out.write(render_card(
+                    image_url=text['image_url'][i] or PLACEHOLDER_URL,
+                    title=text['title'][i],
+                    body=text['body'][i],
+                    stats=format_stats({column: values[i] for column, values in stats.items()}),
+                    placeholder=PLACEHOLDER_URL,
+                    # The first screenful loads straight away; the rest as the reader scrolls
+                    loading='eager' if written % page_size < 6 else 'lazy',
+                ))
+                written += 1
+        if out is None:
+            out = open_page(1)
+        close_page(out, pages)
+    except BaseException:
+        if out is not None and not out.closed:
+            out.close()
+            os.remove(f"{paths[-1]}.tmp")
+        raise
+    # Drop pages left over from an earlier, longer leaderboard
+    stale = pages + 1
+    while os.path.exists(page_path(output_file, stale)):
+        os.remove(page_path(output_file, stale))
+        stale += 1
+    return {'paths': paths, 'ads': written, 'seconds': time.perf_counter() - start}
+
+
+_BENCH_HEAD = "<!DOCTYPE html>\n<html lang=\"en\">\n<head><meta charset=\"UTF-8\"><title>Ad Leaderboard</title></head>\n<body>\n"
+_BENCH_CARD = """
+        <div class="ad">
+            <div class="ad-body">{body}</div>
+            <img class="ad-image" src="{image_url}" loading="{loading}" decoding="async" alt="Ad Image" onerror="this.onerror=null;this.src='{placeholder}';">
+            <div class="ad-title">{title}</div>
+            <div class="ad-stats">{stats}</div>
+        </div>
+"""
+_BENCH_FOOT = "</body>\n</html>\n"
+
+
+def _bench_stats(ad: Dict) -> str:
+    return f"Pre Screener Sessions: {round(ad['sessions']):,}<br>Referrals: {round(ad['referrals']):,}"
+
+
+def _concatenating_reference(sorted_df: pd.DataFrame, output_file: str):
+    """The old approach: iterrows plus repeated string concatenation, written in one go at the end."""
+    html_content = _BENCH_HEAD
+    for _, ad in sorted_df.iterrows():
+        html_content += f"""
+        <div class="ad">
+            <div class="ad-body">{html.escape(str(ad['body']))}</div>
+            <img class="ad-image" src="{html.escape(str(ad['image_url']))}" alt="Ad Image" onerror="this.onerror=null;this.src='{PLACEHOLDER_URL}';">
+            <div class="ad-title">{html.escape(str(ad['title']))}</div>
+            <div class="ad-stats">Pre Screener Sessions: {round(ad['sessions']):,}<br>Referrals: {round(ad['referrals']):,}</div>
+        </div>
+"""
+    html_content += _BENCH_FOOT
+    with open(output_file, 'w', encoding='utf-8') as f:
+        f.write(html_content)
+
+
+def benchmark(ads: int = 10000, page_size: Optional[int] = None) -> Dict:
+    """Time and peak Python memory of the concatenating and streaming renderers on synthetic ads."""
+    import tempfile
+
+    df = pd.DataFrame({
+        'id': [f"2385{i:08d}" for i in range(ads)],
+        'title': [f"Ad <{i}> & friends" for i in range(ads)],
+        'body': [f"Body text for ad {i}. " * 12 for i in range(ads)],
+        'image_url': [f"https://img.example/{i}.png" for i in range(ads)],
+        'sessions': [float(ads - i) for i in range(ads)],
+        'referrals': [float(i % 13) for i in range(ads)],
+    })
+    report = {'ads': ads}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, render in (
+            ('concatenate', lambda path: _concatenating_reference(df, path)),
+            ('stream', lambda path: stream_leaderboard(df, path, _BENCH_HEAD, _BENCH_CARD, _BENCH_FOOT,
+                                                       _bench_stats, page_size=page_size)),
+        ):
+            path = os.path.join(tmp, f"{name}.html")
+            tracemalloc.start()
+            start = time.perf_counter()
+            render(path)
+            seconds = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            files = [f for f in os.listdir(tmp) if f.startswith(name)]
+            cards = sum(open(os.path.join(tmp, f), encoding='utf-8').read().count('class="ad"') for f in files)
+            report[name] = {'seconds': round(seconds, 3), 'peak_mb': round(peak / 2**20, 1),
+                            'files': len(files), 'cards': cards}
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Streaming HTML ad leaderboard writer.")
+    parser.add_argument('--benchmark', action='store_true', help="Compare with string concatenation on synthetic ads")
+    parser.add_argument('--ads', type=int, default=10000)
+    parser.add_argument('--page-size', type=int, default=None)
+    args = parser.parse_args()
+
+    if args.benchmark:
+        for key, value in benchmark(args.ads, args.page_size).items():
+            print(f"{key}: {value}")
+    else:
+        parser.print_help()
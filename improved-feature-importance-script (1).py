@@ -1,5 +1,6 @@
 import snowflake.connector
 import configparser
+from snowflake_client import execute_query_file
 import os
 import pandas as pd
 import numpy as np
@@ -12,9 +13,6 @@ import seaborn as sns
 def connect_to_snowflake(config_path):
     # ... (keep the existing function as is)
 
-def execute_query(ctx, query_path):
-    # ... (keep the existing function as is)
-
 def preprocess_data(df, datadic_path, target):
     datadic = pd.read_csv(datadic_path)[['Asset field name', 'Name']]
     datadic['Asset field name'] = datadic['Asset field name'].str.lower()
@@ -69,7 +67,7 @@ def main():
     if ctx is None:
         return
     
-    df = execute_query(ctx, query_path)
+    df = execute_query_file(ctx, query_path)
     target = 'Ailment2 - Acne'
     X, y = preprocess_data(df, datadic_path, target)
     
@@ -1,5 +1,6 @@
 import snowflake.connector
 import configparser
+from snowflake_client import execute_query_file
 import os
 import pandas as pd
 import numpy as np
@@ -28,17 +29,6 @@ def connect_to_snowflake(config_path):
         print("Error:", e)
         return None
 
-def execute_query(ctx, query_path):
-    with open(query_path, 'r') as file:
-        query = file.read()
-    
-    cursor = ctx.cursor()
-    cursor.execute(query)
-    results = cursor.fetchall()
-    column_names = [column[0] for column in cursor.description]
-    
-    return pd.DataFrame(results, columns=column_names)
-
 def preprocess_data(df, datadic_path, target):
     datadic = pd.read_csv(datadic_path)[['Asset field name', 'Name']]
     datadic['Asset field name'] = datadic['Asset field name'].str.lower()
@@ -93,7 +83,7 @@ def main():
     if ctx is None:
         return
     
-    df = execute_query(ctx, query_path)
+    df = execute_query_file(ctx, query_path)
     target = 'Ailment2 - Acne'
     X, y = preprocess_data(df, datadic_path, target)
     
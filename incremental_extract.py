@@ -0,0 +1,195 @@
+import os
+import json
+import time
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+from extract_runner import stream_extract, write_dataframe
+from snowflake_client import fetch_dataframe, read_sql_file
+
+_RH_SOURCE = 'PRDB_PROD.PROD_US9_PAR_RPR.V_RH_PRTCPNT_ENRL'
+_RH_PROTOCOLS = "('AROAPOC3-3004', 'AROAPOC3-3003', 'AROAPOC3-3009')"
+
+# Referral Hub details: rh.sql is aggregated per REF_DATE (and the other report dimensions), so a run
+# re-pulls the REF_DATE partitions holding a referral whose status changed, or that is new, since the
+# watermarks and swaps them into the snapshot. The watermarks come from the enrollment table itself.
+RH_DETAILS = {
+    'partition': 'REF_DATE',
+    'watermark_query': f"""
+        SELECT MAX(prtcpnt_stat_last_updt_dt), MAX(ref_dt)
+        FROM {_RH_SOURCE}
+        WHERE stdy_id IN {_RH_PROTOCOLS}
+    """,
+    'changed_partitions_query': f"""
+        SELECT DISTINCT DATE(ref_dt)
+        FROM {_RH_SOURCE}
+        WHERE stdy_id IN {_RH_PROTOCOLS} AND (prtcpnt_stat_last_updt_dt >= ? OR ref_dt >= ?)
+    """,
+    # Referrals the extract should hold, with rh.sql's filters, to check against the summed REFERRALS column
+    'count_column': 'REFERRALS',
+    'count_query': f"""
+        SELECT COUNT(DISTINCT prtcpnt_e.prtcpnt_nm)
+        FROM {_RH_SOURCE} prtcpnt_e
+        LEFT JOIN PRDB_PROD.PROD_US9_PAR_RPR.V_RH_CLNCL_STDY_SITE site ON site.clncl_stdy_site_id = prtcpnt_e.clncl_stdy_site_id
+        WHERE LOWER(site.stdy_site_nm) NOT LIKE '%iqvia test%'
+            AND (LOWER(prtcpnt_e.utm_src_cd) NOT LIKE '%test%'
+                OR LOWER(prtcpnt_e.utm_src_cd) NOT LIKE '%uat%'
+                OR LOWER(prtcpnt_e.utm_src_cd) NOT IN ('eleven', 'six')
+                OR prtcpnt_e.utm_src_cd IS NULL)
+            AND refrl_src_typ_nm IN ('ePR_Campaign', 'ePR')
+            AND prtcpnt_e.stdy_id IN {_RH_PROTOCOLS}
+    """,
+    'lookback_days': 3,
+    'full_refresh_days': 7,
+}
+# Set to 1 to make the next run re-pull every extract in full
+FULL_REFRESH_ENV = 'EXTRACT_FULL_REFRESH'
+
+
+def _state_path(base_path: str) -> str:
+    return f"{base_path}.watermark.json"
+
+
+def load_state(base_path: str) -> Dict:
+    try:
+        with open(_state_path(base_path)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(base_path: str, state: Dict):
+    tmp_path = f"{_state_path(base_path)}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=2, default=str)
+    os.replace(tmp_path, _state_path(base_path))
+
+
+def _strip_sql(query: str) -> str:
+    return query.strip().rstrip(';')
+
+
+def changed_rows_query(query: str, watermark_columns: List[str]) -> str:
+    """Wrap an extract so only rows at or past any watermark column come back."""
+    conditions = ' OR '.join(f"{column} >= ?" for column in watermark_columns)
+    # The newline keeps a trailing line comment in the extract from swallowing the bracket
+    return f"SELECT * FROM (\n{_strip_sql(query)}\n) WHERE {conditions}"
+
+
+def partitions_query(query: str, partition_column: str) -> str:
+    """Wrap an extract so only the partitions in a bound JSON array come back."""
+    return (f"SELECT * FROM (\n{_strip_sql(query)}\n) "
+            f"WHERE {partition_column} IN (SELECT value::DATE FROM TABLE(FLATTEN(INPUT => PARSE_JSON(?))))")
+
+
+def result_columns(conn, query: str) -> List[str]:
+    """Upper-cased column names of the extract's result, from a describe-only compile (nothing is scanned)."""
+    return [column[0].upper() for column in conn.cursor().describe(query)]
+
+
+def _scalars(conn, query: str, params: Optional[List] = None) -> List:
+    return list(fetch_dataframe(conn, query, params).iloc[0])
+
+
+def _partition_dates(values) -> pd.Series:
+    return pd.to_datetime(pd.Series(values)).dt.date
+
+
+def reconcile_counts(conn, df: pd.DataFrame, spec: Dict, baseline_gap: Optional[int] = None) -> Dict:
+    """Compare the snapshot with the source: its rows, its summed count column and the source's count.
+
+    The gap between the two counts is recorded at each full refresh; an incremental run whose gap
+    has moved from that baseline has drifted from the warehouse.
+    """
+    column = spec.get('count_column')
+    snapshot_count = int(pd.to_numeric(df[column]).sum()) if column in df.columns else len(df)
+    source_count = int(_scalars(conn, spec['count_query'])[0])
+    report = {'snapshot_rows': len(df), 'snapshot_count': snapshot_count, 'source_count': source_count,
+              'gap': snapshot_count - source_count}
+    if baseline_gap is not None:
+        report['drift'] = report['gap'] - baseline_gap
+    return report
+
+
+def _full_refresh_due(state: Dict, spec: Dict, parquet_path: str, force_full: bool) -> Optional[str]:
+    if force_full or os.getenv(FULL_REFRESH_ENV, '') not in ('', '0'):
+        return "full refresh requested"
+    if not os.path.exists(parquet_path) or not state.get('watermarks') or state.get('partition') != spec['partition']:
+        return "no snapshot yet"
+    last_full = datetime.fromisoformat(state.get('last_full_refresh', '1970-01-01'))
+    if datetime.now() - last_full > timedelta(days=spec.get('full_refresh_days', 7)):
+        return f"last full refresh {last_full:%Y-%m-%d}"
+    return None
+
+
+def incremental_extract(conn, sql_file_path: str, base_path: str, write_csv: bool = True,
+                        spec: Dict = RH_DETAILS, force_full: bool = False) -> Dict:
+    """Refresh a partitioned extract from its watermarks and swap the changed partitions into the local snapshot.
+
+    The extract's result schema is checked before its SQL is wrapped: when the partition column
+    isn't among its output columns it is always extracted in full. It also falls back to a full
+    streamed extract when there is no snapshot, the periodic full refresh is due, or
+    `force_full`/EXTRACT_FULL_REFRESH asks for one. Every run reconciles the snapshot's counts
+    with the source (see reconcile_counts). Returns the same shape as stream_extract plus the
+    mode used, the rows re-pulled and the reconciliation.
+    """
+    start = time.perf_counter()
+    partition = spec['partition']
+    parquet_path = f"{base_path}.parquet"
+    name = os.path.basename(base_path)
+    query = read_sql_file(sql_file_path)
+    state = load_state(base_path)
+
+    has_partition = partition.upper() in result_columns(conn, query)
+    reason = (f"extract has no {partition} column" if not has_partition
+              else _full_refresh_due(state, spec, parquet_path, force_full))
+    # Read before pulling, so anything that changes during the run is picked up next time
+    watermarks = [None if pd.isna(value) else pd.Timestamp(value).isoformat()
+                  for value in _scalars(conn, spec['watermark_query'])]
+
+    if reason is not None:
+        logging.info(f"Full refresh of {name}: {reason}")
+        result = stream_extract(conn, sql_file_path, base_path, write_csv)
+        report = None
+        if has_partition:
+            report = reconcile_counts(conn, pd.read_parquet(parquet_path), spec, state.get('count_gap'))
+            if report.get('drift'):
+                logging.warning(f"{name} had drifted from the warehouse before its full refresh: {report}")
+        save_state(base_path, {
+            'partition': partition,
+            'watermarks': watermarks,
+            'last_full_refresh': datetime.now().isoformat(),
+            'rows': result['rows'],
+            'count_gap': report['gap'] if report else None,
+            'mode': 'full',
+        })
+        result.update({'mode': 'full', 'changed_rows': result['rows'], 'reconciliation': report})
+        return result
+
+    lookback = timedelta(days=spec.get('lookback_days', 0))
+    params = [pd.Timestamp(previous or '1970-01-01').to_pydatetime() - lookback for previous in state['watermarks']]
+    dates = sorted(set(_partition_dates(fetch_dataframe(conn, spec['changed_partitions_query'], params).iloc[:, 0])))
+    snapshot = pd.read_parquet(parquet_path)
+    changes = snapshot.iloc[:0]
+    if dates:
+        changes = fetch_dataframe(conn, partitions_query(query, partition),
+                                  [json.dumps([date.isoformat() for date in dates])])
+    # Replace whole partitions, so groups that no longer exist in the warehouse are dropped too
+    merged = pd.concat([snapshot[~_partition_dates(snapshot[partition]).isin(dates).to_numpy()], changes],
+                       ignore_index=True)
+    paths = write_dataframe(merged, base_path, write_csv)
+
+    report = reconcile_counts(conn, merged, spec, state.get('count_gap'))
+    if report.get('drift'):
+        logging.warning(f"{name} has drifted from the warehouse: {report}")
+    state.update({'watermarks': [new or old for new, old in zip(watermarks, state['watermarks'])],
+                  'rows': len(merged), 'mode': 'incremental'})
+    save_state(base_path, state)
+    return {
+        'paths': paths, 'rows': len(merged), 'seconds': time.perf_counter() - start,
+        'mode': 'incremental', 'changed_partitions': len(dates), 'changed_rows': len(changes),
+        'reconciliation': report,
+    }
@@ -0,0 +1,186 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import argparse
+import textwrap
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+import pandas as pd
+from PIL import Image
+
+from ad_images import PLACEHOLDER_URL, ImageCache
+
+SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
+TILE_DIR = os.path.join(SCRIPT_DIR, '.leaderboard_tiles')
+# Bump when render_tile changes so cached tiles drawn the old way are not reused
+TILE_VERSION = 1
+TILE_INCHES = 5
+COLUMNS = 3
+
+
+def _stat_text(sessions, referrals) -> str:
+    text = f"Sessions: {sessions:,}"
+    if referrals != 0:
+        text += f"\nReferrals: {referrals:,}"
+    return text
+
+
+def ad_cards(sorted_df: pd.DataFrame, image_cache: ImageCache) -> List[Dict]:
+    """Turn leaderboard rows into plain, picklable card dicts pointing at cached image thumbnails."""
+    cards = []
+    for ad in sorted_df[['id', 'title', 'body', 'call_to_action_type', 'image_url', 'sessions', 'referrals']].to_dict('records'):
+        image_url = ad['image_url'] if pd.notna(ad['image_url']) else PLACEHOLDER_URL
+        image_path = image_cache.image_path(image_url) or image_cache.image_path(PLACEHOLDER_URL)
+        cards.append({
+            'id': ad['id'],
+            'title': ad['title'] if pd.notna(ad['title']) else '',
+            'body': ad['body'] if pd.notna(ad['body']) else '',
+            'call_to_action_type': ad['call_to_action_type'] if pd.notna(ad['call_to_action_type']) else '',
+            'stats': _stat_text(ad['sessions'], ad['referrals']),
+            'image_path': image_path,
+        })
+    return cards
+
+
+def tile_key(card: Dict, dpi: int) -> str:
+    """Hash of everything drawn on a tile: the ad's text and stats, its image file and the render settings."""
+    image = card['image_path']
+    image_stamp = None
+    if image and os.path.exists(image):
+        stat = os.stat(image)
+        image_stamp = [os.path.basename(image), stat.st_size, stat.st_mtime_ns]
+    content = {key: card[key] for key in ('title', 'body', 'call_to_action_type', 'stats')}
+    payload = json.dumps([TILE_VERSION, dpi, content, image_stamp], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def render_tile(card: Dict, tile_path: str, dpi: int) -> str:
+    """Draw one ad card on its own fixed-size figure and save it as a PNG. Runs in a worker process."""
+    # Figure without pyplot: no global figure manager, so it is safe in any process
+    from matplotlib import patches
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(TILE_INCHES, TILE_INCHES), dpi=dpi)
+    # Leave room above and below the image for the body, title and call to action
+    ax = fig.add_axes([0.05, 0.2, 0.9, 0.55])
+    if card['image_path']:
+        with Image.open(card['image_path']) as img:
+            ax.imshow(img)
+    ax.add_patch(patches.Rectangle((0, 0), 1, 1, transform=ax.transAxes, alpha=0.6, facecolor='white'))
+    ax.text(0, 1.03, textwrap.fill(card['body'], 60), ha='left', va='bottom', fontsize=8, wrap=True,
+            transform=ax.transAxes, bbox=dict(facecolor='white', alpha=0.8, edgecolor='none', pad=3))
+    ax.text(0, -0.08, f"librexia.com\n{card['title']}", ha='left', va='top', fontsize=8, wrap=True,
+            transform=ax.transAxes, bbox=dict(facecolor='grey', alpha=0.8, edgecolor='none', pad=3))
+    ax.text(0.95, -0.08, card['call_to_action_type'], ha='right', va='top', fontsize=8, wrap=True,
+            transform=ax.transAxes, bbox=dict(facecolor='blue', alpha=0.8, edgecolor='none', pad=3))
+    ax.text(0.95, 0.95, card['stats'], ha='right', va='top', fontsize=8, transform=ax.transAxes,
+            bbox=dict(facecolor='white', alpha=0.8, edgecolor='none', pad=3))
+    ax.axis('off')
+
+    tmp_path = f"{tile_path}.{os.getpid()}.tmp"
+    fig.savefig(tmp_path, dpi=dpi, format='png', facecolor='white')
+    os.replace(tmp_path, tile_path)
+    return tile_path
+
+
+def composite_tiles(tile_paths: List[str], output_path: str, columns: int = COLUMNS, margin: int = 20):
+    """Paste equally sized tiles into a white grid, row by row."""
+    with Image.open(tile_paths[0]) as first:
+        width, height = first.size
+    rows = (len(tile_paths) + columns - 1) // columns
+    sheet = Image.new('RGB', (columns * (width + margin) + margin, rows * (height + margin) + margin), 'white')
+    for idx, path in enumerate(tile_paths):
+        with Image.open(path) as tile:
+            sheet.paste(tile.convert('RGB'), (margin + (idx % columns) * (width + margin),
+                                              margin + (idx // columns) * (height + margin)))
+    tmp_path = f"{output_path}.tmp"
+    sheet.save(tmp_path, format='PNG')
+    os.replace(tmp_path, output_path)
+
+
+def render_leaderboard_tiles(cards: List[Dict], output_path: str, dpi: int = 300, columns: int = COLUMNS,
+                             tile_dir: str = TILE_DIR, max_workers: Optional[int] = None) -> Dict:
+    """Render each card as a cached tile on a process pool and composite them into one leaderboard PNG.
+
+    Tiles are named by tile_key, so only ads whose content, stats or image changed are drawn
+    again. Returns tile counts and timings.
+    """
+    start = time.perf_counter()
+    os.makedirs(tile_dir, exist_ok=True)
+    tile_paths = [os.path.join(tile_dir, f"{tile_key(card, dpi)}.png") for card in cards]
+    missing = {path: card for path, card in zip(tile_paths, cards) if not os.path.exists(path)}
+    for path in set(tile_paths) - set(missing):
+        # Mark reused tiles as recent so prune_tiles keeps them
+        os.utime(path)
+    if missing:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(render_tile, missing.values(), missing.keys(), [dpi] * len(missing)))
+    rendered = time.perf_counter()
+    if tile_paths:
+        composite_tiles(tile_paths, output_path, columns)
+    return {'tiles': len(tile_paths), 'rendered': len(missing), 'cached': len(tile_paths) - len(missing),
+            'render_seconds': round(rendered - start, 2),
+            'composite_seconds': round(time.perf_counter() - rendered, 2)}
+
+
+def prune_tiles(tile_dir: str = TILE_DIR, max_age_days: float = 30):
+    """Drop tiles no render has used for a while."""
+    cutoff = time.time() - max_age_days * 86400
+    for name in os.listdir(tile_dir):
+        path = os.path.join(tile_dir, name)
+        if os.path.getmtime(path) < cutoff:
+            os.remove(path)
+
+
+def create_tiled_ad_leaderboard(merged_df: pd.DataFrame, output_path: str, max_ads: int = 50,
+                                image_cache: Optional[ImageCache] = None, dpi: int = 300,
+                                max_workers: Optional[int] = None) -> Dict:
+    """Tiled equivalent of create_ad_leaderboard: top ads by sessions, one tile per ad, three per row."""
+    sorted_df = merged_df.sort_values(by='sessions', ascending=False).head(max_ads)
+    image_cache = image_cache or ImageCache()
+    image_cache.prefetch(list(sorted_df['image_url'].dropna()) + [PLACEHOLDER_URL])
+    result = render_leaderboard_tiles(ad_cards(sorted_df, image_cache), output_path, dpi, max_workers=max_workers)
+    prune_tiles()
+    logging.info(f"Leaderboard saved to {output_path} ({result})")
+    return result
+
+
+def benchmark(ads: int = 50, dpi: int = 150) -> Dict:
+    """Render synthetic cards cold on one worker, cold on every core, then warm with one ad's stats changed."""
+    import tempfile
+
+    report = {'cores': os.cpu_count()}
+    with tempfile.TemporaryDirectory() as tmp:
+        cards = []
+        for i in range(ads):
+            image_path = os.path.join(tmp, f"image_{i}.png")
+            Image.new('RGB', (600, 600), ((i * 5) % 256, 80, 160)).save(image_path)
+            cards.append({'id': str(i), 'title': f"Ad {i}", 'body': f"Body text for ad {i} " * 6,
+                          'call_to_action_type': 'LEARN_MORE', 'stats': _stat_text(1000 - i, i % 7),
+                          'image_path': image_path})
+        output_path = os.path.join(tmp, 'leaderboard.png')
+        for run, workers in (('cold_1_worker', 1), ('cold_all_cores', None)):
+            tile_dir = os.path.join(tmp, run)
+            report[run] = render_leaderboard_tiles(cards, output_path, dpi, tile_dir=tile_dir, max_workers=workers)
+        cards[0] = {**cards[0], 'stats': _stat_text(5000, 12)}
+        report['warm_one_changed'] = render_leaderboard_tiles(cards, output_path, dpi, tile_dir=tile_dir)
+        with Image.open(output_path) as sheet:
+            report['sheet_size'] = sheet.size
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parallel, cached tile renderer for the ad leaderboard PNG.")
+    parser.add_argument('--benchmark', action='store_true', help="Render synthetic ads cold and warm")
+    parser.add_argument('--ads', type=int, default=50)
+    parser.add_argument('--dpi', type=int, default=150)
+    args = parser.parse_args()
+
+    if args.benchmark:
+        for key, value in benchmark(args.ads, args.dpi).items():
+            print(f"{key}: {value}")
+    else:
+        parser.print_help()
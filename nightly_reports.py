@@ -0,0 +1,64 @@
+import os
+import time
+import runpy
+import sys
+import logging
+import argparse
+from typing import List
+
+from query_cache import request_refresh
+from snowflake_client import get_pool, load_config
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
+
+DEFAULT_REPORTS = [
+    'refactored-scorecard.py',
+    'refined-project-summary.py',
+    'pbix_src.py',
+    'choregraph.py',
+]
+
+
+def run_reports(report_files: List[str]) -> List[str]:
+    """Run each report script in this process so they all borrow from one Snowflake pool.
+
+    Returns the reports that failed; a failure doesn't stop the ones after it.
+    """
+    pool = get_pool(load_config())
+    failed = []
+    for report_file in report_files:
+        path = report_file if os.path.isabs(report_file) else os.path.join(SCRIPT_DIR, report_file)
+        start = time.perf_counter()
+        logging.info(f"Running {report_file}")
+        # Each report sees a bare command line, not this runner's options
+        argv = sys.argv
+        sys.argv = [path]
+        try:
+            runpy.run_path(path, run_name='__main__')
+        except Exception as e:
+            logging.error(f"{report_file} failed: {e}")
+            failed.append(report_file)
+        finally:
+            sys.argv = argv
+        logging.info(f"Finished {report_file} in {time.perf_counter() - start:.1f}s")
+
+    logging.info(f"Snowflake sessions opened: {pool.connects} for {pool.borrows} borrows")
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the nightly reporting pipelines with shared Snowflake sessions.")
+    parser.add_argument('reports', nargs='*', default=DEFAULT_REPORTS, help="Report scripts to run, in order")
+    parser.add_argument('--refresh', action='store_true', help="Ignore cached query results and re-run every query")
+    args = parser.parse_args()
+    if args.refresh:
+        request_refresh()
+    if run_reports(args.reports):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,12 @@
 import os
 import shutil
 from configparser import ConfigParser
-from io import StringIO, BytesIO
 from datetime import datetime, timedelta
 import pandas as pd
-import snowflake.connector
+from extract_runner import ExtractError, run_extracts, upload_artifact, write_dataframe
+from incremental_extract import incremental_extract
 from office365.runtime.auth.authentication_context import AuthenticationContext
 from office365.sharepoint.client_context import ClientContext
-from office365.sharepoint.files.file import File
 from google.oauth2 import service_account
 from google.analytics.data_v1beta import BetaAnalyticsDataClient
 from google.analytics.data_v1beta.types import DateRange, Dimension, Metric, RunReportRequest
@@ -34,60 +33,33 @@ def connect_to_sharepoint(config):
         print(ctx_auth.get_last_error())
         return None
 
-def connect_to_snowflake(config):
-    return snowflake.connector.connect(
-        user=config.get("snowflake", "user"),
-        password=config.get("snowflake", "password"),
-        account=config.get("snowflake", "account"),
-        warehouse=config.get("snowflake", "warehouse"),
-        schema=config.get("snowflake", "schema"),
-        role=config.get("snowflake", "role"))
-
-def execute_query(cursor, sql_file_path):
-    with open(sql_file_path, 'r') as file:
-        query = file.read()
-    cursor.execute(query)
-    results = cursor.fetchall()
-    column_names = [column[0] for column in cursor.description]
-    return pd.DataFrame(results, columns=column_names)
-
-def archive_existing_csvs(output_path):
-    csv_files = [f for f in os.listdir(output_path) if f.endswith('.csv') and f != 'nocion_aspire_project_details.csv']
-    if csv_files:
+def archive_existing_extracts(output_path):
+    # The incremental rh snapshot is merged in place, so it is copied rather than moved
+    snapshots = {'nocion_aspire_rh_details.parquet'}
+    extract_files = [f for f in os.listdir(output_path) if f.endswith(('.csv', '.parquet')) and f != 'nocion_aspire_project_details.csv']
+    if extract_files:
         archive_date = datetime.now().strftime("%Y%m%d_%H%M%S")
         archive_folder = os.path.join(output_path, "Archive", f"log_{archive_date}")
         os.makedirs(archive_folder, exist_ok=True)
         
-        for csv_file in csv_files:
-            shutil.move(os.path.join(output_path, csv_file), os.path.join(archive_folder, csv_file))
+        for extract_file in extract_files:
+            archive = shutil.copy2 if extract_file in snapshots else shutil.move
+            archive(os.path.join(output_path, extract_file), os.path.join(archive_folder, extract_file))
         
-        print(f"Archived {len(csv_files)} CSV files to {archive_folder}")
+        print(f"Archived {len(extract_files)} extract files to {archive_folder}")
     else:
-        print("No existing CSV files to archive.")
-
-def write_to_csv(df, output_path, csv_file_name, ctx=None):
-    csv_buffer = StringIO()
-    df.to_csv(csv_buffer, index=False)
-    csv_buffer.seek(0)
+        print("No existing extract files to archive.")
 
-    if output_path.startswith('https://'):
-        if ctx is None:
-            raise ValueError("ClientContext is required to upload to SharePoint")
-        
-        file_content = csv_buffer.getvalue().encode('utf-8')
-        target_url = f"{output_path}/{csv_file_name}"
-        print(f"Uploading to SharePoint at {target_url}")
-        
+def upload_to_sharepoint(ctx, sp_path, local_paths):
+    # Reuse the files just written locally rather than serialising the data a second time
+    for local_path in local_paths:
+        file_name = os.path.basename(local_path)
+        print(f"Uploading to SharePoint at {sp_path}/{file_name}")
         try:
-            File.save_binary(ctx, target_url, file_content)
-            print(f"Successfully uploaded {csv_file_name} to SharePoint.")
+            upload_artifact(ctx, sp_path, local_path)
+            print(f"Successfully uploaded {file_name} to SharePoint.")
         except Exception as e:
-            print(f"Failed to upload {csv_file_name} to SharePoint: {e}")
-    else:
-        output_file = os.path.join(output_path, csv_file_name)
-        with open(output_file, 'w', newline='', encoding='utf-8') as f:
-            f.write(csv_buffer.getvalue())
-        print(f"File saved locally at {output_file}")
+            print(f"Failed to upload {file_name} to SharePoint: {e}")
 
 def get_ga_data(credentials_file, property_id, start_date, end_date):
     credentials = service_account.Credentials.from_service_account_file(credentials_file)
@@ -149,30 +121,40 @@ def main():
         print("Failed to connect to SharePoint. Exiting.")
         return
 
-    snowflake_ctx = connect_to_snowflake(config)
-    cursor = snowflake_ctx.cursor()
-    
     output_path = config.get("filepath", "path").strip("'")
     output_path_sp = config.get("filepath", "sp_path").strip("'")
     
-    archive_existing_csvs(output_path)
+    archive_existing_extracts(output_path)
     
     sp_username = config.get("windows", "user")
     sp_password = config.get("windows", "password")
     site_url = 'https://quintiles.sharepoint.com/sites/Direct_to_Patient-Marketing_Operations'
 
-    # Process different data types
-    data_types = {
-        'rh': 'nocion_aspire_rh_details.csv',
-        'tmdh': 'nocion_aspire_tmdh.csv',
-        'sg': 'nocion_aspire_survey_responses.csv'
+    # Extracts run concurrently and stream to Parquet, with the .csv files Power BI reads alongside
+    write_csv = config.getboolean("extracts", "write_csv", fallback=True)
+    extracts = {
+        'rh': 'nocion_aspire_rh_details',
+        'tmdh': 'nocion_aspire_tmdh',
+        'sg': 'nocion_aspire_survey_responses'
     }
-
-    for data_type, file_name in data_types.items():
-        sql_file_path = os.path.join(script_dir, f'{data_type}.sql')
-        df = execute_query(cursor, sql_file_path)
-        write_to_csv(df, output_path, file_name)
-        write_to_csv(df, output_path_sp, file_name, ctx)
+    # Referral Hub details re-pull only the REF_DATE partitions with new or status-changed referrals (full
+    # refresh weekly), and every run checks the snapshot's referral count against the warehouse
+    runners = {}
+    if config.getboolean("extracts", "incremental_rh", fallback=True):
+        runners['rh'] = incremental_extract
+    extract_error = None
+    try:
+        results = run_extracts(extracts, script_dir, output_path, config,
+                               max_workers=config.getint("extracts", "max_workers", fallback=3), write_csv=write_csv,
+                               runners=runners)
+    except ExtractError as e:
+        # Publish what did complete, then fail the run once everything else is done
+        results, extract_error = e.results, e
+    for data_type, result in results.items():
+        print(f"{data_type}: {result['rows']} rows in {result['seconds']:.1f}s ({result.get('mode', 'full')})")
+        if result.get('reconciliation'):
+            print(f"{data_type} reconciliation: {result['reconciliation']}")
+        upload_to_sharepoint(ctx, output_path_sp, result['paths'])
 
     # Google Analytics data
     credentials_file = r'C:\Users\q1032269\OneDrive - IQVIA\Documents\config-keys\Quickstart-10783ca848cb.json'
@@ -181,8 +163,11 @@ def main():
     start_date = "2024-10-01"
     ga_df = get_ga_data(credentials_file, property_id, start_date, end_date)
     ga_df = transform_ga_data(ga_df)
-    write_to_csv(ga_df, output_path, "nocion_aspire_ga.csv")
-    write_to_csv(ga_df, output_path_sp, "nocion_aspire_ga.csv", ctx)
+    ga_paths = write_dataframe(ga_df, os.path.join(output_path, "nocion_aspire_ga"), write_csv)
+    upload_to_sharepoint(ctx, output_path_sp, ga_paths)
+
+    if extract_error is not None:
+        raise extract_error
 
 if __name__ == "__main__":
     main()
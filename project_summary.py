@@ -5,7 +5,9 @@ from office365.sharepoint.client_context import ClientContext
 from office365.sharepoint.lists.list import List
 import pandas as pd
 import datetime
-import snowflake.connector
+from revenue_engine import capped, media_revenue, milestone_revenue, referral_revenue
+from sharepoint_lists import load_list
+from snowflake_client import query_file
 import win32com.client as win32
 
 # Get the directory of the current script
@@ -36,34 +38,6 @@ def connect_to_sharepoint():
         print(ctx_auth.get_last_error())
         return None
     
-def connect_to_snowflake():
-    # Snowflake connection
-    ctx = snowflake.connector.connect(
-        user=config.get("snowflake", "user"),
-        password=config.get("snowflake", "password"),
-        account=config.get("snowflake", "account"),
-        warehouse=config.get("snowflake", "warehouse"),
-        schema=config.get("snowflake", "schema"),
-        role=config.get("snowflake", "role"))
-
-    cursor = ctx.cursor()
-    return cursor
-
-def retrieve_list_data(ctx, list_name):
-    list_obj = ctx.web.lists.get_by_title(list_name)
-    items = list_obj.get_items().execute_query()
-    data = [item.properties for item in items]
-    return pd.DataFrame(data)
-
-def execute_query(cursor, sql_file_path):
-    with open(sql_file_path, 'r') as file:
-        query = file.read()
-    cursor.execute(query)
-    results = cursor.fetchall()
-    column_names = [column[0] for column in cursor.description]
-    df = pd.DataFrame(results, columns=column_names)
-    return df
-
 def write_to_csv(df, output_path, csv_file_name):
     csv_buffer = StringIO()
     df.to_csv(csv_buffer, index=False)
@@ -72,14 +46,12 @@ def write_to_csv(df, output_path, csv_file_name):
     with open(output_file, 'w', newline='', encoding='utf-8') as f:
         f.write(csv_buffer.getvalue())
 
-sharepoint_context = connect_to_sharepoint()
+# Project list comes from the local delta-synced mirror; SharePoint is only contacted when it is stale
 list_name = "Direct to Patient Project Details"
-projects = retrieve_list_data(sharepoint_context, list_name)
-
-cursor = connect_to_snowflake()
+projects = load_list(connect_to_sharepoint, list_name)
 
-#execute sql query based on sql.sql file in folder 
-performance = execute_query(cursor, os.path.join(script_dir, 'sql.sql'))
+#execute sql query based on sql.sql file in folder; a pooled session is borrowed only on a cache miss
+performance = query_file(os.path.join(script_dir, 'sql.sql'), max_age=3600, config=config)
 
 # Remove leading and trailing whitespace from 'Protocol' column
 projects['Protocol'] = projects['Protocol'].str.strip()
@@ -98,33 +70,22 @@ for column in columns_to_convert:
 # Calculate 'CPR'
 projects_performance['CPR'] = projects_performance['COSTS'] / projects_performance['REFERRALS']
 
-# Calculate revenues
-projects_performance['Rand Revenue'] = projects_performance['RANDOMIZED'] * projects_performance['Performance_x003a_RandPrice']
-
-# Calculate 'Rand Revenue' with a cap
-projects_performance['Rand Revenue'] = projects_performance.apply(
-    lambda row: min(row['Rand Revenue'], 
-                    row['Target_x0023_Rands'] * row['Performance_x003a_RandPrice']), axis=1)
-
-projects_performance['Consent Revenue'] = projects_performance['CONSENTS'] * projects_performance['Performance_x003a_ConsentPrice']
-
-# Calculate 'Consent Revenue' with a cap
-projects_performance['Consent Revenue'] = projects_performance.apply(
-    lambda row: min(row['Consent Revenue'], 
-                    row['Target_x0023_Consents'] * row['Performance_x003a_ConsentPrice']), axis=1)
+# Calculate revenues, each capped at the contracted target
+projects_performance['Rand Revenue'] = milestone_revenue(
+    projects_performance['RANDOMIZED'], projects_performance['Performance_x003a_RandPrice'], projects_performance['Target_x0023_Rands'])
 
-projects_performance['Referral Revenue'] = projects_performance.apply(lambda x: x['REFERRALS'] * x['Performance_x003a_ReferralPrice'] if x['Performance'] else 0, axis=1)
+projects_performance['Consent Revenue'] = milestone_revenue(
+    projects_performance['CONSENTS'], projects_performance['Performance_x003a_ConsentPrice'], projects_performance['Target_x0023_Consents'])
 
-# Calculate 'Ref Revenue' with a cap
-projects_performance['Referral Revenue'] = projects_performance.apply(
-    lambda row: min(row['Referral Revenue'], 
-                    row['Target_x0023_Referrals'] * row['Performance_x003a_ReferralPrice']), axis=1)
+projects_performance['Referral Revenue'] = referral_revenue(
+    projects_performance['REFERRALS'], projects_performance['Performance_x003a_ReferralPrice'],
+    projects_performance['Target_x0023_Referrals'], projects_performance['Performance'])
 
 projects_performance['client_cost'] = projects_performance['COSTS'] / projects_performance['Markup_x002f_Margin']
 
 # Calculate 'FixedFeeRev'
-projects_performance['FixedFeeRev'] = projects_performance.apply(
-    lambda row: row['client_cost'] if row['client_cost'] < row['FixedFeeValue'] else row['FixedFeeValue'], axis=1)
+# (client_cost if client_cost < FixedFeeValue else FixedFeeValue), so a NaN client cost falls back to the fee
+projects_performance['FixedFeeRev'] = capped(projects_performance['FixedFeeValue'], projects_performance['client_cost'])
 
 # Replace NaN values with 0
 projects_performance = projects_performance.fillna(0)
@@ -136,10 +97,9 @@ projects_performance['External_x0020_Budget'] = projects_performance['External_x
 projects_performance['MediaProfit'] = projects_performance['External_x0020_Budget'] - projects_performance['DTPInternalBudget']
 
 # Calculate 'CostRevenue'
-projects_performance['CostRevenue'] = projects_performance.apply(
-    lambda row: 0 if row['Performance'] == 1 else 
-    (row['MediaProfit']) if row['COSTS'] > row['MediaProfit'] 
-    else row['COSTS'] / row['Markup_x002f_Margin'], axis=1)
+projects_performance['CostRevenue'] = media_revenue(
+    projects_performance['COSTS'], projects_performance['MediaProfit'],
+    projects_performance['Markup_x002f_Margin'], projects_performance['Performance'])
 
 # Calculate 'TotalRevenue', 'NetProfit', and 'NetProfitMargin'
 projects_performance['TotalRevenue'] = projects_performance[['Rand Revenue', 'Consent Revenue', 'Referral Revenue', 'FixedFeeRev', 'CostRevenue']].sum(axis=1)
@@ -0,0 +1,17 @@
+import json
+from typing import Iterable, List, Tuple
+
+
+def normalize_protocols(protocols: Iterable) -> List[str]:
+    """Strip, de-duplicate and sort protocols so the same portfolio always binds the same value."""
+    return sorted({str(p).strip() for p in protocols if p is not None and str(p).strip()})
+
+
+def protocol_filter(column: str, protocols: Iterable) -> Tuple[str, List[str]]:
+    """Build a `column IN (...)` predicate and its bind parameters for a protocol list.
+
+    The list is bound as a single JSON array parameter, so the query text never changes with
+    the portfolio and a repeat run with the same protocols hits Snowflake's result cache.
+    """
+    clause = f"{column} IN (SELECT value::string FROM TABLE(FLATTEN(INPUT => PARSE_JSON(?))))"
+    return clause, [json.dumps(normalize_protocols(protocols))]
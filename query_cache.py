@@ -0,0 +1,201 @@
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import argparse
+import threading
+import configparser
+from typing import Callable, Optional, Sequence
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
+DEFAULT_CACHE_DIR = os.path.join(SCRIPT_DIR, '.query_cache')
+DEFAULT_MAX_SIZE_MB = 2048
+REFRESH_ENV = 'QUERY_CACHE_REFRESH'
+
+# String literals are kept verbatim; comments and runs of whitespace collapse to one space
+_SQL_TOKENS = re.compile(r"'(?:[^']|'')*'|--[^\n]*|/\*.*?\*/|\s+", re.DOTALL)
+
+
+def normalize_sql(query: str) -> str:
+    """Normalise SQL text so formatting and comment edits don't change the cache key."""
+    def replace(match):
+        return match.group(0) if match.group(0).startswith("'") else ' '
+
+    # Second pass merges the spaces left either side of a removed comment
+    normalized = _SQL_TOKENS.sub(replace, _SQL_TOKENS.sub(replace, query))
+    return normalized.strip().rstrip(';').strip()
+
+
+def cache_key(query: str, params: Optional[Sequence] = None) -> str:
+    """Hash the normalised SQL together with its bound parameters."""
+    payload = json.dumps([normalize_sql(query), list(params) if params is not None else None], default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def refresh_requested() -> bool:
+    """True when QUERY_CACHE_REFRESH=1 is set, e.g. by an entry point's --refresh flag."""
+    return os.getenv(REFRESH_ENV, '') not in ('', '0')
+
+
+def request_refresh():
+    """Bypass cached results for the rest of this process (and any child processes)."""
+    os.environ[REFRESH_ENV] = '1'
+
+
+def _unique_names(columns) -> list:
+    """Column names with repeats suffixed __2, __3, ... in order of appearance."""
+    seen, names = {}, []
+    for column in map(str, columns):
+        seen[column] = seen.get(column, 0) + 1
+        names.append(column if seen[column] == 1 else f"{column}__{seen[column]}")
+    return names
+
+
+class QueryCache:
+    """Parquet files on local disk keyed by query hash, with per-read max staleness and an LRU size cap."""
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, max_size_mb: float = DEFAULT_MAX_SIZE_MB):
+        self.cache_dir = cache_dir
+        self.max_bytes = int(max_size_mb * 2**20)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.parquet")
+
+    def get(self, key: str, max_age: float) -> Optional[pd.DataFrame]:
+        """Return the cached frame if it was written less than `max_age` seconds ago."""
+        path = self._path(key)
+        try:
+            metadata = pq.read_schema(path).metadata or {}
+            cached_at = float(metadata.get(b'cached_at', 0))
+            if time.time() - cached_at > max_age:
+                return None
+            df = pq.read_table(path).to_pandas(split_blocks=True, self_destruct=True)
+        except (OSError, pa.ArrowException, ValueError):
+            return None
+        if b'columns' in metadata:
+            df.columns = json.loads(metadata[b'columns'])
+        # mtime tracks last use for LRU eviction; the write time lives in the file metadata
+        os.utime(path)
+        return df
+
+    def put(self, key: str, df: pd.DataFrame, query: str = ''):
+        """Store a result atomically, then evict least recently used entries over the size cap.
+
+        Parquet needs unique column names, so a result with repeats (e.g. `select *` over a join)
+        is stored under suffixed names with the originals kept in the metadata for `get`.
+        """
+        metadata = {b'cached_at': str(time.time()).encode(), b'query': normalize_sql(query)[:1000].encode()}
+        if df.columns.has_duplicates:
+            metadata[b'columns'] = json.dumps([str(column) for column in df.columns]).encode()
+            df = df.set_axis(_unique_names(df.columns), axis=1)
+        try:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+        except (pa.ArrowException, ValueError) as e:
+            logging.warning(f"Query result not cacheable: {e}")
+            return
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), **metadata})
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def entries(self) -> list:
+        """(path, size, last_used) for each cached result, least recently used first."""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.parquet'):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((path, stat.st_size, stat.st_mtime))
+        return sorted(entries, key=lambda entry: entry[2])
+
+    def evict(self):
+        with self._lock:
+            entries = self.entries()
+            total = sum(size for _, size, _ in entries)
+            for path, size, _ in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+
+    def clear(self):
+        for path, _, _ in self.entries():
+            os.remove(path)
+
+    def get_or_fetch(self, query: str, params: Optional[Sequence], max_age: float,
+                     fetch: Callable[[], pd.DataFrame], refresh: Optional[bool] = None) -> pd.DataFrame:
+        """Serve a query from the cache while fresh, otherwise run `fetch` and store its result."""
+        key = cache_key(query, params)
+        if not (refresh_requested() if refresh is None else refresh):
+            df = self.get(key, max_age)
+            if df is not None:
+                self.hits += 1
+                return df
+        self.misses += 1
+        df = fetch()
+        self.put(key, df, query)
+        return df
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache(config: Optional[configparser.ConfigParser] = None) -> QueryCache:
+    """Return the process-wide cache, configured from the [query_cache] section on first use."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            section = config['query_cache'] if config is not None and config.has_section('query_cache') else {}
+            _cache = QueryCache(
+                cache_dir=section.get('dir', DEFAULT_CACHE_DIR),
+                max_size_mb=float(section.get('max_size_mb', DEFAULT_MAX_SIZE_MB)))
+        return _cache
+
+
+def max_age_for(name: str, default: Optional[float], config: Optional[configparser.ConfigParser] = None) -> Optional[float]:
+    """Per-query staleness policy: [query_cache_max_age] in config.ini overrides the caller's default."""
+    if config is not None and config.has_option('query_cache_max_age', name):
+        return config.getfloat('query_cache_max_age', name)
+    return default
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect or clear the local Snowflake query cache.")
+    parser.add_argument('--clear', action='store_true', help="Delete every cached result")
+    parser.add_argument('--dir', default=DEFAULT_CACHE_DIR)
+    args = parser.parse_args()
+
+    cache = QueryCache(args.dir)
+    if args.clear:
+        cache.clear()
+    rows = []
+    for path, size, last_used in cache.entries():
+        metadata = pq.read_schema(path).metadata or {}
+        rows.append({
+            'key': os.path.basename(path)[:12],
+            'mb': round(size / 2**20, 2),
+            'age_min': round((time.time() - float(metadata.get(b'cached_at', 0))) / 60, 1),
+            'last_used': time.strftime('%Y-%m-%d %H:%M', time.localtime(last_used)),
+            'query': metadata.get(b'query', b'').decode()[:60],
+        })
+    print(pd.DataFrame(rows).to_string(index=False) if rows else "Query cache is empty")
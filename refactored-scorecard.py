@@ -1,9 +1,12 @@
 import os
+import time
 import configparser
 from office365.runtime.auth.authentication_context import AuthenticationContext
 from office365.sharepoint.client_context import ClientContext
 import pandas as pd
-import snowflake.connector
+from query_builder import protocol_filter
+from sharepoint_lists import load_list
+from snowflake_client import format_query_timings, pooled_connection, run_queries_async
 
 def load_config():
     script_dir = os.path.dirname(os.path.realpath(__file__))
@@ -29,22 +32,6 @@ def connect_to_sharepoint(config):
         print(ctx_auth.get_last_error())
         return None
 
-def connect_to_snowflake(config):
-    conn = snowflake.connector.connect(
-        user=config.get("snowflake", "user"),
-        password=config.get("snowflake", "password"),
-        account=config.get("snowflake", "account"),
-        warehouse=config.get("snowflake", "warehouse"),
-        schema=config.get("snowflake", "schema"),
-        role=config.get("snowflake", "role")
-    )
-    return conn.cursor()
-
-def retrieve_list_data(ctx, list_name):
-    list_obj = ctx.web.lists.get_by_title(list_name)
-    items = list_obj.get_items().execute_query()
-    return pd.DataFrame([item.properties for item in items])
-
 def retrieve_ytd_projects(cursor):
     ytd_query = """
     SELECT protocol 
@@ -56,6 +43,7 @@ def retrieve_ytd_projects(cursor):
     return [row[0] for row in cursor.fetchall()]
 
 def get_active_projects_query(ytd_projects):
+    protocol_clause, params = protocol_filter('A.protocol', ytd_projects)
     return f"""
     WITH costs AS (
         SELECT protocol, SUM(value) AS costs 
@@ -73,11 +61,12 @@ def get_active_projects_query(ytd_projects):
         SUM(enrolled_randomized_ap) enrolled_randomized_ap
     FROM PRDB_PROD.PROD_US9_PAR_RPR.RH_REFERRAL_DETAIL_COUNTS A
     LEFT JOIN costs B ON A.protocol = B.protocol
-    WHERE A.protocol IN ({','.join([f"'{p}'" for p in ytd_projects])})
+    WHERE {protocol_clause}
     GROUP BY A.protocol, costs
-    """
+    """, params
 
 def get_dtp_study_query(ytd_projects):
+    protocol_clause, params = protocol_filter('dtp_rands.protocol', ytd_projects)
     return f"""
     WITH full_service_study AS (
         SELECT 
@@ -113,8 +102,8 @@ def get_dtp_study_query(ytd_projects):
         dtp_rands/study_rands AS dtp_prop 
     FROM dtp_rands 
     JOIN study_rands ON dtp_rands.protocol = study_rands.protocol
-    WHERE dtp_rands.protocol IN ({','.join([f"'{p}'" for p in ytd_projects])})
-    """
+    WHERE {protocol_clause}
+    """, params
 
 def process_data(projects, active_results_df, results_df_2):
     merged_df = projects.merge(active_results_df, on='Protocol', how='left')
@@ -175,29 +164,33 @@ def calculate_fov_targets(result_df):
 
 def main():
     config = load_config()
-    sharepoint_context = connect_to_sharepoint(config)
-    snowflake_cursor = connect_to_snowflake(config)
-
-    projects = retrieve_list_data(sharepoint_context, "Direct to Patient Project Details")
-    ytd_projects = retrieve_ytd_projects(snowflake_cursor)
-
-    ytd_projects_df = pd.DataFrame({'Protocol': ytd_projects})
-    projects['Protocol'] = projects['Protocol'].str.strip()
-    ytd_merged_df = projects.merge(ytd_projects_df, on='Protocol', how='inner')
-    ytd_projects = ytd_merged_df['Protocol'].tolist()
-
-    active_query = get_active_projects_query(ytd_projects)
-    snowflake_cursor.execute(active_query)
-    active_results = snowflake_cursor.fetchall()
-    active_results_df = pd.DataFrame(active_results, columns=[
-        'Protocol', 'Costs', 'Start Date', 'Referrals', 'FOVs Scheduled',
-        'FOVs', 'Consents', 'Enrolled Randomized AP'
-    ])
-
-    dtp_study_query = get_dtp_study_query(ytd_projects)
-    snowflake_cursor.execute(dtp_study_query)
-    results = snowflake_cursor.fetchall()
-    results_df_2 = pd.DataFrame(results, columns=['Protocol', 'Study Rands', 'DTP Rands', 'DTP Proportion'])
+    projects = load_list(lambda: connect_to_sharepoint(config), "Direct to Patient Project Details")
+
+    with pooled_connection(config) as snowflake_connection:
+        snowflake_cursor = snowflake_connection.cursor()
+        ytd_projects = retrieve_ytd_projects(snowflake_cursor)
+
+        ytd_projects_df = pd.DataFrame({'Protocol': ytd_projects})
+        projects['Protocol'] = projects['Protocol'].str.strip()
+        ytd_merged_df = projects.merge(ytd_projects_df, on='Protocol', how='inner')
+        ytd_projects = ytd_merged_df['Protocol'].tolist()
+
+        # The two report queries are independent, so run them side by side
+        query_start = time.perf_counter()
+        query_results, query_timings = run_queries_async(snowflake_connection, {
+            'active_query': get_active_projects_query(ytd_projects),
+            'dtp_study_query': get_dtp_study_query(ytd_projects),
+        })
+        print(format_query_timings(query_timings, time.perf_counter() - query_start))
+
+        active_results_df = query_results['active_query']
+        active_results_df.columns = [
+            'Protocol', 'Costs', 'Start Date', 'Referrals', 'FOVs Scheduled',
+            'FOVs', 'Consents', 'Enrolled Randomized AP'
+        ]
+
+        results_df_2 = query_results['dtp_study_query']
+        results_df_2.columns = ['Protocol', 'Study Rands', 'DTP Rands', 'DTP Proportion']
 
     result_df = process_data(projects, active_results_df, results_df_2)
     result_df = result_df[result_df['Protocol'].isin(ytd_projects)]
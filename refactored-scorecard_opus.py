@@ -5,7 +5,10 @@ from office365.sharepoint.client_context import ClientContext
 from office365.sharepoint.lists.list import List
 import pandas as pd
 import datetime
-import snowflake.connector
+import time
+from query_builder import protocol_filter
+from sharepoint_lists import load_list
+from snowflake_client import format_query_timings, pooled_connection, run_queries_async
 
 # Get the directory of the current script
 script_dir = os.path.dirname(os.path.realpath(__file__))
@@ -35,25 +38,6 @@ def connect_to_sharepoint():
         print(ctx_auth.get_last_error())
         return None
 
-def connect_to_snowflake():
-    # Snowflake connection
-    ctx = snowflake.connector.connect(
-        user=config.get("snowflake", "user"),
-        password=config.get("snowflake", "password"),
-        account=config.get("snowflake", "account"),
-        warehouse=config.get("snowflake", "warehouse"),
-        schema=config.get("snowflake", "schema"),
-        role=config.get("snowflake", "role"))
-
-    cursor = ctx.cursor()
-    return cursor
-
-def retrieve_list_data(ctx, list_name):
-    list_obj = ctx.web.lists.get_by_title(list_name)
-    items = list_obj.get_items().execute_query()
-    data = [item.properties for item in items]
-    return pd.DataFrame(data)
-
 def retrieve_ytd_projects(cursor):
     ytd_query = """
     SELECT protocol 
@@ -64,8 +48,9 @@ def retrieve_ytd_projects(cursor):
     cursor.execute(ytd_query)
     return [row[0] for row in cursor.fetchall()]
 
-def get_active_results(cursor, ytd_projects):
-    actives_query = f"""
+def get_active_results_query(ytd_projects):
+    protocol_clause, params = protocol_filter('A.protocol', ytd_projects)
+    return f"""
     WITH costs AS (
         SELECT protocol, SUM(value) AS costs 
         FROM PRDB_PROD.PROD_US9_PAR_RPR.V_DTP_MEDIA_COSTS 
@@ -81,15 +66,13 @@ def get_active_results(cursor, ytd_projects):
         SUM(enrolled_randomized_ap) enrolled_randomized_ap
     FROM PRDB_PROD.PROD_US9_PAR_RPR.RH_REFERRAL_DETAIL_COUNTS A
     LEFT JOIN costs B ON A.protocol = B.protocol
-    WHERE A.protocol IN ({','.join([f"'{p}'" for p in ytd_projects])})
+    WHERE {protocol_clause}
     GROUP BY a.protocol, costs
-    """
-    cursor.execute(actives_query)
-    active_results = cursor.fetchall()
-    return pd.DataFrame(active_results, columns=['Protocol', 'Costs', 'Start Date', 'Referrals', 'FOVs Scheduled', 'FOVs', 'Consents', 'Enrolled Randomized AP'])
+    """, params
 
-def get_dtp_study_results(cursor, ytd_projects):
-    dtp_study_query = f"""
+def get_dtp_study_query(ytd_projects):
+    protocol_clause, params = protocol_filter('dtp_rands.protocol', ytd_projects)
+    return f"""
     WITH full_service_study AS (
         SELECT 
             protocol,
@@ -120,10 +103,8 @@ def get_dtp_study_results(cursor, ytd_projects):
     SELECT dtp_rands.protocol, study_rands, dtp_rands, dtp_rands/study_rands dtp_prop 
     FROM dtp_rands 
     JOIN study_rands ON dtp_rands.protocol = study_rands.protocol
-    WHERE dtp_rands.protocol IN ({','.join([f"'{p}'" for p in ytd_projects])})
-    """
-    cursor.execute(dtp_study_query)
-    return pd.DataFrame(cursor.fetchall(), columns=['Protocol', 'Study Rands', 'DTP Rands', 'DTP Proportion'])
+    WHERE {protocol_clause}
+    """, params
 
 def merge_data(projects, active_results_df, dtp_study_results_df):
     merged_df = projects.merge(active_results_df, on='Protocol', how='left')
@@ -172,20 +153,29 @@ def calculate_fov_targets(result_df):
     return fov_targets
 
 def main():
-    sharepoint_context = connect_to_sharepoint()
-    snowflake_cursor = connect_to_snowflake()
-
     list_name = "Direct to Patient Project Details"
-    projects = retrieve_list_data(sharepoint_context, list_name)
-
-    ytd_projects = retrieve_ytd_projects(snowflake_cursor)
-    ytd_projects_df = pd.DataFrame({'Protocol': ytd_projects})
-    projects['Protocol'] = projects['Protocol'].str.strip()
-    ytd_merged_df = projects.merge(ytd_projects_df, on='Protocol', how='inner')
-    ytd_projects = ytd_merged_df['Protocol'].tolist()
-
-    active_results_df = get_active_results(snowflake_cursor, ytd_projects)
-    dtp_study_results_df = get_dtp_study_results(snowflake_cursor, ytd_projects)
+    projects = load_list(connect_to_sharepoint, list_name)
+
+    with pooled_connection(config) as snowflake_connection:
+        snowflake_cursor = snowflake_connection.cursor()
+        ytd_projects = retrieve_ytd_projects(snowflake_cursor)
+        ytd_projects_df = pd.DataFrame({'Protocol': ytd_projects})
+        projects['Protocol'] = projects['Protocol'].str.strip()
+        ytd_merged_df = projects.merge(ytd_projects_df, on='Protocol', how='inner')
+        ytd_projects = ytd_merged_df['Protocol'].tolist()
+
+        # Both report queries only depend on ytd_projects, so run them concurrently
+        query_start = time.perf_counter()
+        query_results, query_timings = run_queries_async(snowflake_connection, {
+            'active_results': get_active_results_query(ytd_projects),
+            'dtp_study_results': get_dtp_study_query(ytd_projects),
+        })
+        print(format_query_timings(query_timings, time.perf_counter() - query_start))
+
+        active_results_df = query_results['active_results']
+        active_results_df.columns = ['Protocol', 'Costs', 'Start Date', 'Referrals', 'FOVs Scheduled', 'FOVs', 'Consents', 'Enrolled Randomized AP']
+        dtp_study_results_df = query_results['dtp_study_results']
+        dtp_study_results_df.columns = ['Protocol', 'Study Rands', 'DTP Rands', 'DTP Proportion']
 
     result_df = merge_data(projects, active_results_df, dtp_study_results_df)
     result_df = calculate_metrics(result_df[result_df['Protocol'].isin(ytd_projects)])
@@ -4,7 +4,9 @@ from io import StringIO
 from office365.runtime.auth.authentication_context import AuthenticationContext
 from office365.sharepoint.client_context import ClientContext
 import pandas as pd
-import snowflake.connector
+from revenue_engine import capped, media_revenue, milestone_revenue, referral_revenue
+from sharepoint_lists import load_list
+from snowflake_client import query_file
 import win32com.client as win32
 
 def load_config():
@@ -31,30 +33,6 @@ def connect_to_sharepoint(config):
         print(ctx_auth.get_last_error())
         return None
 
-def connect_to_snowflake(config):
-    return snowflake.connector.connect(
-        user=config.get("snowflake", "user"),
-        password=config.get("snowflake", "password"),
-        account=config.get("snowflake", "account"),
-        warehouse=config.get("snowflake", "warehouse"),
-        schema=config.get("snowflake", "schema"),
-        role=config.get("snowflake", "role")
-    )
-
-def retrieve_sharepoint_data(ctx, list_name):
-    list_obj = ctx.web.lists.get_by_title(list_name)
-    items = list_obj.get_items().execute_query()
-    return pd.DataFrame([item.properties for item in items])
-
-def execute_snowflake_query(conn, sql_file_path):
-    with open(sql_file_path, 'r') as file:
-        query = file.read()
-    cursor = conn.cursor()
-    cursor.execute(query)
-    results = cursor.fetchall()
-    column_names = [column[0] for column in cursor.description]
-    return pd.DataFrame(results, columns=column_names)
-
 def preprocess_data(projects, performance):
     projects['Protocol'] = projects['Protocol'].str.strip()
     merged_data = pd.merge(projects, performance, left_on='Protocol', right_on='PROTOCOL', how='inner')
@@ -65,19 +43,15 @@ def calculate_metrics(df):
     df[numeric_columns] = df[numeric_columns].apply(pd.to_numeric, errors='coerce')
 
     df['CPR'] = df['COSTS'] / df['REFERRALS']
-    df['Rand_Revenue'] = df.apply(lambda row: min(row['RANDOMIZED'] * row['Performance_x003a_RandPrice'], 
-                                                  row['Target_x0023_Rands'] * row['Performance_x003a_RandPrice']), axis=1)
-    df['Consent_Revenue'] = df.apply(lambda row: min(row['CONSENTS'] * row['Performance_x003a_ConsentPrice'], 
-                                                     row['Target_x0023_Consents'] * row['Performance_x003a_ConsentPrice']), axis=1)
-    df['Referral_Revenue'] = df.apply(lambda row: min(row['REFERRALS'] * row['Performance_x003a_ReferralPrice'] if row['Performance'] else 0, 
-                                                      row['Target_x0023_Referrals'] * row['Performance_x003a_ReferralPrice']), axis=1)
+    df['Rand_Revenue'] = milestone_revenue(df['RANDOMIZED'], df['Performance_x003a_RandPrice'], df['Target_x0023_Rands'])
+    df['Consent_Revenue'] = milestone_revenue(df['CONSENTS'], df['Performance_x003a_ConsentPrice'], df['Target_x0023_Consents'])
+    df['Referral_Revenue'] = referral_revenue(df['REFERRALS'], df['Performance_x003a_ReferralPrice'],
+                                              df['Target_x0023_Referrals'], df['Performance'])
 
     df['Client_Cost'] = df['COSTS'] / df['Markup_x002f_Margin']
-    df['Fixed_Fee_Revenue'] = df.apply(lambda row: min(row['Client_Cost'], row['FixedFeeValue']), axis=1)
+    df['Fixed_Fee_Revenue'] = capped(df['Client_Cost'], df['FixedFeeValue'])
     df['Media_Profit'] = df['External_x0020_Budget'] - df['DTPInternalBudget']
-    df['Cost_Revenue'] = df.apply(lambda row: 0 if row['Performance'] == 1 else 
-                                  (row['Media_Profit'] if row['COSTS'] > row['Media_Profit'] 
-                                   else row['COSTS'] / row['Markup_x002f_Margin']), axis=1)
+    df['Cost_Revenue'] = media_revenue(df['COSTS'], df['Media_Profit'], df['Markup_x002f_Margin'], df['Performance'])
 
     revenue_columns = ['Rand_Revenue', 'Consent_Revenue', 'Referral_Revenue', 'Fixed_Fee_Revenue', 'Cost_Revenue']
     df['Total_Revenue'] = df[revenue_columns].sum(axis=1)
@@ -147,11 +121,8 @@ def send_email(df):
 
 def main():
     config = load_config()
-    sharepoint_context = connect_to_sharepoint(config)
-    snowflake_connection = connect_to_snowflake(config)
-
-    projects = retrieve_sharepoint_data(sharepoint_context, "Direct to Patient Project Details")
-    performance = execute_snowflake_query(snowflake_connection, os.path.join(os.path.dirname(__file__), 'sql.sql'))
+    projects = load_list(lambda: connect_to_sharepoint(config), "Direct to Patient Project Details")
+    performance = query_file(os.path.join(os.path.dirname(__file__), 'sql.sql'), max_age=3600, config=config)
 
     merged_data = preprocess_data(projects, performance)
     calculated_data = calculate_metrics(merged_data)
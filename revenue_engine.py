@@ -0,0 +1,160 @@
+import os
+import time
+import argparse
+import importlib.util
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+
+
+def _values(x) -> np.ndarray:
+    return x.to_numpy() if isinstance(x, (pd.Series, pd.Index)) else np.asarray(x)
+
+
+def capped(value, cap) -> np.ndarray:
+    """Column-wise Python min(value, cap): a NaN value stays NaN, a NaN cap leaves the value uncapped."""
+    value, cap = np.asarray(value, dtype=float), np.asarray(cap, dtype=float)
+    return np.where(cap < value, cap, value)
+
+
+def is_truthy(flags) -> np.ndarray:
+    """Python truthiness per element (None/0/False are false, NaN is true), as `if row[...]` sees it."""
+    return _values(flags).astype(bool)
+
+
+def is_one(flags) -> np.ndarray:
+    """Element-wise `== 1`, so True and 1.0 match while NaN and None don't."""
+    return _values(flags) == 1
+
+
+def milestone_revenue(count, price, target) -> np.ndarray:
+    """Revenue for a paid milestone, capped at the contracted target."""
+    count, price, target = (np.asarray(x, dtype=float) for x in (count, price, target))
+    return capped(count * price, target * price)
+
+
+def referral_revenue(referrals, price, target, performance) -> np.ndarray:
+    """Referral revenue is only earned on performance contracts, still capped at target."""
+    referrals, price, target = (np.asarray(x, dtype=float) for x in (referrals, price, target))
+    earned = np.where(is_truthy(performance), referrals * price, 0.0)
+    return capped(earned, target * price)
+
+
+def media_revenue(costs, media_profit, markup, performance) -> np.ndarray:
+    """Media pass-through revenue for non-performance contracts, limited to the budgeted profit."""
+    costs, media_profit, markup = (np.asarray(x, dtype=float) for x in (costs, media_profit, markup))
+    return np.where(is_one(performance), 0.0, np.where(costs > media_profit, media_profit, costs / markup))
+
+
+def scenario_revenue(df: pd.DataFrame, rand_prices, consent_prices, referral_prices) -> Tuple[np.ndarray, np.ndarray]:
+    """Evaluate many pricing scenarios against the projects in one pass.
+
+    `df` is the output of refined-project-summary's calculate_metrics. Each price argument
+    broadcasts to (n_scenarios, n_projects), e.g. a 2-D array of per-project prices or a
+    (n_scenarios, 1) column of flat prices. Returns total revenue and net profit, both shaped
+    (n_scenarios, n_projects), with NaN components skipped in the total as pandas' sum does.
+    """
+    performance = is_truthy(df['Performance'])
+    rand = capped(df['RANDOMIZED'].to_numpy(dtype=float) * np.asarray(rand_prices, dtype=float),
+                  df['Target_x0023_Rands'].to_numpy(dtype=float) * np.asarray(rand_prices, dtype=float))
+    consent = capped(df['CONSENTS'].to_numpy(dtype=float) * np.asarray(consent_prices, dtype=float),
+                     df['Target_x0023_Consents'].to_numpy(dtype=float) * np.asarray(consent_prices, dtype=float))
+    referral_prices = np.asarray(referral_prices, dtype=float)
+    referral = capped(np.where(performance, df['REFERRALS'].to_numpy(dtype=float) * referral_prices, 0.0),
+                      df['Target_x0023_Referrals'].to_numpy(dtype=float) * referral_prices)
+    # Fixed fee and media revenue don't depend on milestone prices
+    fixed = df[['Fixed_Fee_Revenue', 'Cost_Revenue']].sum(axis=1).to_numpy(dtype=float)
+
+    total = np.nansum(np.broadcast_arrays(rand, consent, referral), axis=0) + fixed
+    net_profit = total - df['COSTS'].to_numpy(dtype=float)
+    return total, net_profit
+
+
+def _rowwise_revenue(df: pd.DataFrame) -> pd.DataFrame:
+    """The original row-by-row revenue logic, kept as the golden reference for the benchmark."""
+    df = df.copy()
+    df['Rand_Revenue'] = df.apply(lambda row: min(row['RANDOMIZED'] * row['Performance_x003a_RandPrice'],
+                                                  row['Target_x0023_Rands'] * row['Performance_x003a_RandPrice']), axis=1)
+    df['Consent_Revenue'] = df.apply(lambda row: min(row['CONSENTS'] * row['Performance_x003a_ConsentPrice'],
+                                                     row['Target_x0023_Consents'] * row['Performance_x003a_ConsentPrice']), axis=1)
+    df['Referral_Revenue'] = df.apply(lambda row: min(row['REFERRALS'] * row['Performance_x003a_ReferralPrice'] if row['Performance'] else 0,
+                                                      row['Target_x0023_Referrals'] * row['Performance_x003a_ReferralPrice']), axis=1)
+    df['Client_Cost'] = df['COSTS'] / df['Markup_x002f_Margin']
+    df['Fixed_Fee_Revenue'] = df.apply(lambda row: min(row['Client_Cost'], row['FixedFeeValue']), axis=1)
+    df['Media_Profit'] = df['External_x0020_Budget'] - df['DTPInternalBudget']
+    df['Cost_Revenue'] = df.apply(lambda row: 0 if row['Performance'] == 1 else
+                                  (row['Media_Profit'] if row['COSTS'] > row['Media_Profit']
+                                   else row['COSTS'] / row['Markup_x002f_Margin']), axis=1)
+    return df
+
+
+def _shipped_calculate_metrics():
+    """calculate_metrics from refined-project-summary.py, loaded by path since the file name isn't importable."""
+    path = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'refined-project-summary.py')
+    spec = importlib.util.spec_from_file_location('refined_project_summary', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.calculate_metrics
+
+
+def _synthetic_projects(rows: int, seed: int = 7) -> pd.DataFrame:
+    """Projects shaped like the SharePoint + sql.sql merge, with NaNs sprinkled through every input."""
+    rng = np.random.default_rng(seed)
+
+    def with_nans(values, share=0.05):
+        values = values.astype(float)
+        values[rng.random(rows) < share] = np.nan
+        return values
+
+    return pd.DataFrame({
+        'Performance': rng.choice(np.array([True, False, None], dtype=object), rows, p=[0.45, 0.45, 0.10]),
+        'COSTS': with_nans(rng.random(rows) * 50_000),
+        'REFERRALS': with_nans(rng.integers(0, 2_000, rows)),
+        'CONSENTS': with_nans(rng.integers(0, 300, rows)),
+        'RANDOMIZED': with_nans(rng.integers(0, 100, rows)),
+        'Performance_x003a_RandPrice': with_nans(rng.integers(500, 5_000, rows)),
+        'Performance_x003a_ConsentPrice': with_nans(rng.integers(100, 1_000, rows)),
+        'Performance_x003a_ReferralPrice': with_nans(rng.integers(10, 100, rows)),
+        'Target_x0023_Rands': with_nans(rng.integers(0, 100, rows)),
+        'Target_x0023_Consents': with_nans(rng.integers(0, 300, rows)),
+        'Target_x0023_Referrals': with_nans(rng.integers(0, 2_000, rows)),
+        'Markup_x002f_Margin': with_nans(rng.uniform(0.6, 0.9, rows)),
+        'FixedFeeValue': with_nans(rng.random(rows) * 60_000),
+        'External_x0020_Budget': with_nans(rng.random(rows) * 80_000),
+        'DTPInternalBudget': with_nans(rng.random(rows) * 60_000),
+    })
+
+
+def benchmark(rows: int = 20_000, scenarios: int = 1_000) -> pd.DataFrame:
+    """Check the shipped calculate_metrics against the row-wise reference and time both, plus a scenario sweep."""
+    df = _synthetic_projects(rows)
+    timings = []
+    for name, compute in [('row-wise apply', _rowwise_revenue), ('calculate_metrics', _shipped_calculate_metrics())]:
+        start = time.perf_counter()
+        result = compute(df.copy())
+        timings.append({'path': name, 'rows': rows, 'seconds': round(time.perf_counter() - start, 4)})
+        if name == 'row-wise apply':
+            golden = result
+    pd.testing.assert_frame_equal(golden, result[golden.columns], check_dtype=False)
+
+    rng = np.random.default_rng(11)
+    rand_prices = df['Performance_x003a_RandPrice'].to_numpy() * rng.uniform(0.8, 1.2, (scenarios, 1))
+    start = time.perf_counter()
+    scenario_revenue(result, rand_prices, result['Performance_x003a_ConsentPrice'], result['Performance_x003a_ReferralPrice'])
+    timings.append({'path': f'{scenarios} price scenarios', 'rows': rows, 'seconds': round(time.perf_counter() - start, 4)})
+    return pd.DataFrame(timings)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Column-wise revenue and profit calculations for the project summary.")
+    parser.add_argument('--benchmark', action='store_true',
+                        help="Verify refined-project-summary's calculate_metrics against the row-wise logic and time both")
+    parser.add_argument('--rows', type=int, default=20_000)
+    parser.add_argument('--scenarios', type=int, default=1_000)
+    args = parser.parse_args()
+
+    if args.benchmark:
+        print(benchmark(args.rows, args.scenarios).to_string(index=False))
+    else:
+        parser.print_help()
@@ -5,7 +5,10 @@ from office365.sharepoint.client_context import ClientContext
 from office365.sharepoint.lists.list import List
 import pandas as pd
 import datetime
-import snowflake.connector
+import time
+from query_builder import protocol_filter
+from sharepoint_lists import load_list
+from snowflake_client import format_query_timings, pooled_connection, run_queries_async
 
 # Get the directory of the current script
 script_dir = os.path.dirname(os.path.realpath(__file__))
@@ -35,40 +38,19 @@ def connect_to_sharepoint():
         print(ctx_auth.get_last_error())
         return None
 
-def connect_to_snowflake():
-    # Snowflake connection
-    ctx = snowflake.connector.connect(
-        user = config.get("snowflake", "user"),
-        password = config.get("snowflake", "password"),
-        account= config.get("snowflake", "account"),
-        warehouse = config.get("snowflake", "warehouse"),
-        schema = config.get("snowflake", "schema"),
-        role = config.get("snowflake", "role"))
-
-    cursor = ctx.cursor()
-    return cursor
-
-# Use the functions
-sharepoint_context = connect_to_sharepoint()
-snowflake_cursor = connect_to_snowflake()
-
-def retrieve_list_data(ctx, list_name):
-    list_obj = ctx.web.lists.get_by_title(list_name)
-    items = list_obj.get_items().execute_query()
-    data = []
-    for item in items:
-        data.append(item.properties)
-    return pd.DataFrame(data)
-
-# Retrieve data from the SharePoint list
+# Retrieve data from the local mirror of the SharePoint list (delta-synced, connects only when stale)
 list_name = "Direct to Patient Project Details"
-projects = retrieve_list_data(sharepoint_context, list_name)
+projects = load_list(connect_to_sharepoint, list_name)
 
 # Filter the active projects
 active_projects = projects.loc[projects['Active'] == True, 'Protocol'].tolist()
 
 #MTD Projects
 
+# Bind the protocol list instead of pasting it into the SQL text
+actives_filter, actives_params = protocol_filter('A.protocol', active_projects)
+dtp_filter, dtp_params = protocol_filter('dtp_rands.protocol', active_projects)
+
 # Custom SQL query using the active projects
 actives_query = f"""
 with costs as (
@@ -87,7 +69,7 @@ select A.protocol,
     sum(enrolled_randomized_ap) enrolled_randomized_ap
 from PRDB_PROD.PROD_US9_PAR_RPR.RH_REFERRAL_DETAIL_COUNTS A
 left join costs B on A.protocol = B.protocol
-where A.protocol in ({','.join([f"'{p}'" for p in active_projects])})
+where {actives_filter}
 group by a.protocol, costs"""
 
 # Integrate the query using the active_projects list to filter
@@ -116,96 +98,9 @@ select protocol, sum(enrolled_randomized_ap) dtp_rands from PRDB_PROD.PROD_US9_P
 
 select dtp_rands.protocol, study_rands, dtp_rands, dtp_rands/study_rands dtp_prop from dtp_rands 
 join study_rands on dtp_rands.protocol = study_rands.protocol
-where dtp_rands.protocol in ({','.join([f"'{p}'" for p in active_projects])})
+where {dtp_filter}
 """
 
-# Execute the query
-snowflake_cursor.execute(dtp_study)
-
-# Fetch all the results
-results = snowflake_cursor.fetchall()
-
-# Convert results to a dataframe
-results_df_2 = pd.DataFrame(results, columns=['Protocol', 'Study Rands', 'DTP Rands', 'DTP Proportion'])
-
-# Execute the query
-snowflake_cursor.execute(actives_query)
-
-# Fetch all the results
-active_results = snowflake_cursor.fetchall()
-
-# Convert active_results to a dataframe
-active_results_df = pd.DataFrame(active_results, columns=['Protocol', 'Costs', 'Start Date', 'Referrals', 'FOVs Scheduled', 'FOVs', 'Consents', 'Enrolled Randomized AP'])
-
-# Join projects, active_results_df, and results_df_2 on Protocol column
-merged_df = projects.merge(active_results_df, on='Protocol', how='left')
-merged_df = merged_df.merge(results_df_2, on='Protocol', how='left')
-
-# Select the desired columns and rename them
-result_df = merged_df[['Sponsor', 'Active', 'Title', 'Protocol', 'Duration', 'Target_x0023_Referrals', 'Target_x0023_FOVs', 'Target_x0023_Consents', 'Target_x0023_Rands', 'Start Date', 'Costs', 'Referrals', 'FOVs Scheduled', 'FOVs', 'Consents', 'Enrolled Randomized AP', 'Study Rands', 'DTP Rands', 'DTP Proportion']]
-result_df = result_df.rename(columns={'Target_x0023_Referrals': 'Target Referrals', 'Target_x0023_FOVs': 'Target FOVs', 'Target_x0023_Consents': 'Target Consents', 'Target_x0023_Rands': 'Target Rands'})
-
-# Calculate the Target FOV Rate
-result_df['Target FOV Rate'] = (result_df['Target FOVs'] / result_df['Target Referrals']).round(4)
-
-#Calculate the Actual FOV Rate
-result_df['Actual FOV Rate'] = (result_df['FOVs'] / result_df['Referrals']).round(4)
-
-#Convert Costs to float
-result_df['Costs'] = result_df['Costs'].astype(float)
-
-# Filter to only include active projects
-result_df = result_df[result_df['Active'] == True]
-
-# Calculate the current date
-current_date = pd.Timestamp.now().normalize()
-
-# Convert 'Start Date' to datetime
-result_df['Start Date'] = pd.to_datetime(result_df['Start Date'])
-
-# Calculate the % elapsed
-result_df['elapsed 0'] = ((current_date - result_df['Start Date']).dt.days / 7) / result_df['Duration']
-result_df['elapsed 14'] = ((current_date - pd.DateOffset(days=14)) - result_df['Start Date']).dt.days / 7 / result_df['Duration']
-result_df['elapsed 30'] = ((current_date - pd.DateOffset(days=30)) - result_df['Start Date']).dt.days / 7 / result_df['Duration']
-result_df['elapsed 60'] = ((current_date - pd.DateOffset(days=60)) - result_df['Start Date']).dt.days / 7 / result_df['Duration']
-
-# Calculate the Target Referrals to Date
-result_df['Target Referrals to Date'] = result_df['elapsed 0'] * result_df['Target Referrals']
-result_df['Target FOVs to Date'] = result_df['elapsed 14'] * result_df['Target FOVs']
-result_df['Target Consents to Date'] = result_df['elapsed 30'] * result_df['Target Consents']
-result_df['Target RANDs to Date'] = result_df['elapsed 60'] * result_df['Target Rands']
-
-# Check if Referrals >= Target Referrals to Date
-result_df['Monthly Goal Refs'] = result_df['Referrals'] >= 0.9 * result_df['Target Referrals to Date']
-result_df['Monthly Goal Fovs'] = result_df['FOVs'] >= 0.9 * result_df['Target FOVs to Date']
-result_df['Monthly Goal Cons'] = result_df['Consents'] >= 0.9 * result_df['Target Consents to Date']
-result_df['Monthly Goal RANDs'] = result_df['Enrolled Randomized AP'] >= 0.9 * result_df['Target RANDs to Date']
-
-#Select the desired columns
-result_df = result_df[['Sponsor', 'Title', 'Costs', 'Target FOV Rate', 'Actual FOV Rate', 'Monthly Goal Refs', 'Monthly Goal Fovs', 'Monthly Goal Cons', 'Monthly Goal RANDs', 'Study Rands', 'DTP Rands']]
-
-# Output the resulting dataframe to a CSV file
-#result_df.to_csv('C:/Users/q1032269/OneDrive - IQVIA/Documents/Gitz/Monthly Scorecard/scorecard_results.csv', index=False)
-
-# Calculate the total sum of costs
-total_costs = result_df['Costs'].sum()
-
-# Calculate the costs proportion
-result_df['Costs Proportion'] = (result_df['Costs'] / total_costs).round(4)
-
-# Calculate the "% to target" Actual FOV Rate / Target FOV rate
-result_df['% to Target'] = (result_df['Actual FOV Rate'] / result_df['Target FOV Rate']).round(4)
-result_df['% to Target'] = result_df['% to Target'].clip(upper=1.0)
-
-# Calculate the weighted average of the overall FOV "% to target" based on the cost proportion
-weighted_avg = (result_df['% to Target'] * result_df['Costs Proportion']).sum()
-
-# Create the FOV Targets dataframe
-FOV_targets = result_df[['Title', 'Costs', 'Costs Proportion', 'Target FOV Rate', 'Actual FOV Rate', '% to Target']]
-FOV_targets['Weighted Avg'] = weighted_avg
-
-#FOV_targets.to_csv('C:/Users/q1032269/OneDrive - IQVIA/Documents/Gitz/Monthly Scorecard/FOV_targets.csv', index=False)
-
 #YTD Projects
 
 def retrieve_ytd_projects(cursor):
@@ -219,7 +114,8 @@ def retrieve_ytd_projects(cursor):
     return [row[0] for row in cursor.fetchall()]
 
 # Retrieve the Year to Date projects
-ytd_projects = retrieve_ytd_projects(snowflake_cursor)
+with pooled_connection(config) as snowflake_connection:
+    ytd_projects = retrieve_ytd_projects(snowflake_connection.cursor())
 
 # Inner join ytd_projects with projects
 ytd_projects_df = pd.DataFrame({'Protocol': ytd_projects})
@@ -228,6 +124,9 @@ ytd_merged_df = projects.merge(ytd_projects_df, on='Protocol', how='inner')
 # Print the Year to Date projects
 print(ytd_merged_df['Protocol'].tolist())
 
+ytd_filter, ytd_params = protocol_filter('A.protocol', ytd_merged_df['Protocol'])
+ytd_dtp_filter, ytd_dtp_params = protocol_filter('dtp_rands.protocol', ytd_merged_df['Protocol'])
+
 # Custom SQL query using the active projects
 ytd_query = f"""
 with costs as (
@@ -246,7 +145,7 @@ select A.protocol,
     sum(enrolled_randomized_ap) enrolled_randomized_ap
 from PRDB_PROD.PROD_US9_PAR_RPR.RH_REFERRAL_DETAIL_COUNTS A
 left join costs B on A.protocol = B.protocol
-where A.protocol in ({','.join([f"'{p}'" for p in ytd_merged_df])})
+where {ytd_filter}
 group by a.protocol, costs"""
 
 # Integrate the query using the active_projects list to filter
@@ -275,23 +174,96 @@ select protocol, sum(enrolled_randomized_ap) dtp_rands from PRDB_PROD.PROD_US9_P
 
 select dtp_rands.protocol, study_rands, dtp_rands, dtp_rands/study_rands dtp_prop from dtp_rands 
 join study_rands on dtp_rands.protocol = study_rands.protocol
-where dtp_rands.protocol in ({','.join([f"'{p}'" for p in ytd_merged_df])})
+where {ytd_dtp_filter}
 """
 
-# Execute the query
-snowflake_cursor.execute(ytd_dtp_study)
+# Run the MTD and YTD queries concurrently; none depends on another's result
+query_start = time.perf_counter()
+with pooled_connection(config) as snowflake_connection:
+    query_results, query_timings = run_queries_async(snowflake_connection, {
+        'actives_query': (actives_query, actives_params),
+        'dtp_study': (dtp_study, dtp_params),
+        'ytd_query': (ytd_query, ytd_params),
+        'ytd_dtp_study': (ytd_dtp_study, ytd_dtp_params),
+    })
+print("Scorecard query timings:")
+print(format_query_timings(query_timings, time.perf_counter() - query_start))
+
+# Convert results to dataframes
+results_df_2 = query_results['dtp_study']
+results_df_2.columns = ['Protocol', 'Study Rands', 'DTP Rands', 'DTP Proportion']
+active_results_df = query_results['actives_query']
+active_results_df.columns = ['Protocol', 'Costs', 'Start Date', 'Referrals', 'FOVs Scheduled', 'FOVs', 'Consents', 'Enrolled Randomized AP']
+ytd_results_df_2 = query_results['ytd_dtp_study']
+ytd_results_df_2.columns = ['Protocol', 'Study Rands', 'DTP Rands', 'DTP Proportion']
+ytd_results_df = query_results['ytd_query']
+ytd_results_df.columns = ['Protocol', 'Costs', 'Start Date', 'Referrals', 'FOVs Scheduled', 'FOVs', 'Consents', 'Enrolled Randomized AP']
+
+# Join projects, active_results_df, and results_df_2 on Protocol column
+merged_df = projects.merge(active_results_df, on='Protocol', how='left')
+merged_df = merged_df.merge(results_df_2, on='Protocol', how='left')
+
+# Select the desired columns and rename them
+result_df = merged_df[['Sponsor', 'Active', 'Title', 'Protocol', 'Duration', 'Target_x0023_Referrals', 'Target_x0023_FOVs', 'Target_x0023_Consents', 'Target_x0023_Rands', 'Start Date', 'Costs', 'Referrals', 'FOVs Scheduled', 'FOVs', 'Consents', 'Enrolled Randomized AP', 'Study Rands', 'DTP Rands', 'DTP Proportion']]
+result_df = result_df.rename(columns={'Target_x0023_Referrals': 'Target Referrals', 'Target_x0023_FOVs': 'Target FOVs', 'Target_x0023_Consents': 'Target Consents', 'Target_x0023_Rands': 'Target Rands'})
+
+# Calculate the Target FOV Rate
+result_df['Target FOV Rate'] = (result_df['Target FOVs'] / result_df['Target Referrals']).round(4)
+
+#Calculate the Actual FOV Rate
+result_df['Actual FOV Rate'] = (result_df['FOVs'] / result_df['Referrals']).round(4)
+
+#Convert Costs to float
+result_df['Costs'] = result_df['Costs'].astype(float)
+
+# Filter to only include active projects
+result_df = result_df[result_df['Active'] == True]
+
+# Calculate the current date
+current_date = pd.Timestamp.now().normalize()
+
+# Convert 'Start Date' to datetime
+result_df['Start Date'] = pd.to_datetime(result_df['Start Date'])
+
+# Calculate the % elapsed
+result_df['elapsed 0'] = ((current_date - result_df['Start Date']).dt.days / 7) / result_df['Duration']
+result_df['elapsed 14'] = ((current_date - pd.DateOffset(days=14)) - result_df['Start Date']).dt.days / 7 / result_df['Duration']
+result_df['elapsed 30'] = ((current_date - pd.DateOffset(days=30)) - result_df['Start Date']).dt.days / 7 / result_df['Duration']
+result_df['elapsed 60'] = ((current_date - pd.DateOffset(days=60)) - result_df['Start Date']).dt.days / 7 / result_df['Duration']
+
+# Calculate the Target Referrals to Date
+result_df['Target Referrals to Date'] = result_df['elapsed 0'] * result_df['Target Referrals']
+result_df['Target FOVs to Date'] = result_df['elapsed 14'] * result_df['Target FOVs']
+result_df['Target Consents to Date'] = result_df['elapsed 30'] * result_df['Target Consents']
+result_df['Target RANDs to Date'] = result_df['elapsed 60'] * result_df['Target Rands']
 
-# Fetch all the results
-ytd_dtp_study_results = snowflake_cursor.fetchall()
+# Check if Referrals >= Target Referrals to Date
+result_df['Monthly Goal Refs'] = result_df['Referrals'] >= 0.9 * result_df['Target Referrals to Date']
+result_df['Monthly Goal Fovs'] = result_df['FOVs'] >= 0.9 * result_df['Target FOVs to Date']
+result_df['Monthly Goal Cons'] = result_df['Consents'] >= 0.9 * result_df['Target Consents to Date']
+result_df['Monthly Goal RANDs'] = result_df['Enrolled Randomized AP'] >= 0.9 * result_df['Target RANDs to Date']
 
-# Convert results to a dataframe
-ytd_results_df_2 = pd.DataFrame(ytd_dtp_study_results, columns=['Protocol', 'Study Rands', 'DTP Rands', 'DTP Proportion'])
+#Select the desired columns
+result_df = result_df[['Sponsor', 'Title', 'Costs', 'Target FOV Rate', 'Actual FOV Rate', 'Monthly Goal Refs', 'Monthly Goal Fovs', 'Monthly Goal Cons', 'Monthly Goal RANDs', 'Study Rands', 'DTP Rands']]
 
-# Execute the query
-snowflake_cursor.execute(ytd_query)
+# Output the resulting dataframe to a CSV file
+#result_df.to_csv('C:/Users/q1032269/OneDrive - IQVIA/Documents/Gitz/Monthly Scorecard/scorecard_results.csv', index=False)
 
-# Fetch all the results
-ytd_results = snowflake_cursor.fetchall()
+# Calculate the total sum of costs
+total_costs = result_df['Costs'].sum()
+
+# Calculate the costs proportion
+result_df['Costs Proportion'] = (result_df['Costs'] / total_costs).round(4)
+
+# Calculate the "% to target" Actual FOV Rate / Target FOV rate
+result_df['% to Target'] = (result_df['Actual FOV Rate'] / result_df['Target FOV Rate']).round(4)
+result_df['% to Target'] = result_df['% to Target'].clip(upper=1.0)
 
-# Convert active_results to a dataframe
-ytd_results_df = pd.DataFrame(ytd_results, columns=['Protocol', 'Costs', 'Start Date', 'Referrals', 'FOVs Scheduled', 'FOVs', 'Consents', 'Enrolled Randomized AP'])
\ No newline at end of file
+# Calculate the weighted average of the overall FOV "% to target" based on the cost proportion
+weighted_avg = (result_df['% to Target'] * result_df['Costs Proportion']).sum()
+
+# Create the FOV Targets dataframe
+FOV_targets = result_df[['Title', 'Costs', 'Costs Proportion', 'Target FOV Rate', 'Actual FOV Rate', '% to Target']]
+FOV_targets['Weighted Avg'] = weighted_avg
+
+#FOV_targets.to_csv('C:/Users/q1032269/OneDrive - IQVIA/Documents/Gitz/Monthly Scorecard/FOV_targets.csv', index=False)
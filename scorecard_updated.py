@@ -5,7 +5,10 @@ from office365.sharepoint.client_context import ClientContext
 from office365.sharepoint.lists.list import List
 import pandas as pd
 import datetime
-import snowflake.connector
+import time
+from query_builder import protocol_filter
+from sharepoint_lists import load_list
+from snowflake_client import format_query_timings, pooled_connection, run_queries_async
 
 # Get the directory of the current script
 script_dir = os.path.dirname(os.path.realpath(__file__))
@@ -35,34 +38,9 @@ def connect_to_sharepoint():
         print(ctx_auth.get_last_error())
         return None
 
-def connect_to_snowflake():
-    # Snowflake connection
-    ctx = snowflake.connector.connect(
-        user = config.get("snowflake", "user"),
-        password = config.get("snowflake", "password"),
-        account= config.get("snowflake", "account"),
-        warehouse = config.get("snowflake", "warehouse"),
-        schema = config.get("snowflake", "schema"),
-        role = config.get("snowflake", "role"))
-
-    cursor = ctx.cursor()
-    return cursor
-
-# Use the functions
-sharepoint_context = connect_to_sharepoint()
-snowflake_cursor = connect_to_snowflake()
-
-def retrieve_list_data(ctx, list_name):
-    list_obj = ctx.web.lists.get_by_title(list_name)
-    items = list_obj.get_items().execute_query()
-    data = []
-    for item in items:
-        data.append(item.properties)
-    return pd.DataFrame(data)
-
-# Retrieve data from the SharePoint list
+# Retrieve data from the local mirror of the SharePoint list (delta-synced, connects only when stale)
 list_name = "Direct to Patient Project Details"
-projects = retrieve_list_data(sharepoint_context, list_name)
+projects = load_list(connect_to_sharepoint, list_name)
 
 def retrieve_ytd_projects(cursor):
     ytd_query = """
@@ -75,7 +53,8 @@ def retrieve_ytd_projects(cursor):
     return [row[0] for row in cursor.fetchall()]
 
 # Retrieve the Year to Date projects
-ytd_projects = retrieve_ytd_projects(snowflake_cursor)
+with pooled_connection(config) as snowflake_connection:
+    ytd_projects = retrieve_ytd_projects(snowflake_connection.cursor())
 
 print(ytd_projects)
 
@@ -88,6 +67,10 @@ ytd_projects = ytd_merged_df['Protocol'].tolist()
 print('-----------------------------------')
 print(ytd_projects)
 
+# Bind the protocol list instead of pasting it into the SQL text
+actives_filter, actives_params = protocol_filter('A.protocol', ytd_projects)
+dtp_filter, dtp_params = protocol_filter('dtp_rands.protocol', ytd_projects)
+
 # Custom SQL query using the active projects
 actives_query = f"""
 with costs as (
@@ -106,7 +89,7 @@ select A.protocol,
     sum(enrolled_randomized_ap) enrolled_randomized_ap
 from PRDB_PROD.PROD_US9_PAR_RPR.RH_REFERRAL_DETAIL_COUNTS A
 left join costs B on A.protocol = B.protocol
-where A.protocol in ({','.join([f"'{p}'" for p in ytd_projects])})
+where {actives_filter}
 group by a.protocol, costs"""
 
 # Integrate the query using the active_projects list to filter
@@ -135,26 +118,23 @@ select protocol, sum(enrolled_randomized_ap) dtp_rands from PRDB_PROD.PROD_US9_P
 
 select dtp_rands.protocol, study_rands, dtp_rands, dtp_rands/study_rands dtp_prop from dtp_rands 
 join study_rands on dtp_rands.protocol = study_rands.protocol
-where dtp_rands.protocol in ({','.join([f"'{p}'" for p in ytd_projects])})
+where {dtp_filter}
 """
 
-# Execute the query
-snowflake_cursor.execute(dtp_study)
-
-# Fetch all the results
-results = snowflake_cursor.fetchall()
-
-# Convert results to a dataframe
-results_df_2 = pd.DataFrame(results, columns=['Protocol', 'Study Rands', 'DTP Rands', 'DTP Proportion'])
-
-# Execute the query
-snowflake_cursor.execute(actives_query)
-
-# Fetch all the results
-active_results = snowflake_cursor.fetchall()
-
-# Convert active_results to a dataframe
-active_results_df = pd.DataFrame(active_results, columns=['Protocol', 'Costs', 'Start Date', 'Referrals', 'FOVs Scheduled', 'FOVs', 'Consents', 'Enrolled Randomized AP'])
+# Run both queries concurrently on the pooled session
+query_start = time.perf_counter()
+with pooled_connection(config) as snowflake_connection:
+    query_results, query_timings = run_queries_async(snowflake_connection, {
+        'dtp_study': (dtp_study, dtp_params),
+        'actives_query': (actives_query, actives_params),
+    })
+print(format_query_timings(query_timings, time.perf_counter() - query_start))
+
+# Convert results to dataframes
+results_df_2 = query_results['dtp_study']
+results_df_2.columns = ['Protocol', 'Study Rands', 'DTP Rands', 'DTP Proportion']
+active_results_df = query_results['actives_query']
+active_results_df.columns = ['Protocol', 'Costs', 'Start Date', 'Referrals', 'FOVs Scheduled', 'FOVs', 'Consents', 'Enrolled Randomized AP']
 
 # Join projects, active_results_df, and results_df_2 on Protocol column
 merged_df = projects.merge(active_results_df, on='Protocol', how='left')
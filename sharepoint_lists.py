@@ -0,0 +1,154 @@
+import os
+import re
+import json
+import logging
+import argparse
+import threading
+import configparser
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+import pandas as pd
+
+SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
+MIRROR_DIR = os.path.join(SCRIPT_DIR, '.sharepoint_mirror')
+PROJECT_LIST = "Direct to Patient Project Details"
+# Seconds to wait for SharePoint before serving the mirror instead
+DEFAULT_TIMEOUT = 60
+
+
+def connect_to_sharepoint(config: configparser.ConfigParser):
+    """Open a ClientContext for the DTP Marketing Operations site."""
+    from office365.runtime.auth.authentication_context import AuthenticationContext
+    from office365.sharepoint.client_context import ClientContext
+
+    site_url = "https://quintiles.sharepoint.com/sites/Direct_to_Patient-Marketing_Operations"
+    ctx_auth = AuthenticationContext(url=site_url)
+    if ctx_auth.acquire_token_for_user(config.get("windows", "user"), config.get("windows", "password")):
+        return ClientContext(site_url, ctx_auth)
+    logging.error(ctx_auth.get_last_error())
+    return None
+
+
+def _mirror_path(list_name: str, mirror_dir: str) -> str:
+    return os.path.join(mirror_dir, re.sub(r'[^A-Za-z0-9]+', '_', list_name).strip('_').lower() + '.json')
+
+
+def load_mirror(list_name: str, mirror_dir: str = MIRROR_DIR) -> Dict:
+    try:
+        with open(_mirror_path(list_name, mirror_dir), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_mirror(list_name: str, mirror: Dict, mirror_dir: str = MIRROR_DIR):
+    os.makedirs(mirror_dir, exist_ok=True)
+    path = _mirror_path(list_name, mirror_dir)
+    with open(f"{path}.tmp", 'w', encoding='utf-8') as f:
+        json.dump(mirror, f, default=str)
+    os.replace(f"{path}.tmp", path)
+
+
+def _fetch_items(ctx, list_name: str, modified_since: Optional[str] = None) -> List[Dict]:
+    list_obj = ctx.web.lists.get_by_title(list_name)
+    if modified_since is None:
+        items = list_obj.get_items().execute_query()
+    else:
+        # ge rather than gt: items saved in the same second as the watermark are merged again by Id
+        items = list_obj.items.filter(f"Modified ge datetime'{modified_since}'").get().execute_query()
+    return [item.properties for item in items]
+
+
+def _call_with_timeout(call: Callable, timeout: Optional[float]):
+    """Run `call` on a daemon thread and raise TimeoutError if it hasn't returned within `timeout` seconds.
+
+    office365's ClientContext doesn't take a request timeout, so a hung call is abandoned instead.
+    """
+    outcome = {}
+
+    def run():
+        try:
+            outcome['value'] = call()
+        except BaseException as e:
+            outcome['error'] = e
+
+    worker = threading.Thread(target=run, daemon=True)
+    worker.start()
+    worker.join(timeout)
+    if worker.is_alive():
+        raise TimeoutError(f"no answer within {timeout:g}s")
+    if 'error' in outcome:
+        raise outcome['error']
+    return outcome['value']
+
+
+def _latest_modified(items) -> Optional[str]:
+    modified = [item.get('Modified') for item in items if item.get('Modified')]
+    return max(modified) if modified else None
+
+
+def sync_list(connect: Callable, list_name: str = PROJECT_LIST, max_age: float = 900,
+              full_sync_hours: float = 24, mirror_dir: str = MIRROR_DIR, force_full: bool = False,
+              timeout: Optional[float] = DEFAULT_TIMEOUT) -> Dict:
+    """Bring the local mirror of a SharePoint list up to date and return it.
+
+    `connect` returns a ClientContext and is only called when the mirror is older than
+    `max_age` seconds. Otherwise only items modified since the last sync are fetched; a full
+    sync every `full_sync_hours` picks up deleted items. If SharePoint fails or takes longer
+    than `timeout` seconds to connect and answer, the existing mirror is returned so reports
+    keep running on the last good copy.
+    """
+    mirror = load_mirror(list_name, mirror_dir)
+    now = datetime.now()
+    last_sync = datetime.fromisoformat(mirror['last_sync']) if mirror.get('last_sync') else None
+    if mirror and not force_full and last_sync and (now - last_sync).total_seconds() < max_age:
+        return mirror
+
+    last_full = datetime.fromisoformat(mirror['last_full_sync']) if mirror.get('last_full_sync') else None
+    full = force_full or not mirror.get('items') or last_full is None or now - last_full > timedelta(hours=full_sync_hours)
+    def fetch():
+        ctx = connect()
+        if ctx is None:
+            raise ConnectionError("SharePoint connection failed")
+        return _fetch_items(ctx, list_name, None if full else mirror.get('modified_watermark'))
+
+    try:
+        fetched = _call_with_timeout(fetch, timeout)
+    except Exception as e:
+        if not mirror.get('items'):
+            raise
+        logging.warning(f"SharePoint sync of '{list_name}' failed ({e}); using mirror from {mirror['last_sync']}")
+        return mirror
+
+    if full:
+        items = {str(item['Id']): item for item in fetched}
+        mirror['last_full_sync'] = now.isoformat()
+    else:
+        items = mirror['items']
+        items.update({str(item['Id']): item for item in fetched})
+    mirror['items'] = items
+    mirror['modified_watermark'] = _latest_modified(items.values()) or mirror.get('modified_watermark')
+    mirror['last_sync'] = now.isoformat()
+    save_mirror(list_name, mirror, mirror_dir)
+    logging.info(f"{'Full' if full else 'Delta'} sync of '{list_name}': {len(fetched)} items fetched, {len(items)} mirrored")
+    return mirror
+
+
+def load_list(connect: Callable, list_name: str = PROJECT_LIST, **kwargs) -> pd.DataFrame:
+    """Return a SharePoint list as a DataFrame (one row per item), served from the local mirror."""
+    mirror = sync_list(connect, list_name, **kwargs)
+    return pd.DataFrame(list(mirror['items'].values()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sync the local mirror of a SharePoint list.")
+    parser.add_argument('--list', default=PROJECT_LIST)
+    parser.add_argument('--full', action='store_true', help="Re-fetch every item instead of a delta sync")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    config = configparser.ConfigParser()
+    config.read(os.path.join(SCRIPT_DIR, 'config.ini'))
+    mirror = sync_list(lambda: connect_to_sharepoint(config), args.list, max_age=0, force_full=args.full)
+    print(f"{len(mirror['items'])} items, last modified {mirror.get('modified_watermark')}")
@@ -0,0 +1,374 @@
+import os
+import json
+import time
+import uuid
+import logging
+import argparse
+import threading
+from typing import Callable, Optional
+from urllib.parse import quote, urlparse
+
+DEFAULT_CHUNK_SIZE = 10 * 2**20
+# Chunked uploads build the file under this suffix and move it over the target once complete
+STAGING_SUFFIX = '.uploading'
+
+
+class UploadError(Exception):
+    pass
+
+
+class OffsetMismatch(UploadError):
+    """The server's upload session is not at the offset we sent, e.g. after a lost ContinueUpload response."""
+
+
+def _is_offset_mismatch(error: Exception) -> bool:
+    # SharePoint answers a ContinueUpload/FinishUpload at the wrong offset (or for a finished session) with a 400
+    response = getattr(error, 'response', None)
+    return getattr(response, 'status_code', None) == 400
+
+
+def _server_relative(url: str) -> str:
+    return urlparse(url).path if url.startswith('https://') or url.startswith('http://') else url
+
+
+class Office365Transport:
+    """SharePoint upload-session calls made through an office365 ClientContext.
+
+    Sessions write to the staging file next to the target; `publish` moves it over the target.
+    """
+
+    def __init__(self, ctx, target_url: str):
+        self.ctx = ctx
+        self.target_url = target_url
+        self.staging_url = f"{target_url}{STAGING_SUFFIX}"
+
+    def _file(self):
+        return self.ctx.web.get_file_by_server_relative_url(_server_relative(self.staging_url))
+
+    def save(self, content: bytes):
+        from office365.sharepoint.files.file import File
+        File.save_binary(self.ctx, self.target_url, content)
+
+    def start(self, upload_id: str, chunk: bytes) -> int:
+        from office365.sharepoint.files.file import File
+        # StartUpload needs the file to exist, so lay down an empty staging file first
+        File.save_binary(self.ctx, self.staging_url, b'')
+        result = self._file().start_upload(upload_id, chunk)
+        self.ctx.execute_query()
+        return int(result.value)
+
+    def continue_(self, upload_id: str, offset: int, chunk: bytes) -> int:
+        result = self._file().continue_upload(upload_id, offset, chunk)
+        try:
+            self.ctx.execute_query()
+        except Exception as e:
+            if _is_offset_mismatch(e):
+                raise OffsetMismatch(str(e)) from e
+            raise
+        return int(result.value)
+
+    def finish(self, upload_id: str, offset: int, chunk: bytes):
+        self._file().finish_upload(upload_id, offset, chunk)
+        try:
+            self.ctx.execute_query()
+        except Exception as e:
+            if _is_offset_mismatch(e):
+                raise OffsetMismatch(str(e)) from e
+            raise
+
+    def cancel(self, upload_id: str):
+        self._file().cancel_upload(upload_id)
+        self.ctx.execute_query()
+
+    def publish(self):
+        # Flag 1 overwrites, so the target is replaced in one step
+        self._file().moveto(_server_relative(self.target_url), 1)
+        self.ctx.execute_query()
+
+
+class HttpTransport:
+    """The same calls over plain SharePoint REST with a requests session carrying the auth headers."""
+
+    def __init__(self, session, site_url: str, target_url: str, timeout: float = 120):
+        self.session = session
+        self.site_url = site_url.rstrip('/')
+        self.path = _server_relative(target_url)
+        self.staging_path = f"{self.path}{STAGING_SUFFIX}"
+        self.timeout = timeout
+
+    def _post(self, endpoint: str, chunk: bytes = b''):
+        response = self.session.post(f"{self.site_url}/_api/web/{endpoint}", data=chunk, timeout=self.timeout,
+                                     headers={'Accept': 'application/json;odata=nometadata'})
+        if response.status_code == 400 and ('ContinueUpload(' in endpoint or 'FinishUpload(' in endpoint):
+            raise OffsetMismatch(f"{response.status_code} from {endpoint}: {response.text[:200]}")
+        response.raise_for_status()
+        return response
+
+    def _file_endpoint(self, method: str) -> str:
+        return f"GetFileByServerRelativeUrl('{quote(self.staging_path)}')/{method}"
+
+    @staticmethod
+    def _offset(response) -> int:
+        body = response.json()
+        value = body.get('value', body.get('d', {}))
+        return int(next(iter(value.values())) if isinstance(value, dict) else value)
+
+    def _add(self, path: str, content: bytes):
+        folder, name = path.rsplit('/', 1)
+        self._post(f"GetFolderByServerRelativeUrl('{quote(folder)}')/Files/add(url='{quote(name)}',overwrite=true)", content)
+
+    def save(self, content: bytes):
+        self._add(self.path, content)
+
+    def start(self, upload_id: str, chunk: bytes) -> int:
+        self._add(self.staging_path, b'')
+        return self._offset(self._post(self._file_endpoint(f"StartUpload(uploadId=guid'{upload_id}')"), chunk))
+
+    def continue_(self, upload_id: str, offset: int, chunk: bytes) -> int:
+        return self._offset(self._post(
+            self._file_endpoint(f"ContinueUpload(uploadId=guid'{upload_id}',fileOffset={offset})"), chunk))
+
+    def finish(self, upload_id: str, offset: int, chunk: bytes):
+        self._post(self._file_endpoint(f"FinishUpload(uploadId=guid'{upload_id}',fileOffset={offset})"), chunk)
+
+    def cancel(self, upload_id: str):
+        self._post(self._file_endpoint(f"CancelUpload(uploadId=guid'{upload_id}')"))
+
+    def publish(self):
+        self._post(self._file_endpoint(f"moveto(newurl='{quote(self.path)}',flags=1)"))
+
+
+def _with_retries(call: Callable, max_retries: int, backoff: float, description: str):
+    for attempt in range(max_retries + 1):
+        try:
+            return call()
+        except OffsetMismatch:
+            # Retrying the same offset can only fail the same way; the caller restarts the session
+            raise
+        except Exception as e:
+            if attempt == max_retries:
+                raise UploadError(f"{description} failed after {max_retries + 1} attempts: {e}") from e
+            delay = backoff * 2 ** attempt
+            logging.warning(f"{description} failed ({e}); retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def _sidecar_path(local_path: str) -> str:
+    return f"{local_path}.upload.json"
+
+
+def _load_session(local_path: str, target: str) -> Optional[dict]:
+    try:
+        with open(_sidecar_path(local_path)) as f:
+            session = json.load(f)
+    except (OSError, ValueError):
+        return None
+    stat = os.stat(local_path)
+    # Only resume an upload of this exact file to this exact target
+    if (session.get('target'), session.get('size'), session.get('mtime')) != (target, stat.st_size, stat.st_mtime):
+        return None
+    return session
+
+
+def _save_session(local_path: str, session: dict):
+    with open(_sidecar_path(local_path), 'w') as f:
+        json.dump(session, f)
+
+
+def _new_session(local_path: str, target: str) -> dict:
+    stat = os.stat(local_path)
+    return {'upload_id': str(uuid.uuid4()), 'target': target, 'offset': 0,
+            'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+def upload_file_chunked(transport, local_path: str, target: str, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                        max_retries: int = 5, backoff: float = 2.0, max_restarts: int = 2) -> int:
+    """Upload a local file through a SharePoint upload session, reading it from disk one block at a time.
+
+    Each block is retried with exponential backoff. The last acknowledged offset is kept in a
+    sidecar file, so a rerun after a failure continues the same session instead of starting over.
+    SharePoint can't be asked for a session's offset, so when it rejects ours (a block landed but
+    its response was lost) the session is cancelled and the upload restarts from the beginning,
+    at most `max_restarts` times. The session builds a staging copy that only replaces the target
+    once finished, so readers never see a partial or empty file. Files no larger than one block
+    are saved in a single request. Returns the bytes uploaded.
+    """
+    size = os.path.getsize(local_path)
+    session = _load_session(local_path, target)
+    if session:
+        logging.info(f"Resuming upload of {os.path.basename(local_path)} at byte {session['offset']} of {size}")
+    else:
+        session = _new_session(local_path, target)
+
+    with open(local_path, 'rb') as f:
+        if size <= chunk_size:
+            content = f.read()
+            _with_retries(lambda: transport.save(content), max_retries, backoff, f"Upload of {target}")
+            return size
+
+        f.seek(session['offset'])
+        restarts = 0
+        while not session.get('finished'):
+            offset = session['offset']
+            chunk = f.read(chunk_size)
+            description = f"Chunk at {offset} of {target}"
+            try:
+                if offset + len(chunk) >= size:
+                    _with_retries(lambda: transport.finish(session['upload_id'], offset, chunk),
+                                  max_retries, backoff, description)
+                    # A rerun after a failed publish only needs to move the finished file
+                    session['finished'] = True
+                    _save_session(local_path, session)
+                    break
+                if offset == 0:
+                    new_offset = _with_retries(lambda: transport.start(session['upload_id'], chunk),
+                                               max_retries, backoff, description)
+                else:
+                    new_offset = _with_retries(lambda: transport.continue_(session['upload_id'], offset, chunk),
+                                               max_retries, backoff, description)
+            except OffsetMismatch as e:
+                if restarts == max_restarts:
+                    # The saved session is out of step with the server, so don't resume it next time
+                    if os.path.exists(_sidecar_path(local_path)):
+                        os.remove(_sidecar_path(local_path))
+                    raise UploadError(f"Upload session for {target} kept losing its place: {e}") from e
+                restarts += 1
+                logging.warning(f"{description} was rejected ({e}); restarting the upload session")
+                try:
+                    transport.cancel(session['upload_id'])
+                except Exception:
+                    pass
+                session = _new_session(local_path, target)
+                _save_session(local_path, session)
+                f.seek(0)
+                continue
+            if new_offset != offset + len(chunk):
+                # Trust the server's offset: it is what a resumed session will expect next
+                f.seek(new_offset)
+            session['offset'] = new_offset
+            _save_session(local_path, session)
+
+    _with_retries(transport.publish, max_retries, backoff, f"Publishing {target}")
+    if os.path.exists(_sidecar_path(local_path)):
+        os.remove(_sidecar_path(local_path))
+    return size
+
+
+def upload_to_sharepoint(ctx, target_url: str, local_path: str, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                         max_retries: int = 5, backoff: float = 2.0) -> int:
+    """Chunked, resumable upload of a local file to a SharePoint URL using an office365 ClientContext."""
+    return upload_file_chunked(Office365Transport(ctx, target_url), local_path, target_url,
+                               chunk_size, max_retries, backoff)
+
+
+def _stand_in_server(fail_every: int, lose_response_at: int = 0):
+    """Local HTTP stand-in for the SharePoint upload-session endpoints, failing every Nth request.
+
+    Request number `lose_response_at` is applied but answered with a 503, as when a response is lost.
+    Returns the server, its files and a log of (path, size) for every write to a file.
+    """
+    import re
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    files, writes, sessions, counter = {}, [], {}, {'requests': 0}
+
+    def write(name, content):
+        files[name] = content
+        writes.append((name, len(content)))
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _reply(self, status, body=None):
+            payload = json.dumps(body or {}).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_POST(self):
+            content = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            counter['requests'] += 1
+            if fail_every and counter['requests'] % fail_every == 0:
+                return self._reply(503, {'error': 'throttled'})
+            path = self.path
+            if m := re.search(r"GetFolderByServerRelativeUrl\('(.+)'\)/Files/add\(url='(.+)',overwrite=true\)", path):
+                write(f"{m.group(1)}/{m.group(2)}", content)
+                return self._reply(200)
+            if m := re.search(r"GetFileByServerRelativeUrl\('(.+)'\)/moveto\(newurl='(.+)',flags=1\)", path):
+                if m.group(1) not in files:
+                    return self._reply(404)
+                write(m.group(2), files.pop(m.group(1)))
+                return self._reply(200)
+            m = re.search(r"GetFileByServerRelativeUrl\('(.+)'\)/(\w+)\(uploadId=guid'([\w-]+)'(?:,fileOffset=(\d+))?\)", path)
+            if not m:
+                return self._reply(404)
+            name, method, upload_id, offset = m.group(1), m.group(2), m.group(3), int(m.group(4) or 0)
+            if method == 'CancelUpload':
+                sessions.pop(upload_id, None)
+                return self._reply(200)
+            if method == 'StartUpload':
+                sessions[upload_id] = bytearray(content)
+            elif upload_id not in sessions or len(sessions[upload_id]) != offset:
+                return self._reply(400, {'error': 'offset mismatch'})
+            else:
+                sessions[upload_id] += content
+            if method == 'FinishUpload':
+                write(name, bytes(sessions.pop(upload_id)))
+            if counter['requests'] == lose_response_at:
+                return self._reply(503, {'error': 'gateway timeout'})
+            if method == 'FinishUpload':
+                return self._reply(200)
+            return self._reply(200, {'value': str(len(sessions[upload_id]))})
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, files, writes
+
+
+def self_test(size_mb: float = 25, chunk_mb: float = 4, fail_every: int = 3, lose_response_at: int = 5) -> dict:
+    """Upload a random file through the local stand-in with injected failures and a lost response.
+
+    Checks the bytes match and that the previously published file was only ever replaced whole.
+    """
+    import tempfile
+    import requests
+
+    server, files, writes = _stand_in_server(fail_every, lose_response_at)
+    site_url = f"http://127.0.0.1:{server.server_address[1]}"
+    target = '/sites/test/Shared Documents/extract.parquet'
+    files[quote(target)] = b'yesterday'
+    with tempfile.NamedTemporaryFile(delete=False) as f:
+        f.write(os.urandom(int(size_mb * 2**20)))
+        local_path = f.name
+    try:
+        start = time.perf_counter()
+        transport = HttpTransport(requests.Session(), site_url, target)
+        upload_file_chunked(transport, local_path, target, int(chunk_mb * 2**20), max_retries=3, backoff=0.01)
+        with open(local_path, 'rb') as f:
+            matches = files.get(quote(target)) == f.read()
+        target_writes = [size for name, size in writes if name == quote(target)]
+        return {'bytes': os.path.getsize(local_path), 'seconds': round(time.perf_counter() - start, 2),
+                'matches': matches, 'sidecar_left': os.path.exists(_sidecar_path(local_path)),
+                'target_writes': len(target_writes),
+                'target_only_replaced_whole': target_writes == [os.path.getsize(local_path)],
+                'staging_left': quote(target + STAGING_SUFFIX) in files}
+    finally:
+        server.shutdown()
+        os.remove(local_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chunked, resumable SharePoint uploads.")
+    parser.add_argument('--self-test', action='store_true', help="Upload through a local HTTP stand-in with injected failures")
+    parser.add_argument('--size-mb', type=float, default=25)
+    parser.add_argument('--chunk-mb', type=float, default=4)
+    args = parser.parse_args()
+
+    if args.self_test:
+        logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+        print(self_test(args.size_mb, args.chunk_mb))
+    else:
+        parser.print_help()
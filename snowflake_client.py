@@ -0,0 +1,408 @@
+import os
+import time
+import atexit
+import logging
+import argparse
+import threading
+import configparser
+import tracemalloc
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, Optional, Sequence, Tuple, Union
+
+import pandas as pd
+import pyarrow as pa
+
+from query_cache import get_cache, max_age_for
+
+try:
+    import snowflake.connector
+    from snowflake.connector.errors import NotSupportedError
+except ImportError:  # the benchmark runs without the connector installed
+    NotSupportedError = Exception
+
+SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
+CONFIG_PATH = os.path.join(SCRIPT_DIR, 'config.ini')
+
+
+def load_config(config_path: Union[str, os.PathLike] = CONFIG_PATH) -> configparser.ConfigParser:
+    """Load configuration from the specified path."""
+    config = configparser.ConfigParser()
+    config.read(config_path)
+    return config
+
+
+def connect_to_snowflake(config: configparser.ConfigParser):
+    """Open a new Snowflake session. Pipelines should borrow from the pool instead."""
+    return snowflake.connector.connect(
+        user=config.get("snowflake", "user", fallback=os.getenv("SNOWFLAKE_USER")),
+        password=config.get("snowflake", "password", fallback=os.getenv("SNOWFLAKE_PASSWORD")),
+        account=config.get("snowflake", "account", fallback=os.getenv("SNOWFLAKE_ACCOUNT")),
+        warehouse=config.get("snowflake", "warehouse", fallback=os.getenv("SNOWFLAKE_WAREHOUSE")),
+        schema=config.get("snowflake", "schema", fallback=os.getenv("SNOWFLAKE_SCHEMA")),
+        role=config.get("snowflake", "role", fallback=os.getenv("SNOWFLAKE_ROLE")),
+        # Server-side binding keeps query text stable across runs (see query_builder)
+        paramstyle='qmark')
+
+
+class SnowflakeConnectionPool:
+    """Thread-safe pool of Snowflake sessions with idle eviction and a health check on borrow."""
+
+    def __init__(self, connect: Callable, max_size: int = 4, idle_timeout: float = 900,
+                 health_check_interval: float = 300):
+        self._connect = connect
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self._idle = []  # (connection, returned_at), most recently returned last
+        self._in_use = 0
+        self._lock = threading.Condition()
+        self.connects = 0
+        self.borrows = 0
+
+    def _is_healthy(self, conn, idle_for: float) -> bool:
+        if conn.is_closed():
+            return False
+        if idle_for < self.health_check_interval:
+            return True
+        try:
+            conn.cursor().execute("SELECT 1").fetchone()
+            return True
+        except Exception as e:
+            logging.warning(f"Discarding unhealthy Snowflake session: {e}")
+            return False
+
+    def _evict_idle(self, now: float):
+        expired = [conn for conn, returned_at in self._idle if now - returned_at > self.idle_timeout]
+        self._idle = [(conn, returned_at) for conn, returned_at in self._idle if now - returned_at <= self.idle_timeout]
+        for conn in expired:
+            self._close(conn)
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _reserve(self, deadline: Optional[float], timeout: Optional[float]):
+        """Claim a slot, returning an idle (session, idle seconds) to check or (None, None) to connect."""
+        with self._lock:
+            while True:
+                now = time.monotonic()
+                self._evict_idle(now)
+                if self._idle or self._in_use < self.max_size:
+                    self._in_use += 1
+                    if self._idle:
+                        conn, returned_at = self._idle.pop()
+                        return conn, now - returned_at
+                    return None, None
+                remaining = None if deadline is None else deadline - now
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError(f"No Snowflake session available within {timeout}s (max_size={self.max_size})")
+                self._lock.wait(remaining)
+
+    def _give_up_slot(self):
+        with self._lock:
+            self._in_use -= 1
+            self._lock.notify()
+
+    def acquire(self, timeout: Optional[float] = None):
+        """Borrow a session, reusing a warm one when available."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            conn, idle_for = self._reserve(deadline, timeout)
+            if conn is None:
+                break
+            # Health check outside the lock so a slow SELECT 1 doesn't block other borrowers
+            if self._is_healthy(conn, idle_for):
+                with self._lock:
+                    self.borrows += 1
+                return conn
+            self._close(conn)
+            self._give_up_slot()
+
+        # Connect outside the lock so a slow handshake doesn't block other borrowers
+        try:
+            conn = self._connect()
+        except Exception:
+            self._give_up_slot()
+            raise
+        with self._lock:
+            self.connects += 1
+            self.borrows += 1
+        return conn
+
+    def release(self, conn):
+        """Return a borrowed session to the pool."""
+        with self._lock:
+            self._in_use -= 1
+            if not conn.is_closed():
+                self._idle.append((conn, time.monotonic()))
+            self._lock.notify()
+
+    @contextmanager
+    def connection(self, timeout: Optional[float] = None):
+        conn = self.acquire(timeout)
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close_all(self):
+        with self._lock:
+            for conn, _ in self._idle:
+                self._close(conn)
+            self._idle = []
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool(config: Optional[configparser.ConfigParser] = None) -> SnowflakeConnectionPool:
+    """Return the process-wide pool, configuring it from config.ini on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            config = config or load_config()
+            _pool = SnowflakeConnectionPool(
+                lambda: connect_to_snowflake(config),
+                max_size=config.getint("snowflake_pool", "max_size", fallback=4),
+                idle_timeout=config.getfloat("snowflake_pool", "idle_timeout", fallback=900),
+                health_check_interval=config.getfloat("snowflake_pool", "health_check_interval", fallback=300))
+            atexit.register(_shutdown_pool)
+        return _pool
+
+
+def _shutdown_pool():
+    if _pool is not None:
+        logging.info(f"Snowflake pool: {_pool.connects} connects for {_pool.borrows} borrows")
+        _pool.close_all()
+
+
+@contextmanager
+def pooled_connection(config: Optional[configparser.ConfigParser] = None):
+    """Borrow a Snowflake session from the process-wide pool for the duration of a block."""
+    with get_pool(config).connection() as conn:
+        yield conn
+
+def read_sql_file(sql_file_path: Union[str, os.PathLike]) -> str:
+    """Read a SQL script from disk."""
+    with open(sql_file_path, 'r') as file:
+        return file.read()
+
+
+def _as_cursor(source):
+    """Accept either a SnowflakeConnection or a SnowflakeCursor and return a cursor."""
+    return source.cursor() if hasattr(source, 'cursor') else source
+
+
+def _column_names(cursor) -> list:
+    return [column[0] for column in cursor.description]
+
+
+def iter_arrow_batches(source, query: str, params: Optional[Sequence] = None) -> Iterator[pa.Table]:
+    """Execute a query and yield the result as Arrow record batches as they are downloaded."""
+    cursor = _as_cursor(source)
+    cursor.execute(query, params)
+    try:
+        yield from cursor.fetch_arrow_batches()
+    except NotSupportedError:
+        # SHOW/DESCRIBE and some metadata queries are only available as JSON rows
+        rows = cursor.fetchall()
+        yield pa.Table.from_pandas(pd.DataFrame(rows, columns=_column_names(cursor)), preserve_index=False)
+
+
+def _fetch_dataframe(source, query: str, params: Optional[Sequence] = None) -> pd.DataFrame:
+    cursor = _as_cursor(source)
+    batches = list(iter_arrow_batches(cursor, query, params))
+    if not batches:
+        return pd.DataFrame(columns=_column_names(cursor))
+    table = pa.concat_tables(batches)
+    del batches
+    # split_blocks/self_destruct release Arrow buffers column by column while converting
+    return table.to_pandas(split_blocks=True, self_destruct=True)
+
+
+def fetch_dataframe(source, query: str, params: Optional[Sequence] = None,
+                    max_age: Optional[float] = None) -> pd.DataFrame:
+    """Execute a query and return a typed DataFrame built from the connector's Arrow batches.
+
+    With `max_age` (seconds) the result is served from the local query cache while fresh.
+    """
+    if not max_age:
+        return _fetch_dataframe(source, query, params)
+    return get_cache(load_config()).get_or_fetch(query, params, max_age, lambda: _fetch_dataframe(source, query, params))
+
+
+def execute_query_file(source, sql_file_path: Union[str, os.PathLike], params: Optional[Sequence] = None,
+                       max_age: Optional[float] = None) -> pd.DataFrame:
+    """Execute a Snowflake query from a file and return the results as a DataFrame."""
+    max_age = max_age_for(os.path.basename(sql_file_path), max_age, load_config())
+    return fetch_dataframe(source, read_sql_file(sql_file_path), params, max_age)
+
+
+def query_file(sql_file_path: Union[str, os.PathLike], params: Optional[Sequence] = None,
+               max_age: Optional[float] = None, config: Optional[configparser.ConfigParser] = None,
+               refresh: Optional[bool] = None) -> pd.DataFrame:
+    """Run a query file, borrowing a pooled session only when the cached result is missing or stale.
+
+    `refresh=True` re-runs the query and replaces the cached result; by default QUERY_CACHE_REFRESH decides.
+    """
+    config = config or load_config()
+    query = read_sql_file(sql_file_path)
+    max_age = max_age_for(os.path.basename(sql_file_path), max_age, config)
+
+    def fetch():
+        with pooled_connection(config) as conn:
+            return _fetch_dataframe(conn, query, params)
+
+    if not max_age:
+        return fetch()
+    return get_cache(config).get_or_fetch(query, params, max_age, fetch, refresh)
+
+
+def _arrow_result_to_dataframe(cursor) -> pd.DataFrame:
+    batches = list(cursor.fetch_arrow_batches())
+    if not batches:
+        return pd.DataFrame(columns=_column_names(cursor))
+    return pa.concat_tables(batches).to_pandas(split_blocks=True, self_destruct=True)
+
+
+def _cancel_queries(conn, query_ids: Sequence[str]):
+    """Best-effort SYSTEM$CANCEL_QUERY for queries that would otherwise keep running."""
+    for query_id in query_ids:
+        try:
+            conn.cursor().execute("SELECT SYSTEM$CANCEL_QUERY(?)", [query_id])
+        except Exception as e:
+            logging.warning(f"Could not cancel query {query_id}: {e}")
+
+
+def run_queries_async(conn, queries: Dict[str, Union[str, Tuple[str, Optional[Sequence]]]],
+                      poll_interval: float = 0.5) -> Tuple[Dict[str, pd.DataFrame], Dict[str, float]]:
+    """Submit independent queries with execute_async on one session and join their results.
+
+    `queries` maps a name to SQL text or a (sql, params) tuple. Returns the result frames and
+    each query's client-observed elapsed time in seconds: from submission until a status poll
+    saw it finish, so up to `poll_interval` later than the server did. If any query fails, the
+    ones still running are cancelled before the error is re-raised.
+    """
+    submitted = {}
+    for name, query in queries.items():
+        sql, params = query if isinstance(query, tuple) else (query, None)
+        cursor = conn.cursor()
+        cursor.execute_async(sql, params)
+        submitted[name] = (cursor, cursor.sfqid, time.perf_counter())
+
+    timings = {}
+    pending = set(submitted)
+    try:
+        while pending:
+            for name in list(pending):
+                _, query_id, submitted_at = submitted[name]
+                # Raises ProgrammingError as soon as one of the queries fails
+                if not conn.is_still_running(conn.get_query_status_throw_if_error(query_id)):
+                    timings[name] = time.perf_counter() - submitted_at
+                    pending.discard(name)
+            if pending:
+                time.sleep(poll_interval)
+    except Exception:
+        _cancel_queries(conn, [submitted[name][1] for name in pending])
+        raise
+
+    results = {}
+    for name, (cursor, query_id, _) in submitted.items():
+        cursor.get_results_from_sfqid(query_id)
+        results[name] = _arrow_result_to_dataframe(cursor)
+    return results, timings
+
+
+def format_query_timings(timings: Dict[str, float], total: float) -> str:
+    """Summarise per-query elapsed times (as seen by the client) next to the overall wall-clock time."""
+    lines = [f"  {name}: {seconds:.2f}s" for name, seconds in sorted(timings.items(), key=lambda item: -item[1])]
+    lines.append(f"Wall clock {total:.2f}s vs {sum(timings.values()):.2f}s if run one after another")
+    return "\n".join(lines)
+
+
+class _SyntheticCursor:
+    """Stand-in cursor serving the same synthetic result through both fetch paths."""
+
+    def __init__(self, table: pa.Table, batch_rows: int = 100_000):
+        self._table = table
+        self._batch_rows = batch_rows
+        self.description = [(name,) for name in table.column_names]
+
+    def execute(self, query, params=None):
+        return self
+
+    def fetchall(self):
+        return list(zip(*(column.to_pylist() for column in self._table.columns)))
+
+    def fetch_arrow_batches(self):
+        for offset in range(0, self._table.num_rows, self._batch_rows):
+            yield self._table.slice(offset, self._batch_rows)
+
+
+def _synthetic_referral_table(rows: int) -> pa.Table:
+    """Build a wide-ish result shaped like the rh.sql referral-detail extract."""
+    import numpy as np
+
+    rng = np.random.default_rng(42)
+    protocols = np.array([f"PROTOCOL-{i:03d}" for i in range(200)])
+    return pa.table({
+        'REFRL_ID': np.arange(rows, dtype='int64'),
+        'PROTOCOL': protocols[rng.integers(0, len(protocols), rows)],
+        'REF_DATE': pd.Timestamp('2024-01-01') + pd.to_timedelta(rng.integers(0, 365, rows), unit='D'),
+        'UTM_SOURCE': np.array(['fb', 'google', 'hmn', 'IQVIAmedia'])[rng.integers(0, 4, rows)],
+        'SITE_NUMBER': rng.integers(1000, 9999, rows),
+        'REFERRALS': rng.integers(0, 2, rows),
+        'FIRST_OFFICE_VISIT': rng.integers(0, 2, rows),
+        'CONSENTED': rng.integers(0, 2, rows),
+        'COSTS': rng.random(rows) * 100,
+    })
+
+
+def _tuple_path(cursor, query):
+    cursor.execute(query)
+    results = cursor.fetchall()
+    return pd.DataFrame(results, columns=_column_names(cursor))
+
+
+def benchmark(rows: int = 1_000_000) -> pd.DataFrame:
+    """Compare the legacy fetchall/tuple path against the Arrow batch path on a synthetic result."""
+    cursor = _SyntheticCursor(_synthetic_referral_table(rows))
+    timings = []
+    for name, fetch in [('fetchall -> tuples', _tuple_path), ('arrow batches', fetch_dataframe)]:
+        start = time.perf_counter()
+        df = fetch(cursor, 'SELECT 1')
+        elapsed = time.perf_counter() - start
+        del df
+
+        # Second pass for memory: tracemalloc slows the tuple path down considerably
+        arrow_baseline = pa.total_allocated_bytes()
+        tracemalloc.start()
+        df = fetch(cursor, 'SELECT 1')
+        _, python_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        timings.append({
+            'path': name,
+            'rows': len(df),
+            'seconds': round(elapsed, 3),
+            'python_peak_mb': round(python_peak / 2**20, 1),
+            'arrow_retained_mb': round((pa.total_allocated_bytes() - arrow_baseline) / 2**20, 1),
+            'frame_mb': round(df.memory_usage(deep=True).sum() / 2**20, 1),
+        })
+        del df
+    return pd.DataFrame(timings)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Shared Snowflake data-access helpers.")
+    parser.add_argument('--benchmark', action='store_true', help="Run the fetch-path benchmark on synthetic data")
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    if args.benchmark:
+        print(benchmark(args.rows).to_string(index=False))
+    else:
+        parser.print_help()